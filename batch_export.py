@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""@package batch_export
+Export many Excel and Word documents in one run. Documents are given as paths, directories
+(walked recursively) or a newline separated list on stdin, and are processed in parallel
+over one shared pool of soffice instances. One JSON record is written to stdout per document
+as soon as it is done:
+
+{"file": "...", "type": "xlsm", "status": "ok", "seconds": 0.12, "stats": ..., "result": ...}
+{"file": "...", "type": "doc", "status": "error", "seconds": 3.4, "error": "..."}
+{"file": "...", "type": "other", "status": "skipped", "seconds": 0.0}
+
+Excel results are lists of sheets (see excel.book_to_json()) and Word results are
+{"text", "tables", "metadata"} dicts (see export_doc_text.export_word_all()). stats gives
+the time spent in each stage of the extraction (see pipeline_stats). A failing
+document only fails its own record. A document that makes soffice hang or run over the
+time or memory limits (see limits) gets its soffice killed and restarted, and is recorded
+as an error while the rest of the batch keeps going.
+
+This is Python 3.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import threading
+import argparse
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import docx_reader
+import excel
+import filetype
+import pipeline_stats
+import sheet_filter
+
+verbose = False
+
+# Number of documents queued per worker thread.
+QUEUE_DEPTH_PER_WORKER = 4
+
+###################################################################################################
+def iter_paths(args, stdin=None):
+    """
+    Walk the documents to process.
+
+    @param args (list) File and directory names. "-" reads names from stdin.
+
+    @param stdin (file) Where to read names from for "-". Defaults to sys.stdin.
+
+    @return (generator) The file names. Directories are walked recursively, in name order.
+    """
+    if (stdin is None):
+        stdin = sys.stdin
+    for arg in args:
+        if (arg == "-"):
+            for line in stdin:
+                line = line.rstrip("\r\n")
+                if (len(line) > 0):
+                    for path in iter_paths([line]):
+                        yield path
+        elif os.path.isdir(arg):
+            for root, dirs, files in os.walk(arg):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield arg
+
+###################################################################################################
+class SharedBackend(object):
+    """
+    Pool of soffice instances shared by all the documents of a batch. soffice is only
+    started when the first document that needs LibreOffice comes along. If it fails to
+    start it is not tried again, the rest of the documents that need LibreOffice fail
+    right away.
+    """
+
+    def __init__(self, size, base_port=None, timeout=None, max_memory=None):
+        self.size = size
+        self.base_port = base_port
+        self.timeout = timeout
+        self.max_memory = max_memory
+        self.pool = None
+        self.started = False
+        self.start_error = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+
+        # Import the pool here so batches that are read natively don't need unotools.
+        import office_pool
+        import soffice
+        if verbose:
+            office_pool.verbose = True
+            soffice.verbose = True
+        if (self.pool is None):
+            self.pool = office_pool.WorkerPool(self.size, base_port=self.base_port,
+                                               timeout=self.timeout, max_memory=self.max_memory)
+        self.pool.start()
+
+    def run(self, req, stats=None):
+        """
+        Run a conversion request on the pool, starting it if needed.
+
+        @param req (dict) The request. See office_pool.run_request().
+
+        @param stats (PipelineStats) Where to record the conversion stages.
+
+        @return (any) The result of the conversion.
+        """
+        with self.lock:
+            if (self.start_error is not None):
+                raise Exception("LibreOffice is not available. " + self.start_error)
+            if (not self.started):
+                try:
+                    self._start()
+                except Exception as e:
+                    self.start_error = "Starting soffice failed. " + str(e)
+                    raise
+                self.started = True
+        return self.pool.run(req, stats)
+
+    def export_sheets(self, data, stats=None, sheet_filter=None):
+        req = {"op" : "excel_sheets", "data" : data}
+        if (sheet_filter is not None):
+            req["filter"] = sheet_filter.to_dict()
+        return self.run(req, stats)
+
+    def export_word(self, data, stats=None):
+        return self.run({"op" : "word_all", "data" : data}, stats)
+
+    def stop(self):
+        with self.lock:
+            if self.started:
+                self.pool.stop()
+                self.started = False
+
+###################################################################################################
+def export_document(path, backend, sheet_filter=None):
+    """
+    Export a single document.
+
+    @param path (str) The name of the document.
+
+    @param backend (SharedBackend) The soffice pool to use if LibreOffice is needed.
+
+    @param sheet_filter (SheetFilter) Which sheets of Excel files to read and how much of
+    each. See sheet_filter.
+
+    @return (dict) The JSON record of the document.
+    """
+    start = time.time()
+    r = {
+        "file" : path,
+        "type" : None,
+        "status" : "ok",
+    }
+    stats = None
+    try:
+        if (not os.path.isfile(path)):
+            raise IOError("No such file.")
+        file_type = filetype.get_file_type(path, False)
+        r["type"] = file_type
+        if (file_type in filetype.EXCEL_TYPES):
+            f = open(path, 'rb')
+            data = f.read()
+            f.close()
+
+            # Keep the LibreOffice error (like a killed soffice) to report it.
+            stats = pipeline_stats.PipelineStats()
+            errors = []
+            def export_sheets(data, sheet_filter=None):
+                try:
+                    return backend.export_sheets(data, stats, sheet_filter)
+                except Exception as e:
+                    errors.append(e)
+                    raise
+            book = excel.load_excel_libreoffice(data, export_sheets=export_sheets, stats=stats,
+                                                sheet_filter=sheet_filter)
+            if (book is None):
+                if (len(errors) > 0):
+                    raise errors[0]
+                raise Exception("Reading the workbook failed.")
+            r["result"] = excel.book_to_json(book)
+        elif (file_type in filetype.WORD_TYPES):
+
+            stats = pipeline_stats.PipelineStats()
+            def export_word(data):
+                return backend.export_word(data, stats)
+            result = docx_reader.load_word(path, export_word, stats)
+            if (result is None):
+                raise Exception("Reading the document failed.")
+            r["result"] = result
+        else:
+            r["status"] = "skipped"
+    except Exception as e:
+        r["status"] = "error"
+        r["error"] = str(e)
+    r["seconds"] = round(time.time() - start, 3)
+    if (stats is not None):
+        r["stats"] = stats.to_dict()
+    return r
+
+###################################################################################################
+def run_batch(paths, out=None, workers=None, base_port=None, timeout=None,
+              max_memory=None, sheet_filter=None):
+    """
+    Export a batch of documents, writing one JSON line per document as each one finishes.
+
+    @param paths (iterable) The names of the documents.
+
+    @param out (file) Where to write the JSON lines. Defaults to sys.stdout.
+
+    @param workers (int) The number of documents processed at once, which is also the
+    number of soffice instances. Defaults to the number of CPUs.
+
+    @param base_port (int) The port of the 1st soffice instance, the others use the following
+    ports. Each instance uses a free port if None.
+
+    @param timeout (float) Seconds allowed per document before its soffice is killed.
+    Defaults to limits.DOC_TIMEOUT.
+
+    @param max_memory (int) Bytes of memory soffice may use per document. Defaults to
+    limits.MAX_MEMORY.
+
+    @param sheet_filter (SheetFilter) Which sheets of Excel files to read and how much of
+    each. See sheet_filter.
+
+    @return (dict) The number of documents per status.
+    """
+    if (out is None):
+        out = sys.stdout
+    if (workers is None):
+        workers = os.cpu_count() or 1
+    backend = SharedBackend(workers, base_port, timeout, max_memory)
+    todo = queue.Queue(maxsize=workers * QUEUE_DEPTH_PER_WORKER)
+    out_lock = threading.Lock()
+    counts = {}
+
+    def work():
+        while True:
+            path = todo.get()
+            if (path is None):
+                break
+            record = export_document(path, backend, sheet_filter)
+            line = json.dumps(record)
+            with out_lock:
+                out.write(line + "\n")
+                out.flush()
+                counts[record["status"]] = counts.get(record["status"], 0) + 1
+            if (verbose and (record["status"] == "error")):
+                print("FAILED " + path + ": " + record["error"], file=sys.stderr)
+
+    threads = [threading.Thread(target=work) for _ in range(0, workers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    try:
+        for path in paths:
+            todo.put(path)
+    finally:
+        for _ in threads:
+            todo.put(None)
+        for t in threads:
+            t.join()
+        backend.stop()
+    return counts
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="export the sheets of Excel files and the text, "
+                                                     "tables and metadata of Word files as JSON lines")
+    arg_parser.add_argument("paths", nargs="*", default=["-"],
+                            help="files or directories to export, '-' (the default) reads file "
+                                 "names from stdin")
+    arg_parser.add_argument("-w", "--workers", action="store", type=int, default=None,
+                            help="number of documents exported at once (default: number of CPUs)")
+    arg_parser.add_argument("-p", "--base-port", action="store", type=int, default=None,
+                            help="port of the 1st soffice instance, the others use the following "
+                                 "ports (default: a free port per instance)")
+    arg_parser.add_argument("-t", "--timeout", action="store", type=float, default=None,
+                            help="seconds allowed per document before its soffice is killed "
+                                 "(default: $OFFICE_DUMPER_TIMEOUT or 120, 0 for no limit)")
+    arg_parser.add_argument("-m", "--max-memory", action="store", type=int, default=None,
+                            help="bytes of memory soffice may use per document before it is killed "
+                                 "(default: $OFFICE_DUMPER_MAX_MEMORY or 2GB, 0 for no limit)")
+    arg_parser.add_argument("-v", "--verbose", action="store_true",
+                            help="print debug information to stderr")
+    sheet_filter.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    verbose = args.verbose
+
+    # The readers print their warnings to stdout, so keep stdout for the JSON lines only.
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    counts = run_batch(iter_paths(args.paths), out=out, workers=args.workers,
+                       base_port=args.base_port, timeout=args.timeout,
+                       max_memory=args.max_memory, sheet_filter=sheet_filter.from_args(args))
+    if verbose:
+        print("DONE. " + json.dumps(counts), file=sys.stderr)
@@ -0,0 +1,408 @@
+"""@package bench_corpus
+Generate a reproducible synthetic corpus of Office documents for benchmarking, without
+LibreOffice or any Office library. The same scale and seed always give byte for byte the
+same files.
+
+Excel workbooks are written both as .xls (BIFF8 in an OLE2 container) and .xlsx. Each
+workbook also gets one CSV file per sheet, as LibreOffice would export it.
+"""
+
+from __future__ import print_function
+
+import os
+import io
+import csv
+import random
+import struct
+import zipfile
+
+# OLE2 layout.
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+SECTOR_SIZE = 512
+MINI_STREAM_CUTOFF = 4096
+ENDOFCHAIN = 0xFFFFFFFE
+FATSECT = 0xFFFFFFFD
+FREESECT = 0xFFFFFFFF
+NOSTREAM = 0xFFFFFFFF
+
+# BIFF8 records.
+RT_EOF = 0x000A
+RT_BOUNDSHEET = 0x0085
+RT_NUMBER = 0x0203
+RT_LABEL = 0x0204
+RT_BOF = 0x0809
+BIFF8_VERSION = 0x0600
+BOF_GLOBALS = 0x0005
+BOF_WORKSHEET = 0x0010
+MAX_RECORD_SIZE = 8224
+
+# BOUNDSHEET sheet states.
+SHEET_STATES = {
+    "visible" : 0,
+    "hidden" : 1,
+    "veryHidden" : 2,
+}
+
+# Namespaces and relationship types of the OOXML parts written here.
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_WORD = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+REL_OFFICE_DOCUMENT = NS_REL + "/officeDocument"
+REL_WORKSHEET = NS_REL + "/worksheet"
+REL_SHARED_STRINGS = NS_REL + "/sharedStrings"
+CT_WORKBOOK = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"
+CT_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CT_SHARED_STRINGS = "application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"
+CT_DOCUMENT = "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"
+
+####################################################################
+class SheetSpec(object):
+    """
+    A sheet to generate.
+    """
+
+    def __init__(self, name, rows, state="visible"):
+        """
+        @param name (str) The sheet name.
+
+        @param rows (list) The rows of the sheet. Each row is a list of cell values (str or
+        float), starting at column A. Empty strings are empty cells.
+
+        @param state (str) "visible", "hidden" or "veryHidden".
+        """
+        self.name = name
+        self.rows = rows
+        self.state = state
+
+####################################################################
+def _words(rng, n):
+    return " ".join(["w" + str(rng.randint(0, 9999)) for _ in range(0, n)])
+
+def _value(rng, row, col):
+    """
+    A cell value, mixing numbers and short strings.
+    """
+    if ((row + col) % 3 == 0):
+        return float(rng.randint(-100000, 100000)) / 100
+    return "r" + str(row) + "c" + str(col) + " " + _words(rng, 2)
+
+def _grid(rng, nrows, ncols):
+    return [[_value(rng, row, col) for col in range(0, ncols)] for row in range(0, nrows)]
+
+def _long_quoted(rng, length):
+    """
+    A long cell with the characters that need quoting in CSV.
+    """
+    parts = []
+    size = 0
+    while (size < length):
+        part = rng.choice(['say "hi"', "a,b,c", "line\nbreak", '""', _words(rng, 3)])
+        parts.append(part)
+        size += len(part) + 1
+    return " ".join(parts)[:length]
+
+####################################################################
+def excel_cases(scale=1, seed=1):
+    """
+    The workbooks of the corpus.
+
+    @param scale (int) Multiplies the size of every workbook.
+
+    @param seed (int) Seed of the cell values.
+
+    @return (list) (name, list of SheetSpec) tuples.
+    """
+    rng = random.Random(seed)
+    cases = []
+    cases.append(("many_sheets", [SheetSpec("Sheet" + str(i), _grid(rng, 10, 5))
+                                  for i in range(0, 100 * scale)]))
+    cases.append(("wide", [SheetSpec("Wide", _grid(rng, 20 * scale, 250))]))
+    cases.append(("tall", [SheetSpec("Tall", _grid(rng, 10000 * scale, 4))]))
+    cases.append(("hidden", [SheetSpec("Visible", _grid(rng, 50, 10)),
+                             SheetSpec("Hidden", _grid(rng, 50, 10), "hidden"),
+                             SheetSpec("VeryHidden", _grid(rng, 50 * scale, 10), "veryHidden")]))
+    cases.append(("long_quoted", [SheetSpec("Quoted", [[_long_quoted(rng, 4000) for _ in range(0, 5)]
+                                                       for _ in range(0, 40 * scale)])]))
+    return cases
+
+def word_cases(scale=1, seed=1):
+    """
+    The Word documents of the corpus.
+
+    @return (list) (name, paragraphs, tables) tuples. tables are lists of 2D lists of cell
+    text.
+    """
+    rng = random.Random(seed)
+    paragraphs = [_words(rng, 20) for _ in range(0, 200 * scale)]
+    tables = [[[_words(rng, 3) for _ in range(0, 5)] for _ in range(0, 5)]
+              for _ in range(0, 200 * scale)]
+    return [("many_tables", paragraphs, tables)]
+
+####################################################################
+def make_ole(streams):
+    """
+    Write an OLE2 compound file.
+
+    @param streams (list) (name, data) tuples of the root storage streams. Streams are
+    padded up to MINI_STREAM_CUTOFF bytes so no mini stream is needed.
+
+    @return (bytes) The OLE file.
+    """
+    sectors = []
+    fat = []
+
+    def alloc(data):
+        num = max(1, (len(data) + SECTOR_SIZE - 1) // SECTOR_SIZE)
+        start = len(sectors)
+        for i in range(0, num):
+            sectors.append(data[i * SECTOR_SIZE : (i + 1) * SECTOR_SIZE].ljust(SECTOR_SIZE, b"\0"))
+            fat.append(start + i + 1 if (i < num - 1) else ENDOFCHAIN)
+        return start
+
+    def dir_entry(name, entry_type, right, child, start, size):
+        name = name.encode("utf-16-le") + b"\0\0"
+        return name.ljust(64, b"\0") + struct.pack("<HBB", len(name), entry_type, 1) + \
+            struct.pack("<III", NOSTREAM, right, child) + b"\0" * 36 + \
+            struct.pack("<IQ", start, size)
+
+    # Stream contents, then the directory. The streams are chained as right siblings.
+    entries = []
+    for name, data in streams:
+        data = data.ljust(MINI_STREAM_CUTOFF, b"\0")
+        entries.append((name, alloc(data), len(data)))
+    directory = dir_entry("Root Entry", 5, NOSTREAM, 1 if entries else NOSTREAM, ENDOFCHAIN, 0)
+    for i, (name, start, size) in enumerate(entries):
+        right = i + 2 if (i + 1 < len(entries)) else NOSTREAM
+        directory += dir_entry(name, 2, right, NOSTREAM, start, size)
+    while ((len(directory) % SECTOR_SIZE) != 0):
+        directory += dir_entry("", 0, NOSTREAM, NOSTREAM, FREESECT, 0)
+    dir_start = alloc(directory)
+
+    # The FAT, which also covers its own sectors.
+    num_fat = 1
+    while ((len(fat) + num_fat) * 4 > num_fat * SECTOR_SIZE):
+        num_fat += 1
+    if (num_fat > 109):
+        raise ValueError("OLE file too big for a header-only DIFAT.")
+    fat_start = len(sectors)
+    fat.extend([FATSECT] * num_fat)
+    fat_data = b"".join([struct.pack("<I", x) for x in fat]).ljust(num_fat * SECTOR_SIZE, b"\xff")
+    for i in range(0, num_fat):
+        sectors.append(fat_data[i * SECTOR_SIZE : (i + 1) * SECTOR_SIZE])
+
+    header = OLE_MAGIC + b"\0" * 16 + struct.pack("<HHHHH", 0x3E, 3, 0xFFFE, 9, 6) + b"\0" * 6
+    header += struct.pack("<IIIIIIIII", 0, num_fat, dir_start, 0, MINI_STREAM_CUTOFF,
+                          ENDOFCHAIN, 0, ENDOFCHAIN, 0)
+    header += b"".join([struct.pack("<I", fat_start + i) for i in range(0, num_fat)])
+    header += b"\xff\xff\xff\xff" * (109 - num_fat)
+    return header + b"".join(sectors)
+
+####################################################################
+def _record(rtype, data):
+    if (len(data) > MAX_RECORD_SIZE):
+        raise ValueError("BIFF record too long.")
+    return struct.pack("<HH", rtype, len(data)) + data
+
+def _bof(substream_type):
+    return _record(RT_BOF, struct.pack("<HH", BIFF8_VERSION, substream_type) + b"\0" * 12)
+
+def _boundsheet(sheet, pos):
+    name = sheet.name.encode("latin-1")
+    return _record(RT_BOUNDSHEET, struct.pack("<IBBBB", pos, SHEET_STATES[sheet.state], 0,
+                                              len(name), 0) + name)
+
+def _sheet_substream(sheet):
+    records = [_bof(BOF_WORKSHEET)]
+    for row, cells in enumerate(sheet.rows):
+        for col, val in enumerate(cells):
+            if isinstance(val, float):
+                records.append(_record(RT_NUMBER, struct.pack("<HHHd", row, col, 0, val)))
+            elif (len(val) > 0):
+                text = val.encode("latin-1")
+                records.append(_record(RT_LABEL, struct.pack("<HHHHB", row, col, 0, len(text), 0) + text))
+    records.append(_record(RT_EOF, b""))
+    return b"".join(records)
+
+def make_xls(sheets):
+    """
+    Write a BIFF8 .xls workbook with only cell values (LABEL and NUMBER records).
+
+    @param sheets (list) The SheetSpec objects of the sheets.
+
+    @return (bytes) The .xls file.
+    """
+    bodies = [_sheet_substream(sheet) for sheet in sheets]
+    globals_size = len(_bof(BOF_GLOBALS)) + len(_record(RT_EOF, b"")) + \
+        sum([len(_boundsheet(sheet, 0)) for sheet in sheets])
+    pos = globals_size
+    workbook = [_bof(BOF_GLOBALS)]
+    for sheet, body in zip(sheets, bodies):
+        workbook.append(_boundsheet(sheet, pos))
+        pos += len(body)
+    workbook.append(_record(RT_EOF, b""))
+    workbook.extend(bodies)
+    return make_ole([("Workbook", b"".join(workbook))])
+
+####################################################################
+def _xml_text(val):
+    return val.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+def _col_name(col):
+    name = ""
+    col += 1
+    while (col > 0):
+        col, rem = divmod(col - 1, 26)
+        name = chr(ord("A") + rem) + name
+    return name
+
+def _content_types(overrides):
+    r = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">' \
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>' \
+        '<Default Extension="xml" ContentType="application/xml"/>'
+    for part, content_type in overrides:
+        r += '<Override PartName="/' + part + '" ContentType="' + content_type + '"/>'
+    return r + "</Types>"
+
+def _relationships(rels):
+    r = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="' + NS_PKG_REL + '">'
+    for rid, rel_type, target in rels:
+        r += '<Relationship Id="' + rid + '" Type="' + rel_type + '" Target="' + target + '"/>'
+    return r + "</Relationships>"
+
+def make_xlsx(sheets):
+    """
+    Write an .xlsx workbook with only cell values. Strings go to the shared strings table.
+
+    @param sheets (list) The SheetSpec objects of the sheets.
+
+    @return (bytes) The .xlsx file.
+    """
+    strings = []
+    string_ids = {}
+    out = io.BytesIO()
+    z = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED)
+    overrides = [("xl/workbook.xml", CT_WORKBOOK), ("xl/sharedStrings.xml", CT_SHARED_STRINGS)]
+    workbook = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' \
+               '<workbook xmlns="' + NS_MAIN + '" xmlns:r="' + NS_REL + '"><sheets>'
+    rels = []
+    for i, sheet in enumerate(sheets):
+        part = "worksheets/sheet" + str(i + 1) + ".xml"
+        rid = "rId" + str(i + 1)
+        overrides.append(("xl/" + part, CT_WORKSHEET))
+        rels.append((rid, REL_WORKSHEET, part))
+        state = ""
+        if (sheet.state != "visible"):
+            state = ' state="' + sheet.state + '"'
+        workbook += '<sheet name="' + _xml_text(sheet.name) + '" sheetId="' + str(i + 1) + '"' + \
+                    state + ' r:id="' + rid + '"/>'
+        xml = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="' + \
+               NS_MAIN + '"><sheetData>']
+        for row, cells in enumerate(sheet.rows):
+            xml.append('<row r="' + str(row + 1) + '">')
+            for col, val in enumerate(cells):
+                ref = _col_name(col) + str(row + 1)
+                if isinstance(val, float):
+                    xml.append('<c r="' + ref + '"><v>' + repr(val) + '</v></c>')
+                elif (len(val) > 0):
+                    if (val not in string_ids):
+                        string_ids[val] = len(strings)
+                        strings.append(val)
+                    xml.append('<c r="' + ref + '" t="s"><v>' + str(string_ids[val]) + '</v></c>')
+            xml.append('</row>')
+        xml.append('</sheetData></worksheet>')
+        z.writestr("xl/" + part, "".join(xml))
+    workbook += '</sheets></workbook>'
+    rels.append(("rId" + str(len(sheets) + 1), REL_SHARED_STRINGS, "sharedStrings.xml"))
+    sst = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst xmlns="' + NS_MAIN + \
+           '" count="' + str(len(strings)) + '" uniqueCount="' + str(len(strings)) + '">']
+    for val in strings:
+        sst.append('<si><t xml:space="preserve">' + _xml_text(val) + '</t></si>')
+    sst.append('</sst>')
+    z.writestr("[Content_Types].xml", _content_types(overrides))
+    z.writestr("_rels/.rels", _relationships([("rId1", REL_OFFICE_DOCUMENT, "xl/workbook.xml")]))
+    z.writestr("xl/workbook.xml", workbook)
+    z.writestr("xl/_rels/workbook.xml.rels", _relationships(rels))
+    z.writestr("xl/sharedStrings.xml", "".join(sst))
+    z.close()
+    return out.getvalue()
+
+def make_csv(sheet):
+    """
+    @return (bytes) The sheet as a CSV file, the way LibreOffice exports it.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    for cells in sheet.rows:
+        writer.writerow([repr(val) if isinstance(val, float) else val for val in cells])
+    return out.getvalue().encode("utf-8")
+
+####################################################################
+def make_docx(paragraphs, tables):
+    """
+    Write a .docx document with plain paragraphs followed by simple tables.
+
+    @param paragraphs (list) The paragraph texts.
+
+    @param tables (list) The tables, as 2D lists of cell text.
+
+    @return (bytes) The .docx file.
+    """
+    def para(text):
+        return '<w:p><w:r><w:t xml:space="preserve">' + _xml_text(text) + '</w:t></w:r></w:p>'
+
+    body = [para(text) for text in paragraphs]
+    for table in tables:
+        body.append('<w:tbl>')
+        for row in table:
+            body.append('<w:tr>' + "".join(['<w:tc>' + para(text) + '</w:tc>' for text in row]) + '</w:tr>')
+        body.append('</w:tbl>')
+        body.append(para(""))
+    document = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:document xmlns:w="' + \
+               NS_WORD + '"><w:body>' + "".join(body) + '</w:body></w:document>'
+    out = io.BytesIO()
+    z = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED)
+    z.writestr("[Content_Types].xml", _content_types([("word/document.xml", CT_DOCUMENT)]))
+    z.writestr("_rels/.rels", _relationships([("rId1", REL_OFFICE_DOCUMENT, "word/document.xml")]))
+    z.writestr("word/document.xml", document)
+    z.close()
+    return out.getvalue()
+
+####################################################################
+def write_corpus(out_dir, scale=1, seed=1):
+    """
+    Write the benchmark corpus.
+
+    @param out_dir (str) The directory to write to. Created if needed.
+
+    @param scale (int) Multiplies the size of every document.
+
+    @param seed (int) Seed of the cell values.
+
+    @return (dict) The written file names by kind: "xls", "xlsx", "csv" and "docx".
+    """
+    if (not os.path.isdir(out_dir)):
+        os.makedirs(out_dir)
+    r = {
+        "xls" : [],
+        "xlsx" : [],
+        "csv" : [],
+        "docx" : [],
+    }
+
+    def write(name, data):
+        path = os.path.join(out_dir, name)
+        f = open(path, "wb")
+        f.write(data)
+        f.close()
+        return path
+
+    for name, sheets in excel_cases(scale, seed):
+        r["xls"].append(write(name + ".xls", make_xls(sheets)))
+        r["xlsx"].append(write(name + ".xlsx", make_xlsx(sheets)))
+        for i, sheet in enumerate(sheets):
+            r["csv"].append(write(name + "_" + str(i) + ".csv", make_csv(sheet)))
+    for name, paragraphs, tables in word_cases(scale, seed):
+        r["docx"].append(write(name + ".docx", make_docx(paragraphs, tables)))
+    return r
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""@package benchmark
+Benchmark the extraction pipeline on a synthetic corpus (see bench_corpus). Each stage runs
+in its own child process over every file of its kind, several times, and reports:
+
+seconds           Fastest time of one pass over all the files.
+items_per_second  Files (or sheets) processed per second.
+mb_per_second     Input megabytes processed per second.
+p50_ms, p99_ms    Latency of a single call.
+peak_rss          Peak resident memory of the stage process in bytes.
+
+The results are written as JSON. Give a saved result with --baseline to compare against it;
+the exit code is 1 if a stage got slower or bigger than the allowed threshold.
+
+The LibreOffice stages only run if soffice and unotools are available here.
+
+This is Python 3.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import importlib
+import resource
+import multiprocessing
+
+import bench_corpus
+import docx_reader
+import excel
+import filetype
+
+# Version of the result format.
+RESULT_VERSION = 1
+
+# Default allowed slowdown or memory growth against a baseline, as a fraction.
+DEFAULT_THRESHOLD = 0.2
+
+####################################################################
+def _read(path):
+    f = open(path, "rb")
+    data = f.read()
+    f.close()
+    return data
+
+def _percentile(values, percent):
+    """
+    @return (float) The nearest-rank percentile of a list of numbers.
+    """
+    values = sorted(values)
+    if (len(values) == 0):
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+def _peak_rss():
+    """
+    @return (int) The peak resident memory of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if (sys.platform == "darwin"):
+        return peak
+    return peak * 1024
+
+def _loaded_book(path):
+    book = excel.read_excel_sheets(path)
+    for sheet in book.sheets:
+        sheet.load()
+    return book
+
+def _read_word_native(data):
+    document = docx_reader.DocxDocument(data)
+    r = document.read()
+    document.get_metadata()
+    document.close()
+    return r
+
+####################################################################
+class Stage(object):
+    """
+    A benchmarked step of the pipeline.
+    """
+
+    def __init__(self, name, kinds, func, prepare=None, needs_soffice=False):
+        """
+        @param name (str) The stage name.
+
+        @param kinds (list) The corpus file kinds the stage runs on.
+
+        @param func (function) The timed call.
+
+        @param prepare (function) Turns a file name into the list of arguments of the timed
+        calls, untimed. Defaults to one call with the file name.
+
+        @param needs_soffice (bool) func takes the UNO connection as a 2nd argument.
+        """
+        self.name = name
+        self.kinds = kinds
+        self.func = func
+        self.prepare = prepare
+        self.needs_soffice = needs_soffice
+
+    def args(self, corpus):
+        """
+        @return (list) (argument, size in bytes) tuples of all the timed calls.
+        """
+        r = []
+        for kind in self.kinds:
+            for path in corpus[kind]:
+                size = os.path.getsize(path)
+                if (self.prepare is None):
+                    r.append((path, size))
+                    continue
+                args = self.prepare(path)
+                for arg in args:
+                    r.append((arg, size // max(len(args), 1)))
+        return r
+
+def _libreoffice_excel(data, context):
+    import excel_export
+    return excel_export.export_sheets_data(data, context=context)
+
+def _libreoffice_word(data, context):
+    import export_doc_text
+    document = export_doc_text.get_document_from_data(data, context)
+    try:
+        return (export_doc_text.get_text(document), export_doc_text.get_tables(document),
+                export_doc_text.get_metadata(document))
+    finally:
+        document.close(True)
+
+STAGES = [
+    Stage("filetype", ["xls", "xlsx", "docx", "csv"], lambda path: filetype.is_office_file(path, False)),
+    Stage("unhide_sheets", ["xls", "xlsx"], excel._unhide_sheets, prepare=lambda path: [_read(path)]),
+    Stage("read_sheet_from_csv", ["csv"], excel.read_sheet_from_csv),
+    Stage("sheet_repr", ["xls", "xlsx"], repr, prepare=lambda path: _loaded_book(path).sheets),
+    Stage("read_excel_sheets", ["xls", "xlsx"], _loaded_book),
+    Stage("read_word_native", ["docx"], _read_word_native, prepare=lambda path: [_read(path)]),
+    Stage("libreoffice_excel", ["xls", "xlsx"], _libreoffice_excel, prepare=lambda path: [_read(path)],
+          needs_soffice=True),
+    Stage("libreoffice_word", ["docx"], _libreoffice_word, prepare=lambda path: [_read(path)],
+          needs_soffice=True),
+]
+
+####################################################################
+def soffice_available():
+    """
+    @return (str) Why the LibreOffice stages cannot run, None if they can.
+    """
+    try:
+        import soffice
+
+        # The converters import unotools, so loading them checks that it works.
+        for name in ("excel_export", "export_doc_text"):
+            importlib.import_module(name)
+    except ImportError as e:
+        return str(e)
+    if (not soffice.is_soffice_installed()):
+        return "soffice is not installed"
+    return None
+
+def run_stage(stage, corpus, repeat):
+    """
+    Time a stage in this process.
+
+    @param stage (Stage) The stage.
+
+    @param corpus (dict) The corpus file names by kind. See bench_corpus.write_corpus().
+
+    @param repeat (int) The number of timed passes over the files.
+
+    @return (dict) The stage results.
+    """
+    instance = None
+    context = None
+    r = {}
+    if stage.needs_soffice:
+        import soffice
+        instance = soffice.SofficeInstance()
+        context = instance.start()
+        r["startup_seconds"] = round(instance.startup_seconds, 3)
+    try:
+        args = stage.args(corpus)
+        total_bytes = sum([size for _, size in args])
+
+        # One untimed pass to warm up the caches.
+        for arg, _ in args:
+            if stage.needs_soffice:
+                stage.func(arg, context)
+            else:
+                stage.func(arg)
+
+        latencies = []
+        passes = []
+        for _ in range(0, repeat):
+            pass_start = time.perf_counter()
+            for arg, _ in args:
+                start = time.perf_counter()
+                if stage.needs_soffice:
+                    stage.func(arg, context)
+                else:
+                    stage.func(arg)
+                latencies.append(time.perf_counter() - start)
+            passes.append(time.perf_counter() - pass_start)
+    finally:
+        if (instance is not None):
+            instance.stop(remove_profile=True)
+
+    seconds = min(passes)
+    r.update({
+        "items" : len(args),
+        "bytes" : total_bytes,
+        "seconds" : round(seconds, 6),
+        "items_per_second" : round(len(args) / seconds, 3) if (seconds > 0) else None,
+        "mb_per_second" : round(total_bytes / seconds / 1e6, 3) if (seconds > 0) else None,
+        "p50_ms" : round(_percentile(latencies, 50) * 1000, 3),
+        "p99_ms" : round(_percentile(latencies, 99) * 1000, 3),
+        "peak_rss" : _peak_rss(),
+    })
+    return r
+
+def _stage_child(stage, corpus, repeat, conn):
+    try:
+        conn.send(run_stage(stage, corpus, repeat))
+    except Exception as e:
+        conn.send({"error" : str(e)})
+    conn.close()
+
+def run_stage_isolated(stage, corpus, repeat):
+    """
+    Time a stage in a child process, so its peak memory is its own.
+
+    @return (dict) The stage results. See run_stage().
+    """
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_child, args=(stage, corpus, repeat, child_conn))
+    proc.start()
+    child_conn.close()
+    try:
+        r = parent_conn.recv()
+    except EOFError:
+        r = {"error" : "Stage process died."}
+    proc.join()
+    return r
+
+####################################################################
+def run_benchmark(corpus, repeat=5, stages=None):
+    """
+    Run the benchmark stages.
+
+    @param corpus (dict) The corpus file names by kind. See bench_corpus.write_corpus().
+
+    @param repeat (int) The number of timed passes over the files of each stage.
+
+    @param stages (list) The names of the stages to run. All of them if None.
+
+    @return (dict) The results of each stage by name. Stages that cannot run here only have
+    a "skipped" reason.
+    """
+    no_soffice = soffice_available()
+    r = {}
+    for stage in STAGES:
+        if ((stages is not None) and (stage.name not in stages)):
+            continue
+        if (stage.needs_soffice and (no_soffice is not None)):
+            r[stage.name] = {"skipped" : no_soffice}
+            continue
+        print("RUNNING " + stage.name, file=sys.stderr)
+        r[stage.name] = run_stage_isolated(stage, corpus, repeat)
+    return r
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare benchmark results against a baseline.
+
+    @param results (dict) The stage results. See run_benchmark().
+
+    @param baseline (dict) The stage results of the baseline.
+
+    @param threshold (float) The allowed slowdown or memory growth, as a fraction.
+
+    @return (dict) For each stage in both, the "time_ratio" and "rss_ratio" of the results
+    to the baseline and whether it is a "regression".
+    """
+    r = {}
+    for name, stage in results.items():
+        old = baseline.get(name)
+        if ((old is None) or ("seconds" not in stage) or ("seconds" not in old)):
+            continue
+        time_ratio = None
+        if (old["seconds"] > 0):
+            time_ratio = round(stage["seconds"] / old["seconds"], 3)
+        rss_ratio = None
+        if (old.get("peak_rss", 0) > 0):
+            rss_ratio = round(stage["peak_rss"] / float(old["peak_rss"]), 3)
+        r[name] = {
+            "time_ratio" : time_ratio,
+            "rss_ratio" : rss_ratio,
+            "regression" : (((time_ratio is not None) and (time_ratio > 1 + threshold)) or
+                            ((rss_ratio is not None) and (rss_ratio > 1 + threshold))),
+        }
+    return r
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="benchmark the Excel and Word extraction "
+                                                     "on a synthetic document corpus")
+    arg_parser.add_argument("-o", "--output", action="store", default="-",
+                            help="file to write the JSON results to (default: stdout)")
+    arg_parser.add_argument("-b", "--baseline", action="store", default=None,
+                            help="JSON results of an earlier run to compare against")
+    arg_parser.add_argument("-t", "--threshold", action="store", type=float, default=DEFAULT_THRESHOLD,
+                            help="allowed slowdown or memory growth against the baseline, as a "
+                                 "fraction (default: " + str(DEFAULT_THRESHOLD) + ")")
+    arg_parser.add_argument("-r", "--repeat", action="store", type=int, default=5,
+                            help="number of timed passes per stage (default: 5)")
+    arg_parser.add_argument("-s", "--scale", action="store", type=int, default=1,
+                            help="size multiplier of the corpus documents (default: 1)")
+    arg_parser.add_argument("--seed", action="store", type=int, default=1,
+                            help="seed of the corpus cell values (default: 1)")
+    arg_parser.add_argument("--corpus", action="store", default=None,
+                            help="directory to write the corpus to and keep it (default: a "
+                                 "temporary directory)")
+    arg_parser.add_argument("--stage", action="append", default=None,
+                            help="only run this stage, can be given several times (stages: " + \
+                                 ", ".join([stage.name for stage in STAGES]) + ")")
+    args = arg_parser.parse_args()
+
+    # Cached results would make the LibreOffice stages meaningless.
+    os.environ.pop("OFFICE_DUMPER_CACHE_DIR", None)
+
+    corpus_dir = args.corpus
+    if (corpus_dir is None):
+        corpus_dir = tempfile.mkdtemp(prefix="office_dumper_bench_")
+    try:
+        corpus = bench_corpus.write_corpus(corpus_dir, args.scale, args.seed)
+        results = {
+            "version" : RESULT_VERSION,
+            "python" : platform.python_version(),
+            "platform" : platform.platform(),
+            "scale" : args.scale,
+            "seed" : args.seed,
+            "repeat" : args.repeat,
+            "stages" : run_benchmark(corpus, args.repeat, args.stage),
+        }
+    finally:
+        if (args.corpus is None):
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    regressions = []
+    if (args.baseline is not None):
+        f = open(args.baseline, "r")
+        baseline = json.load(f)
+        f.close()
+        if ((baseline.get("scale") != args.scale) or (baseline.get("seed") != args.seed)):
+            print("WARNING: The baseline was run on a different corpus.", file=sys.stderr)
+        results["comparison"] = compare(results["stages"], baseline.get("stages", {}), args.threshold)
+        regressions = [name for name, c in results["comparison"].items() if c["regression"]]
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if (args.output == "-"):
+        print(output)
+    else:
+        f = open(args.output, "w")
+        f.write(output + "\n")
+        f.close()
+    if (len(regressions) > 0):
+        print("REGRESSIONS: " + ", ".join(regressions), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,262 @@
+"""@package docx_reader
+Read the text and the tables of Word 2007+ documents (.docx/.docm) directly from the ZIP
+container, without LibreOffice. The document XML is parsed incrementally and finished
+paragraphs and tables are dropped from the XML tree as soon as they are read.
+load_word() adds the result cache and a LibreOffice fallback given by the caller.
+"""
+
+from __future__ import print_function
+
+import sys
+import xml.etree.ElementTree as ET
+
+import filetype
+import ooxml
+import pipeline_stats
+import result_cache
+
+# Elements whose text is not part of the document body text. Paragraph and run properties
+# hold no text, but their <w:tabs><w:tab/> tab stop definitions look like tab characters.
+SKIPPED_ELEMENTS = set(["txbxContent", "delText", "instrText", "Fallback", "pPr", "rPr"])
+
+####################################################################
+class DocxDocument(object):
+    """
+    Word 2007+ document read straight from the ZIP container.
+    """
+
+    def __init__(self, data):
+        """
+        @param data (binary blob) The contents of the .docx/.docm file.
+        """
+        self.package = ooxml.OoxmlPackage(data)
+        self.document_path = self.package.main_part("word/document.xml")
+        if (self.document_path is None):
+            raise ValueError("No document part found.")
+        if (not self.document_path.endswith(".xml")):
+            raise ValueError("Document part " + self.document_path + " is not XML.")
+
+    def read(self):
+        """
+        Read the text and the tables of the document in one pass.
+
+        @return (tuple) The paragraphs of the document body (list of str, table cell
+        paragraphs included) and the tables of the document (list of 2D lists of cell text).
+        """
+        paragraphs = []
+        tables = []
+
+        # Stack of (table, current row, current cell paragraphs) for nested tables.
+        table_stack = []
+        para = None
+        skip_depth = 0
+        depth = 0
+        body = None
+        body_depth = None
+        for event, elem in ET.iterparse(self.package.open(self.document_path), events=("start", "end")):
+            name = ooxml.local_name(elem.tag)
+            if (event == "start"):
+                depth += 1
+                if (name in SKIPPED_ELEMENTS):
+                    skip_depth += 1
+                if (skip_depth > 0):
+                    continue
+                if (name == "body"):
+                    body = elem
+                    body_depth = depth
+                elif (name == "p"):
+                    para = []
+                elif (name == "tbl"):
+                    table = []
+                    tables.append(table)
+                    table_stack.append([table, None, None])
+                elif ((name == "tr") and (len(table_stack) > 0)):
+                    table_stack[-1][1] = []
+                elif ((name == "tc") and (len(table_stack) > 0)):
+                    table_stack[-1][2] = []
+                continue
+
+            # End of an element.
+            depth -= 1
+            if (skip_depth > 0):
+                if (name in SKIPPED_ELEMENTS):
+                    skip_depth -= 1
+                continue
+            if (para is not None):
+                if (name == "t"):
+                    para.append(elem.text or "")
+                elif (name == "tab"):
+                    para.append("\t")
+                elif ((name == "br") and (ooxml.get_attrib(elem, "type") in (None, "textWrapping"))):
+                    para.append("\n")
+                elif (name == "cr"):
+                    para.append("\n")
+            if (name == "p"):
+                text = "".join(para or [])
+                paragraphs.append(text)
+
+                # Text of nested tables is also part of the enclosing table cells.
+                for level in table_stack:
+                    if (level[2] is not None):
+                        level[2].append(text)
+                para = None
+                elem.clear()
+            elif ((name == "tc") and (len(table_stack) > 0)):
+                cell = table_stack[-1][2]
+                if (table_stack[-1][1] is not None):
+                    table_stack[-1][1].append("\n".join(cell or []))
+                table_stack[-1][2] = None
+            elif ((name == "tr") and (len(table_stack) > 0)):
+                if (table_stack[-1][1] is not None):
+                    table_stack[-1][0].append(table_stack[-1][1])
+                table_stack[-1][1] = None
+            elif ((name == "tbl") and (len(table_stack) > 0)):
+                table_stack.pop()
+                elem.clear()
+
+            # Drop finished top level paragraphs and tables.
+            if ((body is not None) and (depth == body_depth)):
+                body.clear()
+
+        return (paragraphs, tables)
+
+    def get_text(self):
+        """
+        Get the document text, in the same form as exported through LibreOffice.
+
+        @return (str) The document text, with a \\x0c at the start.
+        """
+        paragraphs, _ = self.read()
+        return "\x0c" + "\n".join(paragraphs)
+
+    def get_tables(self):
+        """
+        Get the text tables of the document.
+
+        @return (list) The 2D lists of the cell text of each table in the document.
+        """
+        _, tables = self.read()
+        return tables
+
+    def get_metadata(self):
+        """
+        Get the basic document properties.
+
+        @return (dict) See ooxml.OoxmlPackage.read_metadata().
+        """
+        return self.package.read_metadata()
+
+    def close(self):
+        self.package.close()
+
+####################################################################
+def is_docx_data(data):
+    """
+    Check to see if the given data looks like a Word 2007+ file.
+
+    @param data (binary blob) The file contents.
+
+    @return (bool) True if it is a ZIP file with a Word document part, False if not.
+    """
+    if (not data.startswith(b"PK\x03\x04")):
+        return False
+    try:
+        package = ooxml.OoxmlPackage(data)
+    except ValueError:
+        return False
+    main_part = package.main_part("word/document.xml")
+    package.close()
+    return ((main_part is not None) and main_part.startswith("word/"))
+
+####################################################################
+def read_document(data):
+    """
+    Read the text, tables and metadata of a Word 2007+ file.
+
+    @param data (binary blob) The file contents.
+
+    @return (dict) {"text", "tables", "metadata"} like export_doc_text.export_word_all(),
+    None if the file is not a Word 2007+ file or could not be read.
+    """
+    if (not is_docx_data(data)):
+        return None
+    try:
+        document = DocxDocument(data)
+        paragraphs, tables = document.read()
+        result = {
+            "text" : "\x0c" + "\n".join(paragraphs),
+            "tables" : tables,
+            "metadata" : document.get_metadata(),
+        }
+        document.close()
+        return result
+    except Exception as e:
+        print("WARNING: Reading Word file natively failed. " + str(e), file=sys.stderr)
+        return None
+
+####################################################################
+def load_word(fname, export_word, stats=None):
+    """
+    Export the text, the tables and the metadata of a Word file. Results are taken from
+    and saved in the result cache, if one is configured (see result_cache). Word 2007+
+    files are read natively, and the others (or ones the native reader fails on) with a
+    given LibreOffice export, so this needs no LibreOffice itself.
+
+    @param fname (str) The name of the Word file.
+
+    @param export_word (function) Called with the file contents to read the document with
+    LibreOffice when the native reader can't. It must return the same dict as
+    export_doc_text.export_word_data().
+
+    @param stats (PipelineStats) Where to record the time spent in each stage and the byte,
+    text and table counts. It is finished (see PipelineStats.finish()) when this returns.
+
+    @return (dict) {"text", "tables", "metadata"} like export_doc_text.export_word_all(),
+    None if the file is not a Word file.
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+    result = None
+    try:
+
+        # Make sure this is a word file.
+        with stats.stage("filetype"):
+            word = filetype.is_word_file(fname, False)
+        if (not word):
+            return None
+
+        # Have we already seen this file?
+        f = open(fname, 'rb')
+        data = f.read()
+        f.close()
+        stats.add("input_bytes", len(data))
+        cache = result_cache.default_cache()
+        if (cache is not None):
+            with stats.stage("cache_get"):
+                result = cache.get(data, "word")
+            if (result is not None):
+                stats.add("cache_hits")
+                return result
+
+        # Read Word 2007+ documents directly if we can. LibreOffice is only needed for
+        # binary .doc files or if that fails.
+        with stats.stage("native_read"):
+            result = read_document(data)
+        if (result is not None):
+            stats.add("native_reads")
+        else:
+            result = export_word(data)
+
+        # Remember the result.
+        if ((cache is not None) and (result is not None)):
+            try:
+                with stats.stage("cache_put"):
+                    cache.put(data, "word", result)
+            except Exception as e:
+                print("WARNING: Saving Word export in the result cache failed. " + str(e), file=sys.stderr)
+        return result
+    finally:
+        if (result is not None):
+            stats.add("text_chars", len(result["text"]))
+            stats.add("tables", len(result["tables"]))
+        stats.finish("word", "ok" if (result is not None) else "error")
@@ -5,199 +5,547 @@ Partial implementation of xlrd.book object interface.
 from __future__ import print_function
 
 import os
-import random
 import json
 import subprocess
-import string
-import copy
 import sys
-import re
+import io
+import csv
+import array
+import bisect
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
 
 import filetype
+import limits
+import office_service
+import pipeline_stats
+import result_cache
+import sheet_dump
+import xls_reader
+import xlsx_reader
+
+# The in-process LibreOffice API is only available if unotools can be loaded here.
+try:
+    import excel_export
+except ImportError:
+    excel_export = None
+
+# Maximum size of a CSV field.
+CSV_FIELD_SIZE_LIMIT = 2 ** 31 - 1
 
 ####################################################################
-def read_sheet_from_csv(filename):
+def iter_csv_rows(filename, encoding="utf-8"):
+    """
+    Stream the rows of a CSV file. Quoted fields may contain ',', '""' escaped quotes and
+    newlines (RFC 4180).
+
+    @param filename (str) The name of the CSV file.
+
+    @param encoding (str) The character encoding of the CSV file. Undecodable bytes are
+    replaced.
+
+    @return (generator) The rows of the CSV file. Each row is a list of cell values (str).
+    """
+
+    # Obfuscated sheets can have very long cells.
+    if (csv.field_size_limit() < CSV_FIELD_SIZE_LIMIT):
+        csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+    with io.open(filename, 'r', encoding=encoding, errors='replace', newline='') as f:
+        for row in csv.reader(f):
+            yield row
+
+####################################################################
+def read_sheet_from_csv(filename, encoding="utf-8", sheet_filter=None):
     """
     Read an Excel CSV file into a Sheet object.
 
     @param filename (str) The name of the CSV file.
 
+    @param encoding (str) The character encoding of the CSV file.
+
+    @param sheet_filter (SheetFilter) Caps on the rows, columns, cells and bytes read. The
+    file is only read up to the first limit hit. See sheet_filter.
+
     @return (ExcelSheet object) The Excel sheet object containing the CSV data.
     """
 
-    # Open the CSV file.
-    f = None
+    # Read in all the cells. Note that this only works for a single sheet.
     try:
-        f = open(filename, 'rb')
-    except Exception as e:
+        rows = iter_csv_rows(filename, encoding)
+        truncated = []
+        if (sheet_filter is not None):
+            rows = sheet_filter.cap_rows(rows, truncated)
+        sheet = _rows_to_sheet(rows)
+        sheet.truncated = truncated
+    except (IOError, OSError) as e:
         print("ERROR: Cannot open CSV file. " + str(e))
         return None
 
-    # Read in all the cells. Note that this only works for a single sheet.
-    row = 1
-    r = {}
-    for line in f:
-
-        # Escape ',' in cell values so the split works correctly.
-        line = line.strip()
-        in_str = False
-        tmp = ""
-        for c in line:
-            if (isinstance(c, int)):
-                c = chr(c)
-            if (c == '"'):
-                in_str = not in_str
-            if (in_str and (c == ',')):
-                tmp += "#A_COMMA!!#"
-            else:
-                tmp += c
-        line = tmp
-
-        # Break out the individual cell values.
-        cells = line.split(",")
-        col = 1
-        for cell in cells:
-
-            # Add back in escaped ','.
-            cell = cell.replace("#A_COMMA!!#", ",")
-
-            # Strip " from start and end of value.
-            dat = str(cell)
-            if (dat.startswith('"')):
-                dat = dat[1:]
-            if (dat.endswith('"')):
-                dat = dat[:-1]
-            r[(row, col)] = dat
-            col += 1
-        row += 1
-
-    # Close file.
-    f.close()
-
     # Make an object with a subset of the xlrd book methods.
-    r = make_book(r)
-    #print "EXCEL:\n"
-    #print r
+    r = ExcelBook(None)
+    r.sheets.append(sheet)
     return r
 
 ####################################################################
 def _unhide_sheets(data):
     """
-    Unhide all very hidden sheets the given Excel file data.
+    Unhide all hidden and very hidden sheets of the given Excel file data, so LibreOffice
+    exports them. Only the sheet visibility flags are changed (the BOUNDSHEET records of
+    .xls files, the workbook part of .xlsx/.xlsm files).
+
+    See https://inquest.net/blog/2019/01/29/Carving-Sneaky-XLM-Files for why this matters.
 
     @param data (binary blob) The contents of an Excel file.
 
-    @return (binary blob) The Excel data with sheets unhidden.
+    @return (tuple) The Excel data with sheets unhidden and a list of {"name", "index",
+    "state", "type"} dicts for the sheets that were hidden. Patched .xls data is returned
+    as the bytearray it was patched in, so the file is only copied once.
     """
+    try:
+        file_type = filetype.get_file_type(data, True)
+        if (file_type == "xls"):
+            buf = bytearray(data)
+            hidden = xls_reader.unhide_sheets(buf)
+            if (len(hidden) > 0):
+                return (buf, hidden)
+        elif (file_type in ("xlsx", "xlsm")):
+            return xlsx_reader.unhide_sheets(data)
+    except Exception as e:
+        print("WARNING: Unhiding Excel sheets failed. " + str(e))
+    return (data, [])
 
-    # See https://inquest.net/blog/2019/01/29/Carving-Sneaky-XLM-Files and
-    # https://github.com/InQuest/yara-rules/blob/master/Excel_Hidden_Macro_Sheet.rule for explanation.
-    hide_pat = br"(\x85\x00.{6})[\x01\x02]\x01"
-    new_data = data
-    if (re.search(hide_pat, data) is not None):
-        
-        # Edit the file to unhide the sheets.
-        new_data = re.sub(hide_pat, br"\1" + b"\x00\x01", data)
-
-    # Done.
-    return new_data
-        
 ####################################################################
-def load_excel_libreoffice(data):
+def _export_sheets(data, stats=None, sheet_filter=None):
     """
-    Load the sheets from a given in-memory Excel file into a Workbook object.
+    Read all the sheets of an Excel file with LibreOffice. The file is handed over in
+    memory, nothing is written to disk.
 
-    @param data (binary blob) The contents of an Excel file.
+    @param data (binary blob) The contents of the Excel file.
 
-    @return (ExcelBook object) On success return a workbook object with the read in
-    Excel workbook, on failure return None.
+    @param stats (PipelineStats) Where to record the LibreOffice stages, if read in this
+    process.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. See
+    sheet_filter.
+
+    @return (list) One {"name", "index", "cells"} dict per sheet (see
+    excel_export.export_sheets()), None on error.
     """
-    
-    # Don't try this if it is not an Office file.
-    if (not filetype.is_office_file(data, True)):
-        print("WARNING: The file is not an Office file. Not extracting sheets with LibreOffice.")
+
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+
+    # Use the resident conversion service if it is running.
+    try:
+        result = office_service.export_excel_sheets(None, data=data, sheet_filter=sheet_filter)
+        stats.add("service_requests")
+        return result
+    except office_service.SERVICE_UNAVAILABLE:
+        pass
+    except Exception as e:
+        stats.add("service_requests")
+        print("ERROR: Conversion service failed. " + str(e))
         return None
 
-    # Unhide hidden Excel sheets.
-    data = _unhide_sheets(data)
-    
-    # Save the Excel data to a temporary file.
-    out_dir = "/tmp/tmp_excel_file_" + str(random.randrange(0, 10000000000))
-    f = open(out_dir, 'wb')
-    f.write(data)
-    f.close()
-    
-    # Dump all the sheets as CSV files using soffice.
+    # No service. Read the sheets in this process if we can use LibreOffice from here.
+    if (excel_export is not None):
+        try:
+            return excel_export.export_sheets_data(data, stats=stats, sheet_filter=sheet_filter)
+        except Exception as e:
+            print("ERROR: Exporting sheets with LibreOffice failed. " + str(e))
+            return None
+
+    # Fall back to reading the sheets with the python3 export script, which reads the file
+    # from stdin. The script watches its own soffice, this only catches a stuck script.
     output = None
     _thismodule_dir = os.path.normpath(os.path.abspath(os.path.dirname(__file__)))
+    stats.add("export_processes")
+    args = ["--json"]
+    if (sheet_filter is not None):
+        args += sheet_filter.to_args()
     try:
-        output = subprocess.check_output(["python3", _thismodule_dir + "/export_all_excel_sheets.py", out_dir])
+        proc = subprocess.Popen(["python3", _thismodule_dir + "/export_all_excel_sheets.py"] + args + ["-"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            timeout = None
+            if (limits.DOC_TIMEOUT > 0):
+                timeout = limits.DOC_TIMEOUT + limits.STARTUP_TIMEOUT
+            output, _ = proc.communicate(data, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise Exception("Timed out.")
+        if (proc.returncode != 0):
+            raise Exception("Exit code " + str(proc.returncode) + ".")
     except Exception as e:
         print("ERROR: Running export_all_excel_sheets.py failed. " + str(e))
-        #os.remove(out_dir)
         return None
-
-    # Get the names of the sheet files, if there are any.
     try:
-        sheet_files = json.loads(output.replace(b"'", b'"'))
+        return json.loads(output)
     except Exception as e:
         print(e)
-        os.remove(out_dir)
         return None
-    if (len(sheet_files) == 0):
-        os.remove(out_dir)
+
+####################################################################
+def _rows_to_sheet(rows, name="Sheet1"):
+    """
+    Make a sheet from a list of sheet rows.
+
+    @param rows (iterable) The rows of the sheet. Each row is a list of cell values.
+
+    @param name (str) The name of the sheet.
+
+    @return (ExcelSheet object) The sheet. Rows and columns start at 1.
+    """
+    r = ExcelSheet(None, name)
+    row = 1
+    for row_vals in rows:
+        col = 1
+        for val in row_vals:
+            r.set_cell(row, col, val)
+            col += 1
+        row += 1
+    return r
+
+####################################################################
+def load_excel_native(data, lazy=True, sheet_filter=None):
+    """
+    Load the sheets from a given in-memory Excel file into a Workbook object without using
+    LibreOffice. Office 97-2003 (BIFF8) and Office 2007+ (.xlsx/.xlsm) workbooks are
+    supported. Hidden, very hidden and macro sheets are included.
+
+    @param data (binary blob) The contents of an Excel file.
+
+    @param lazy (bool) If True only the sheet list is read here. The cells of each sheet
+    are read from the file when they are first used (see ExcelSheet), and a sheet that
+    fails to read then is marked with "error" in truncated. If False all the cells are read
+    now, and None is returned if any sheet fails to read.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. Sheets
+    that are not picked are left out of the workbook. See sheet_filter.
+
+    @return (ExcelBook object) On success return a workbook object with the read in
+    Excel workbook, on failure return None.
+    """
+    try:
+        if filetype.is_office97_file(data, True):
+            workbook = xls_reader.XlsWorkbook(data)
+        else:
+            workbook = xlsx_reader.XlsxWorkbook(data)
+        result_book = ExcelBook(None)
+        for sheet_info in workbook.sheets:
+            if ((sheet_filter is not None) and
+                (not sheet_filter.selects(sheet_info["index"], sheet_info["name"], sheet_info["state"],
+                                          sheet_info["type"] or "worksheet"))):
+                continue
+            sheet = ExcelSheet(None, sheet_info["name"])
+            sheet.state = sheet_info["state"]
+            sheet.type = sheet_info["type"] or "worksheet"
+
+            # Capped sheets stop reading the file at the first limit hit.
+            def source(sheet_info=sheet_info, sheet=sheet):
+                cells = workbook.iter_cells(sheet_info, formulas=True)
+                if ((sheet_filter is None) or (not sheet_filter.has_caps())):
+                    return cells
+                return sheet_filter.cap_cells(cells, sheet.truncated)
+            if lazy:
+                sheet._source = source
+            else:
+                for row, col, val, formula in source():
+                    sheet.set_cell(row, col, val)
+                    if (formula is not None):
+                        sheet.set_formula(row, col, formula)
+            result_book.sheets.append(sheet)
+        if (not lazy):
+            workbook.close()
+    except Exception as e:
+        print("WARNING: Reading Excel file natively failed. " + str(e))
+        return None
+    if (len(workbook.sheets) == 0):
+        return None
+    return result_book
+
+####################################################################
+def book_to_json(book):
+    """
+    Convert a workbook to a JSON serializable form for the result cache.
+
+    @param book (ExcelBook object) The workbook.
+
+    @return (list) One {"name", "state", "type", "nrows", "ncols", "cells", "formulas",
+    "truncated"} dict per sheet. The cells are [row, col, value] lists and the formulas [row,
+    col, formula] lists. truncated lists the limits that cut the sheet short (see
+    sheet_filter).
+    """
+    r = []
+    for sheet in book.sheets:
+        sheet.load()
+        r.append({
+            "name" : sheet.name,
+            "state" : sheet.state,
+            "type" : sheet.type,
+            "nrows" : sheet.nrows,
+            "ncols" : sheet.ncols,
+            "cells" : [[row, col, val] for row, col, val in sheet.iter_cells()],
+            "formulas" : [[row, col, formula] for row, col, formula, _ in sheet.iter_formulas()],
+            "truncated" : sheet.truncated,
+        })
+    return r
+
+####################################################################
+def book_from_json(sheets):
+    """
+    Rebuild a workbook saved with book_to_json().
+
+    @param sheets (list) The saved sheets.
+
+    @return (ExcelBook object) The workbook.
+    """
+    r = ExcelBook(None)
+    for sheet_data in sheets:
+        sheet = ExcelSheet(None, sheet_data["name"])
+        sheet.state = sheet_data.get("state", "visible")
+        sheet.type = sheet_data.get("type", "worksheet")
+        sheet.truncated = list(sheet_data.get("truncated", []))
+        for row, col, val in sheet_data["cells"]:
+            sheet.set_cell(row, col, val)
+        for row, col, formula in sheet_data.get("formulas", []):
+            sheet.set_formula(row, col, formula)
+        sheet.nrows = max(sheet.nrows, sheet_data["nrows"])
+        sheet.ncols = max(sheet.ncols, sheet_data["ncols"])
+        r.sheets.append(sheet)
+    return r
+
+####################################################################
+def load_excel_libreoffice(data, formulas=False, export_sheets=None, stats=None, sheet_filter=None,
+                           lazy=False):
+    """
+    Load the sheets from a given in-memory Excel file into a Workbook object.
+
+    Results are saved in the result cache, if one is configured (see result_cache), so
+    files that were already seen are not converted again.
+
+    @param data (binary blob) The contents of an Excel file.
+
+    @param formulas (bool) If True make sure the formulas of the cells are read too (see
+    ExcelSheet.iter_formulas()). The native .xls reader does not decompile formulas, so .xls
+    files are read with LibreOffice in that case. .xlsx/.xlsm formulas are always read.
+
+    @param export_sheets (function) Called with the (unhidden) file contents to read the
+    sheets with LibreOffice when the native readers can't. It must return the same records
+    as excel_export.export_sheets_data(). If None the conversion service, the in-process
+    LibreOffice API or the export script is used (see _export_sheets()). If a sheet filter
+    is given it is passed as a 2nd argument.
+
+    @param stats (PipelineStats) Where to record the time spent in each stage and the
+    byte, sheet, cell, formula and soffice start counts. It is finished (see
+    PipelineStats.finish()) when this returns. The cells and formulas of lazily loaded
+    sheets are not counted.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. Sheets
+    that are not picked are left out of the workbook. See sheet_filter.
+
+    @param lazy (bool) If True natively read workbooks are loaded lazily (see
+    load_excel_native()): only the sheet list is read here, and a sheet that later fails to
+    read is marked with "error" in ExcelSheet.truncated instead of being read with
+    LibreOffice. If False (the default) all the sheets are read here, and LibreOffice is
+    used if the native readers fail on any of them. Workbooks saved in the result cache are
+    always read in full.
+
+    @return (ExcelBook object) On success return a workbook object with the read in
+    Excel workbook, on failure return None.
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+    stats.add("input_bytes", len(data))
+    r = None
+    try:
+
+        # Have we already seen this file?
+        cache = result_cache.default_cache()
+        kind = "excel_formulas" if formulas else "excel"
+        if (sheet_filter is not None):
+            kind += ":" + sheet_filter.key()
+        if (cache is not None):
+            with stats.stage("cache_get"):
+                cached = cache.get(data, kind)
+            if (cached is not None):
+                stats.add("cache_hits")
+                r = book_from_json(cached)
+                return r
+
+        # Load the workbook and remember it.
+        r = _load_excel(data, formulas, export_sheets, stats, sheet_filter,
+                        lazy and (cache is None))
+        if ((cache is not None) and (r is not None)):
+            try:
+                with stats.stage("cache_put"):
+                    cache.put(data, kind, book_to_json(r))
+            except Exception as e:
+                print("WARNING: Saving workbook in the result cache failed. " + str(e))
+        return r
+    finally:
+        if (r is not None):
+            _count_book(r, stats)
+        stats.finish("excel", "ok" if (r is not None) else "error")
+
+def _count_book(book, stats):
+    """
+    Record the sheet, cell, formula and truncated sheet counts of a loaded workbook, however
+    it was read (natively, with LibreOffice or from the result cache). The cells, formulas
+    and truncation of lazily read sheets are only known once they are read, after the
+    stats are finished, so those sheets are only counted in "sheets" and "lazy_sheets".
+
+    @param book (ExcelBook object) The workbook.
+
+    @param stats (PipelineStats) Where to record the counts.
+    """
+    stats.add("sheets", len(book.sheets))
+    for sheet in book.sheets:
+        if (not sheet.is_loaded()):
+            stats.add("lazy_sheets")
+            continue
+        if (len(sheet.truncated) > 0):
+            stats.add("truncated_sheets")
+        stats.add("cells", sheet.num_cells())
+        stats.add("formulas", sheet.num_formulas())
+
+####################################################################
+def _load_excel(data, formulas=False, export_sheets=None, stats=None, sheet_filter=None, lazy=False):
+    """
+    Load the sheets from a given in-memory Excel file into a Workbook object, natively if
+    possible and with LibreOffice if not.
+
+    @param data (binary blob) The contents of an Excel file.
+
+    @param formulas (bool) If True the formulas must be read too. See
+    load_excel_libreoffice().
+
+    @param export_sheets (function) How to read the sheets with LibreOffice. See
+    load_excel_libreoffice().
+
+    @param stats (PipelineStats) Where to record the stages.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each.
+
+    @param lazy (bool) Load natively read workbooks lazily. See load_excel_libreoffice().
+
+    @return (ExcelBook object) On success return a workbook object with the read in
+    Excel workbook, on failure return None.
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+
+    # Don't try this if it is not an Excel file.
+    with stats.stage("filetype"):
+        file_type = filetype.get_file_type(data, True)
+    if (file_type not in filetype.EXCEL_TYPES):
+        print("WARNING: The file is not an Excel file (" + file_type + "). Not extracting sheets with LibreOffice.")
         return None
 
-    # Load the CSV files into Excel objects.
-    sheet_map = {}
-    for sheet_file in sheet_files:
+    # Read BIFF8 and Office 2007+ workbooks directly if we can. LibreOffice is only needed
+    # for .xlsb files, .xls formulas or if that fails.
+    if ((file_type in ("xlsx", "xlsm")) or ((file_type == "xls") and (not formulas))):
+        with stats.stage("native_read"):
+            result_book = load_excel_native(data, lazy, sheet_filter)
+        if (result_book is not None):
+            stats.add("native_reads")
+            return result_book
 
-        # Read the CSV file into a single Excel workbook object.
-        tmp_workbook = read_sheet_from_csv(sheet_file)
+    # LibreOffice only sees the unhidden copy of the file, so pick the sheets by name using
+    # the visibility and type in the original file.
+    sheet_list = []
+    if ((sheet_filter is not None) and sheet_filter.picks_by_sheet()):
+        with stats.stage("sheet_list"):
+            sheet_list = _read_sheet_list(data, file_type)
+        if (sheet_list is not None):
+            sheet_filter = sheet_filter.for_sheets(sheet_list)
 
-        # Pull the cell data for the current sheet.
-        cell_data = tmp_workbook.sheet_by_name("Sheet1").cells
-        
-        # Pull out the name of the current sheet.
-        start = sheet_file.index("--") + 2
-        end = sheet_file.rindex(".")
-        sheet_name = sheet_file[start : end]
+    # Unhide hidden Excel sheets, remembering which ones they were.
+    with stats.stage("unhide"):
+        data, hidden = _unhide_sheets(data)
+    states = dict([(sheet["name"], sheet["state"]) for sheet in hidden])
+    types = dict([(sheet["name"], sheet["type"]) for sheet in (sheet_list or []) + hidden])
+    stats.add("hidden_sheets", len(hidden))
 
-        # Pull out the index of the current sheet.
-        start = sheet_file.index("-") + 1
-        end = sheet_file[start:].index("-") + start
-        sheet_index = int(sheet_file[start : end])
-        
-        # Make a sheet with the current name and data.
-        tmp_sheet = ExcelSheet(cell_data, sheet_name)
+    # Read all the sheets. The data stays in memory.
+    try:
+        with stats.stage("export"):
+            if (export_sheets is None):
+                sheets = _export_sheets(data, stats, sheet_filter)
+            elif (sheet_filter is None):
+                sheets = export_sheets(data)
+            else:
+                sheets = export_sheets(data, sheet_filter)
+    except Exception as e:
+        print("ERROR: Exporting sheets with LibreOffice failed. " + str(e))
+        return None
+    if (sheets is None):
+        return None
 
-        # Map the sheet to its index.
-        sheet_map[sheet_index] = tmp_sheet
+    # A filter may have left out every sheet.
+    if ((len(sheets) == 0) and (sheet_filter is None)):
+        return None
 
     # Save the sheets in the proper order into a workbook.
-    result_book = ExcelBook(None)
-    for index in range(0, len(sheet_map)):
-        result_book.sheets.append(sheet_map[index])
-
-    # Delete the temp files with the CSV sheet data.
-    for sheet_file in sheet_files:
-        os.remove(sheet_file)
-
-    # Delete the temporary Excel file.
-    if os.path.isfile(out_dir):
-        os.remove(out_dir)
-        
+    with stats.stage("build_book"):
+        result_book = ExcelBook(None)
+        for sheet in sorted(sheets, key=lambda x: x["index"]):
+            new_sheet = _rows_to_sheet(sheet["cells"], sheet["name"])
+            new_sheet.state = states.get(sheet["name"], "visible")
+            new_sheet.type = types.get(sheet["name"]) or "worksheet"
+            new_sheet.truncated = list(sheet.get("truncated", []))
+            for row, col, formula in sheet.get("formulas", []):
+                new_sheet.set_formula(row, col, formula)
+            result_book.sheets.append(new_sheet)
+
     # Return the workbook.
     return result_book
 
 ####################################################################
-def read_excel_sheets(fname):
+def _read_sheet_list(data, file_type):
+    """
+    Read the names, visibility and types of the sheets of an Excel file natively.
+
+    @param data (binary blob) The contents of the Excel file.
+
+    @param file_type (str) The file type. See filetype.get_file_type().
+
+    @return (list) The {"name", "index", "state", "type"} dicts of the sheets, None if they
+    cannot be read natively (e.g. .xlsb files).
+    """
+    try:
+        if (file_type == "xls"):
+            workbook = xls_reader.XlsWorkbook(data)
+        elif (file_type in ("xlsx", "xlsm")):
+            workbook = xlsx_reader.XlsxWorkbook(data)
+        else:
+            return None
+        workbook.close()
+        return workbook.sheets
+    except Exception as e:
+        print("WARNING: Reading the Excel sheet list failed. " + str(e))
+        return None
+
+####################################################################
+def read_excel_sheets(fname, formulas=False, sheet_filter=None, lazy=False):
     """
     Read all the sheets of a given Excel file as CSV and return them as a ExcelBook object. 
     Returns None on error.
 
     @param fname (str) The name of the Excel file.
 
+    @param formulas (bool) If True make sure the cell formulas are read too. See
+    load_excel_libreoffice().
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. See
+    sheet_filter.
+
+    @param lazy (bool) Only read the cells of natively read sheets when they are first
+    used. See load_excel_libreoffice().
+
     @return (ExcelBook object) On success return a workbook object with the read in
     Excel workbook, on failure return None.
     """
@@ -207,7 +555,7 @@ def read_excel_sheets(fname):
     f = open(fname, 'rb')
     data = f.read()
     f.close()
-    return load_excel_libreoffice(data)
+    return load_excel_libreoffice(data, formulas, sheet_filter=sheet_filter, lazy=lazy)
     #except Exception as e:
     #    print(e)
     #    return None
@@ -216,49 +564,477 @@ def read_excel_sheets(fname):
 class ExcelSheet(object):
     """
     Single Excel sheet.
+
+    Only non-empty cells are stored. Each row with cells has an array of its column numbers
+    (in order) and a list of the matching values, which are interned so repeated values are
+    only stored once. Cells that are not stored but are inside the used range of the sheet
+    (nrows x ncols) read as "". Copies share the cell storage until one of them is changed.
+    state is the visibility of the sheet in the original file (visible, hidden or
+    veryHidden) and type its type (worksheet, macrosheet, ...). truncated lists why the
+    sheet is incomplete, if it is: the limits of a sheet filter that cut it short (see
+    sheet_filter), or "error" if reading its backing source failed part way.
+
+    Formula cells also have their formula (e.g. "=SUM(A1:A3)"), kept apart from the values
+    so walking only the formulas with iter_formulas() skips the value-only cells.
+
+    A sheet can also be backed by a source (e.g. a sheet of a natively read workbook). The
+    cells are then only read from the source when they are first needed. iter_cells() and
+    iter_rows() stream straight from the source without storing the cells.
     """
-    
-    def __init__(self, cells, name="Sheet1"):
+
+    __slots__ = ["name", "state", "type", "truncated", "_nrows", "_ncols", "_rows", "_formulas", "_shared", "_source", "_cells"]
+
+    def __init__(self, cells, name="Sheet1", source=None):
+        """
+        @param cells (dict or ExcelSheet) The cell values keyed by (row, col), or a sheet
+        to copy. None for an empty sheet.
+
+        @param name (str) The name of the sheet.
+
+        @param source (function) If given, called with no arguments to get a fresh iterator
+        of the (row, col, value, formula) tuples of the sheet cells. formula is None for
+        cells without a formula.
+        """
 
         # Copy constructor?
         if (isinstance(cells, ExcelSheet)):
             self.name = cells.name
-            self.cells = copy.deepcopy(cells.cells)
+            self.state = cells.state
+            self.type = cells.type
+            self.truncated = list(cells.truncated)
+            self._nrows = cells._nrows
+            self._ncols = cells._ncols
+            self._rows = cells._rows
+            self._formulas = cells._formulas
+            self._source = cells._source
+            self._cells = None
+
+            # Count the sheets sharing the storage. Whoever changes it first while it is
+            # still shared makes a private copy.
+            if (cells._shared is None):
+                cells._shared = [1]
+            cells._shared[0] += 1
+            self._shared = cells._shared
 
         # Regular constructor?
         else:
-            self.cells = cells
             self.name = name
+            self.state = "visible"
+            self.type = "worksheet"
+            self.truncated = []
+            self._nrows = 0
+            self._ncols = 0
+            self._rows = {}
+            self._formulas = {}
+            self._shared = None
+            self._source = source
+            self._cells = None
+            if (cells is not None):
+                for (row, col), val in sorted(cells.items()):
+                    self.set_cell(row, col, val)
+
+    @property
+    def nrows(self):
+        self.load()
+        return self._nrows
+
+    @nrows.setter
+    def nrows(self, val):
+        self.load()
+        self._nrows = val
+
+    @property
+    def ncols(self):
+        self.load()
+        return self._ncols
+
+    @ncols.setter
+    def ncols(self, val):
+        self.load()
+        self._ncols = val
+
+    def is_loaded(self):
+        """
+        @return (bool) True if the cells of the sheet have been read, False if they are
+        still only in the backing source.
+        """
+        return (self._source is None)
+
+    def load(self):
+        """
+        Read all of the cells from the backing source, if that has not been done yet. If
+        reading fails part way the cells read so far are kept and the sheet is marked with
+        "error" in truncated.
+        """
+        if (self._source is None):
+            return
+        source = self._source
+        self._source = None
+        try:
+            for row, col, val, formula in source():
+                self.set_cell(row, col, val)
+                if (formula is not None):
+                    self.set_formula(row, col, formula)
+        except Exception as e:
+            self._read_failed(e)
+
+    def _read_failed(self, e):
+        """
+        Mark a sheet whose backing source failed part way as cut short ("error" in
+        truncated). The warning is only printed the 1st time.
+        """
+        if ("error" not in self.truncated):
+            print("WARNING: Reading sheet '" + str(self.name) + "' failed. " + str(e))
+            self.truncated.append("error")
 
     def __repr__(self):
-        r = ""
-        r += "Sheet: " + self.name + "\n\n"
-        for cell in self.cells.keys():
-            if (len(str(self.cells[cell])) == 0):
-                continue
-            cell_content = None
+        out = io.StringIO()
+        sheet_dump.SheetWriter(out).write_sheet(self)
+        return out.getvalue()
+
+    def dump(self, out, fmt="text", printable=False):
+        """
+        Write the cells of the sheet to a file as they are walked. See sheet_dump.
+
+        @param out (file) Where to write, opened in text mode.
+
+        @param fmt (str) "text" (the repr() format), "tsv" or "jsonl".
+
+        @param printable (bool) Remove control characters from the cell values.
+        """
+        sheet_dump.SheetWriter(out, fmt, printable).write_sheet(self)
+
+    @property
+    def cells(self):
+        """
+        The cells of the sheet as a live dict-like view keyed by (row, col) (see CellMap).
+        Changing it changes the sheet.
+        """
+        if (self._cells is None):
+            self._cells = CellMap(self)
+        return self._cells
+
+    @cells.setter
+    def cells(self, cells):
+        self.load()
+        self._unshare()
+        self._rows = {}
+        self._nrows = 0
+        self._ncols = 0
+        for (row, col), val in sorted(cells.items()):
+            self.set_cell(row, col, val)
+
+    def set_cell(self, row, col, val):
+        """
+        Set the value of a cell. Setting a cell to "" or None removes it but still grows the
+        used range of the sheet.
+
+        @param row (int) The row of the cell, starting at 1.
+
+        @param col (int) The column of the cell, starting at 1.
+
+        @param val (str) The cell value.
+        """
+        if (self._source is not None):
+            self.load()
+        if (row > self._nrows):
+            self._nrows = row
+        if (col > self._ncols):
+            self._ncols = col
+
+        # Don't change cells shared with a copy of the sheet.
+        self._unshare()
+
+        entry = self._rows.get(row)
+        if ((val is None) or (len(val) == 0)):
+            if (entry is not None):
+                cols, vals = entry
+                i = bisect.bisect_left(cols, col)
+                if ((i < len(cols)) and (cols[i] == col)):
+                    cols.pop(i)
+                    vals.pop(i)
+            return
+        if isinstance(val, str):
+            val = sys.intern(val)
+        if (entry is None):
+            self._rows[row] = (array.array('i', [col]), [val])
+            return
+        cols, vals = entry
+
+        # Cells are usually added in order.
+        if (cols[-1] < col):
+            cols.append(col)
+            vals.append(val)
+            return
+        i = bisect.bisect_left(cols, col)
+        if ((i < len(cols)) and (cols[i] == col)):
+            vals[i] = val
+        else:
+            cols.insert(i, col)
+            vals.insert(i, val)
+
+    def _unshare(self):
+        """
+        Make a private copy of cell storage shared with a copy of the sheet, before it is
+        changed. Nothing is copied if the other sheets sharing it already made their own.
+        """
+        if (self._shared is None):
+            return
+        if (self._shared[0] > 1):
+            self._rows = dict([(r, (array.array(cols.typecode, cols), list(vals)))
+                               for r, (cols, vals) in self._rows.items()])
+            self._formulas = dict(self._formulas)
+            self._shared[0] -= 1
+        self._shared = None
+
+    def set_formula(self, row, col, formula):
+        """
+        Set the formula of a cell. The cell value is set separately with set_cell().
+
+        @param row (int) The row of the cell, starting at 1.
+
+        @param col (int) The column of the cell, starting at 1.
+
+        @param formula (str) The formula. "" or None removes it.
+        """
+        if (self._source is not None):
+            self.load()
+        if (row > self._nrows):
+            self._nrows = row
+        if (col > self._ncols):
+            self._ncols = col
+        self._unshare()
+        if ((formula is None) or (len(formula) == 0)):
+            self._formulas.pop((row, col), None)
+            return
+        self._formulas[(row, col)] = sys.intern(formula)
+
+    def formula(self, row, col):
+        """
+        @return (str) The formula of a cell, "" if the cell has no formula.
+        """
+        if (self._source is not None):
+            self.load()
+        return self._formulas.get((row, col), "")
+
+    def iter_formulas(self):
+        """
+        Walk only the cells of the sheet that have formulas, in row/column order. If the
+        sheet has not been loaded yet the cells are streamed from the backing source.
+
+        @return (generator) (row, col, formula, value) tuples.
+        """
+        if (self._source is not None):
+            try:
+                for row, col, val, formula in self._source():
+                    if ((formula is not None) and (len(formula) > 0)):
+                        yield (row, col, formula, val or "")
+            except Exception as e:
+                self._read_failed(e)
+            return
+        for row, col in sorted(self._formulas.keys()):
+            yield (row, col, self._formulas[(row, col)], self.cell(row, col))
+
+    def num_formulas(self):
+        """
+        @return (int) The number of cells with formulas in the sheet.
+        """
+        self.load()
+        return len(self._formulas)
+
+    def iter_cells(self, ordered=False):
+        """
+        Walk the non-empty cells of the sheet in row/column order. If the sheet has not been
+        loaded yet the cells are streamed from the backing source, in the order they are in
+        the file (row order for files written by Excel), and are not kept.
+
+        @param ordered (bool) If True always walk the cells in row/column order. A sheet that
+        is not loaded is still streamed, holding one row at a time (see
+        _iter_source_ordered()).
+
+        @return (generator) (row, col, value) tuples.
+        """
+        if ((self._source is not None) and ordered):
+            for cell in self._iter_source_ordered():
+                yield cell
+            return
+        if (self._source is not None):
             try:
-                cell_content = "\t'" + str(self.cells[cell]) + "'"
-                r += str(cell) + "\t=" + cell_content + "\n"
-            except UnicodeDecodeError:
-                cell_content = "\t'" + ''.join(filter(lambda x:x in string.printable, self.cells[cell])) + "'"
-                r += str(cell) + "\t=" + cell_content + "\n"
+                for row, col, val, _ in self._source():
+                    if ((val is not None) and (len(val) > 0)):
+                        yield (row, col, val)
+            except Exception as e:
+                self._read_failed(e)
+            return
+        for row in sorted(self._rows.keys()):
+            cols, vals = self._rows[row]
+            for i in range(0, len(cols)):
+                yield (row, cols[i], vals[i])
+
+    def _iter_source_ordered(self):
+        """
+        Stream the cells of a sheet that is not loaded in row/column order. Files written by
+        Excel and LibreOffice have their cells in row order, so only the cells of the current
+        row are held, to sort them by column. If the file goes back to an earlier row the
+        cells from there on are read into a temporary sheet and walked at the end, so a row
+        already walked can come again with the rest of its cells.
+
+        @return (generator) (row, col, value) tuples.
+        """
+        curr_row = None
+        cells = {}
+        rest = None
+        try:
+            for row, col, val, _ in self._source():
+                if ((val is None) or (len(val) == 0)):
+                    continue
+                if (rest is not None):
+                    rest.set_cell(row, col, val)
+                    continue
+                if (row != curr_row):
+                    if ((curr_row is not None) and (row < curr_row)):
+                        rest = ExcelSheet(None, self.name)
+                        rest.set_cell(row, col, val)
+                        continue
+                    for cell_col in sorted(cells.keys()):
+                        yield (curr_row, cell_col, cells[cell_col])
+                    curr_row = row
+                    cells = {}
+                cells[col] = val
+        except Exception as e:
+            self._read_failed(e)
+        for cell_col in sorted(cells.keys()):
+            yield (curr_row, cell_col, cells[cell_col])
+        if (rest is not None):
+            for cell in rest.iter_cells():
+                yield cell
+
+    def iter_rows(self, ordered=False):
+        """
+        Walk the rows of the sheet that have non-empty cells, streaming from the backing
+        source like iter_cells().
+
+        @param ordered (bool) Always walk the rows in order. See iter_cells().
+
+        @return (generator) (row, cells) tuples. cells is a list of (col, value) tuples.
+        """
+        curr_row = None
+        cells = []
+        for row, col, val in self.iter_cells(ordered):
+            if (row != curr_row):
+                if (len(cells) > 0):
+                    yield (curr_row, cells)
+                curr_row = row
+                cells = []
+            cells.append((col, val))
+        if (len(cells) > 0):
+            yield (curr_row, cells)
+
+    def num_cells(self):
+        """
+        @return (int) The number of non-empty cells in the sheet.
+        """
+        self.load()
+        return sum([len(cols) for cols, _ in self._rows.values()])
+
+    def memory_size(self):
+        """
+        Estimate the memory used by the sheet. Values shared with other sheets are counted.
+
+        @return (int) The size of the sheet in bytes.
+        """
+        self.load()
+        r = sys.getsizeof(self) + sys.getsizeof(self._rows) + sys.getsizeof(self._formulas)
+        seen = set()
+        for formula in self._formulas.values():
+            if (id(formula) not in seen):
+                seen.add(id(formula))
+                r += sys.getsizeof(formula)
+        for entry in self._rows.values():
+            cols, vals = entry
+            r += sys.getsizeof(entry) + sys.getsizeof(cols) + sys.getsizeof(vals)
+            for val in vals:
+                if (id(val) not in seen):
+                    seen.add(id(val))
+                    r += sys.getsizeof(val)
         return r
-    
+
     def cell(self, row, col):
-        if ((row, col) in self.cells):
-            return self.cells[(row, col)]
+        if (self._source is not None):
+            self.load()
+        entry = self._rows.get(row)
+        if (entry is not None):
+            cols, vals = entry
+            i = bisect.bisect_left(cols, col)
+            if ((i < len(cols)) and (cols[i] == col)):
+                return vals[i]
+        if ((1 <= row <= self._nrows) and (1 <= col <= self._ncols)):
+            return ""
         raise KeyError("Cell (" + str(row) + ", " + str(col) + ") not found.")
 
     def cell_value(self, row, col):
         return self.cell(row, col)
 
-####################################################################    
+####################################################################
+class CellMap(MutableMapping):
+    """
+    Live dict-like view of the cells of a sheet, keyed by (row, col), for code written
+    against the old ExcelSheet.cells dict. Lookups and changes go straight to the sheet
+    (ExcelSheet.cell() and ExcelSheet.set_cell()). Only non-empty cells are listed.
+    """
+
+    __slots__ = ["sheet"]
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def __getitem__(self, key):
+        row, col = key
+        return self.sheet.cell(row, col)
+
+    def __setitem__(self, key, val):
+        row, col = key
+        self.sheet.set_cell(row, col, val)
+
+    def __delitem__(self, key):
+        row, col = key
+        sheet = self.sheet
+        sheet.load()
+        entry = sheet._rows.get(row)
+        if (entry is not None):
+            cols = entry[0]
+            i = bisect.bisect_left(cols, col)
+            if ((i < len(cols)) and (cols[i] == col)):
+                sheet.set_cell(row, col, None)
+                return
+        raise KeyError(key)
+
+    def __iter__(self):
+        sheet = self.sheet
+        sheet.load()
+
+        # Walk a snapshot of the keys so cells can be changed while walking.
+        for row in sorted(sheet._rows.keys()):
+            for col in list(sheet._rows[row][0]):
+                yield (row, col)
+
+    def __len__(self):
+        return self.sheet.num_cells()
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+####################################################################
 class ExcelBook(object):
     """
-    Excel workbook containing multiple ExcelSheet objects.
+    Excel workbook containing multiple ExcelSheet objects. The sheets of lazily loaded
+    workbooks (see load_excel_native()) are only read from the file when they are first
+    used, so looking up a sheet with sheet_by_name()/sheet_by_index() and streaming it with
+    ExcelSheet.iter_rows() does not read the other sheets.
     """
-    
+
+    __slots__ = ["sheets"]
+
     def __init__(self, cells=None, name="Sheet1"):
 
         # Create empty workbook to fill in later?
@@ -270,11 +1046,17 @@ class ExcelBook(object):
         self.sheets.append(ExcelSheet(cells, name))
 
     def __repr__(self):
-        r = ""
-        for sheet in self.sheets:
-            r += str(sheet) + "\n"
-        return r
-        
+        out = io.StringIO()
+        self.dump(out)
+        return out.getvalue()
+
+    def dump(self, out, fmt="text", printable=False):
+        """
+        Write the cells of all the sheets to a file, one sheet at a time. See
+        ExcelSheet.dump().
+        """
+        sheet_dump.SheetWriter(out, fmt, printable).write_book(self)
+
     def sheet_names(self):
         r = []
         for sheet in self.sheets:
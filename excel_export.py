@@ -0,0 +1,483 @@
+"""@package excel_export
+Export the sheets of an Excel file with LibreOffice. This is Python 3.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import io
+import csv
+import string
+import tempfile
+
+# sudo pip3 install unotools
+# sudo apt install libreoffice-calc, python3-uno
+from unotools.component.calc import Calc
+from unotools.unohelper import convert_path_to_url
+
+import filetype
+import pipeline_stats
+import soffice
+import uno_streams
+import xls_reader
+
+# LibreOffice CSV export filter. The options are ',' as the field separator, '"' as the
+# text delimiter and UTF-8 as the character set.
+CSV_FILTER = "Text - txt - csv (StarCalc)"
+CSV_FILTER_OPTIONS = "44,34,76"
+
+# Maximum size of a CSV field. Obfuscated sheets can have very long cells.
+CSV_FIELD_SIZE_LIMIT = 2 ** 31 - 1
+
+# Number of sheet rows read per bulk UNO call.
+BULK_ROWS = 4096
+
+verbose = False
+
+###################################################################################################
+def is_excel_file(maldoc):
+    """
+    Check to see if the given file is an Excel file..
+
+    @param name (str) The name of the file to check.
+
+    @return (bool) True if the file is an Excel file, False if not.
+    """
+    typ = filetype.get_file_type(maldoc, False)
+    if verbose:
+        print("CHECK FILE TYPE: " + str(maldoc) + ": " + typ, file=sys.stderr)
+    return (typ in filetype.EXCEL_TYPES)
+
+###################################################################################################
+def get_component(fname, context):
+    """
+    Load the object for the Excel spreadsheet.
+    """
+    url = convert_path_to_url(fname)
+    component = Calc(context, url)
+    return component
+
+###################################################################################################
+def _csv_file_name(fname, pos, name, out_dir):
+    """
+    Make the name of the CSV file for a sheet.
+
+    @param fname (str) The name of the Excel file.
+
+    @param pos (int) The index of the sheet.
+
+    @param name (str) The name of the sheet.
+
+    @param out_dir (str) The directory the CSV file goes in.
+
+    @return (str) The full name of the CSV file.
+    """
+    if (name.count(" ") > 10):
+        name = name.replace(" ", "")
+    short_name = os.path.basename(fname)
+    outfilename =  "sheet_%s-%s--%s.csv" % (short_name, str(pos), name.replace(' ', '_SPACE_'))
+    outfilename = ''.join(filter(lambda x:x in string.printable, outfilename))
+    return os.path.join(out_dir, outfilename.replace(os.path.sep, "_"))
+
+###################################################################################################
+def get_component_from_data(data, context):
+    """
+    Load the object for an Excel spreadsheet held in memory.
+    """
+    return uno_streams.load_component(Calc, context, data)
+
+###################################################################################################
+def _with_workbook(data, context, func, stats=None):
+    """
+    Load an Excel file held in memory and run a function on it.
+
+    @param data (binary blob) The contents of the Excel file.
+
+    @param context (ScriptContext) An existing UNO connection to reuse. If None a private
+    soffice is started for this file and stopped when done. It is killed if the file goes
+    over the limits in limits, and limits.LimitExceeded is raised.
+
+    @param func (function) Called with the loaded component and the UNO connection.
+
+    @param stats (PipelineStats) Where to record the soffice start, load and close times.
+
+    @return (any) What func returned.
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+
+    # Connect to the local LibreOffice server, running our own soffice in listening mode if
+    # we were not given a connection.
+    instance = None
+    watchdog = None
+    try:
+        if (context is None):
+            instance = soffice.SofficeInstance()
+            with stats.stage("soffice_start"):
+                context = instance.start()
+            stats.add("soffice_starts")
+
+        # Load the Excel sheet straight from memory. A private soffice is killed if the file
+        # hangs it or makes it use too much memory. Shared connections are watched by
+        # their owner.
+        with soffice.Watchdog(instance) as watchdog:
+            with stats.stage("load"):
+                component = get_component_from_data(data, context)
+            try:
+                return func(component, context)
+
+            # Close the spreadsheet.
+            finally:
+                with stats.stage("close"):
+                    component.close(True)
+
+    # clean up
+    finally:
+        if (instance is not None):
+            if ((watchdog is not None) and (watchdog.peak_memory > 0)):
+                stats.peak("soffice_peak_rss", watchdog.peak_memory)
+            with stats.stage("soffice_stop"):
+                instance.stop(remove_profile=True)
+
+###################################################################################################
+def _sheet_csv(component, context, sheet):
+    """
+    Export a sheet as CSV, in memory.
+
+    @return (binary blob) The CSV data.
+    """
+    component.getCurrentController().setActiveSheet(sheet)
+    return uno_streams.store_to_memory(component, context,
+                                       'FilterName', CSV_FILTER,
+                                       'FilterOptions', CSV_FILTER_OPTIONS)
+
+###################################################################################################
+def _export_csv(data, context, stats=None, sheet_filter=None):
+    """
+    Export every sheet of an Excel file as CSV, in memory.
+
+    @param data (binary blob) The contents of the Excel file.
+
+    @param context (ScriptContext) An existing UNO connection to reuse. If None a private
+    soffice is started for this file and stopped when done.
+
+    @param stats (PipelineStats) Where to record the export times and sizes.
+
+    @param sheet_filter (SheetFilter) Which sheets to export. Only the sheet names and
+    indexes are checked, visibility and type criteria are dropped with a warning (see
+    SheetFilter.by_name_and_index()). See sheet_filter.
+
+    @return (list) A (sheet index, sheet name, CSV data) tuple for each sheet.
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+    if (sheet_filter is not None):
+        sheet_filter = sheet_filter.by_name_and_index()
+
+    def export(component, context):
+        r = []
+        sheets = component.getSheets()
+        for pos in range(0, sheets.getCount()):
+            sheet = sheets.getByIndex(pos)
+            name = sheet.getName()
+            if ((sheet_filter is not None) and (not sheet_filter.selects(pos, name))):
+                stats.add("skipped_sheets")
+                continue
+            if verbose:
+                print("LOOKING AT SHEET " + str(name), file=sys.stderr)
+            with stats.stage("csv_export"):
+                csv_data = _sheet_csv(component, context, sheet)
+            stats.add("csv_bytes", len(csv_data))
+            r.append((pos, name, csv_data))
+            if verbose:
+                print("EXPORTED CSV OF " + str(name) + " (" + str(len(csv_data)) + " bytes)", file=sys.stderr)
+        return r
+    return _with_workbook(data, context, export, stats)
+
+###################################################################################################
+def _cell_text(val):
+    """
+    Convert a value from getDataArray() to a cell string.
+    """
+    if isinstance(val, float):
+        return xls_reader.format_number(val)
+    return val
+
+###################################################################################################
+def _sheet_rows(sheet, sheet_filter=None, truncated=None):
+    """
+    Read the cell values and formulas of the used area of a sheet with a few bulk UNO calls.
+    Each block of rows is read with one getDataArray() and one getFormulaArray() call.
+
+    @param sheet (XSpreadsheet) The sheet.
+
+    @param sheet_filter (SheetFilter) Caps on the rows, columns, cells and bytes read. Only
+    the capped area is read from soffice, and reading stops at the block where the cell or
+    byte limit is hit.
+
+    @param truncated (list) Where to add the names of the limits that were hit.
+
+    @return (tuple) The rows of the sheet, starting at A1, and the formulas of the sheet.
+    Each row is a list of cell values (str) without trailing empty cells. The formulas are
+    [row, col, formula] lists, rows and columns starting at 1.
+    """
+    cursor = sheet.createCursor()
+    cursor.gotoEndOfUsedArea(False)
+    address = cursor.getRangeAddress()
+    end_row = address.EndRow
+    end_col = address.EndColumn
+    counter = None
+    if ((sheet_filter is not None) and sheet_filter.has_caps()):
+        counter = sheet_filter.counter(truncated)
+        if ((sheet_filter.max_rows is not None) and (end_row >= sheet_filter.max_rows)):
+            counter.note("rows")
+            end_row = sheet_filter.max_rows - 1
+        if ((sheet_filter.max_cols is not None) and (end_col >= sheet_filter.max_cols)):
+            counter.note("cols")
+            end_col = sheet_filter.max_cols - 1
+        if ((end_row < 0) or (end_col < 0)):
+            return ([], [])
+    rows = []
+    formulas = []
+    for start in range(0, end_row + 1, BULK_ROWS):
+        end = min(start + BULK_ROWS, end_row + 1) - 1
+        block = sheet.getCellRangeByPosition(0, start, end_col, end)
+        for row_num, row_formulas in enumerate(block.getFormulaArray()):
+            for col_num, formula in enumerate(row_formulas):
+                if formula.startswith("="):
+                    formulas.append([start + row_num + 1, col_num + 1, formula])
+        for row in block.getDataArray():
+            vals = [_cell_text(val) for val in row]
+            if (counter is not None):
+
+                # Stop at the cell where the cell or byte limit is hit.
+                for col_num, val in enumerate(vals):
+                    if (not counter.add(len(rows) + 1, col_num + 1, val)):
+                        vals = vals[:col_num]
+                        break
+            while ((len(vals) > 0) and (vals[-1] == "")):
+                vals.pop()
+            rows.append(vals)
+            if ((counter is not None) and counter.done):
+                break
+        if ((counter is not None) and counter.done):
+            last = (len(rows), len(rows[-1]))
+            formulas = [f for f in formulas if ((f[0], f[1]) <= last)]
+            break
+    while ((len(rows) > 0) and (len(rows[-1]) == 0)):
+        rows.pop()
+    return (rows, formulas)
+
+###################################################################################################
+def _read_sheets(data, context, stats=None, sheet_filter=None):
+    """
+    Read the cell values of every sheet of an Excel file with bulk UNO calls. Sheets that
+    cannot be read that way are exported as CSV instead.
+
+    @param data (binary blob) The contents of the Excel file.
+
+    @param context (ScriptContext) An existing UNO connection to reuse. If None a private
+    soffice is started for this file and stopped when done.
+
+    @param stats (PipelineStats) Where to record the read times.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. Only the
+    sheet names and indexes are checked, visibility and type criteria are dropped with a
+    warning (see SheetFilter.by_name_and_index()). See sheet_filter.
+
+    @return (list) A (sheet index, sheet name, rows, formulas, truncated) tuple for each
+    sheet. See _sheet_rows(). There are no formulas for sheets exported as CSV. truncated
+    lists the limits of the sheet filter that were hit.
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+    if (sheet_filter is not None):
+        sheet_filter = sheet_filter.by_name_and_index()
+
+    def read(component, context):
+        r = []
+        sheets = component.getSheets()
+        for pos in range(0, sheets.getCount()):
+            sheet = sheets.getByIndex(pos)
+            name = sheet.getName()
+            if ((sheet_filter is not None) and (not sheet_filter.selects(pos, name))):
+                stats.add("skipped_sheets")
+                continue
+            truncated = []
+            try:
+                with stats.stage("read_sheet"):
+                    rows, formulas = _sheet_rows(sheet, sheet_filter, truncated)
+            except Exception as e:
+                if verbose:
+                    print("BULK READ OF " + str(name) + " FAILED (" + str(e) + "). USING CSV.", file=sys.stderr)
+                with stats.stage("csv_export"):
+                    csv_data = _sheet_csv(component, context, sheet)
+                stats.add("csv_bytes", len(csv_data))
+                truncated = []
+                with stats.stage("csv_parse"):
+                    rows = parse_csv_rows(csv_data, sheet_filter, truncated)
+                formulas = []
+            r.append((pos, name, rows, formulas, truncated))
+        return r
+    return _with_workbook(data, context, read, stats)
+
+###################################################################################################
+def _read_file(fname):
+    with open(fname, 'rb') as f:
+        return f.read()
+
+###################################################################################################
+def convert_csv(fname, context=None, out_dir=None, sheet_filter=None):
+    """
+    Convert all of the sheets in a given Excel spreadsheet to CSV files.
+
+    fname - The name of the file.
+    context - An existing UNO connection to reuse. If None a private soffice is started for
+    this file and stopped when done.
+    out_dir - The directory to write the CSV files to. If None a new private temporary
+    directory is created.
+    sheet_filter - Which sheets to export and how much of each (SheetFilter). Only the
+    sheet names and indexes are checked. Capped sheets are cut short in the CSV files.
+    return - A list of the names of the CSV sheet files.
+    """
+
+    # Make sure this is an Excel file.
+    if (not is_excel_file(fname)):
+
+        # Not Excel, so no sheets.
+        if verbose:
+            print("NOT EXCEL", file=sys.stderr)
+        return []
+
+    # Write the sheets to a private directory so conversions running at the same time
+    # don't overwrite each other's CSV files.
+    if (out_dir is None):
+        out_dir = tempfile.mkdtemp(prefix="office_dumper_sheets_")
+
+    r = []
+    for pos, name, csv_data in _export_csv(_read_file(fname), context, sheet_filter=sheet_filter):
+        if ((sheet_filter is not None) and sheet_filter.has_caps()):
+            truncated = []
+            rows = parse_csv_rows(csv_data, sheet_filter, truncated)
+            if (len(truncated) > 0):
+                out = io.StringIO(newline='')
+                csv.writer(out, lineterminator="\n").writerows(rows)
+                csv_data = out.getvalue().encode('utf-8')
+        outfilename = _csv_file_name(fname, pos, name, out_dir)
+        with open(outfilename, 'wb') as f:
+            f.write(csv_data)
+        r.append(outfilename)
+        if verbose:
+            print("SAVED CSV to " + str(outfilename), file=sys.stderr)
+
+    # Done.
+    if verbose:
+        print("DONE. RETURN " + str(r), file=sys.stderr)
+    return r
+
+###################################################################################################
+def read_csv_rows(filename):
+    """
+    Read the rows of a CSV file exported by LibreOffice.
+
+    @param filename (str) The name of the CSV file.
+
+    @return (list) The rows of the CSV file. Each row is a list of cell values (str).
+    """
+    return parse_csv_rows(_read_file(filename))
+
+###################################################################################################
+def parse_csv_rows(csv_data, sheet_filter=None, truncated=None):
+    """
+    Parse CSV data exported by LibreOffice.
+
+    @param csv_data (binary blob) The UTF-8 CSV data.
+
+    @param sheet_filter (SheetFilter) Caps on the rows, columns, cells and bytes parsed.
+    Parsing stops at the first limit hit.
+
+    @param truncated (list) Where to add the names of the limits that were hit.
+
+    @return (list) The rows of the CSV data. Each row is a list of cell values (str).
+    """
+    if (csv.field_size_limit() < CSV_FIELD_SIZE_LIMIT):
+        csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+    text = csv_data.decode('utf-8', 'replace')
+    rows = csv.reader(io.StringIO(text, newline=''))
+    if ((sheet_filter is not None) and sheet_filter.has_caps()):
+        rows = sheet_filter.cap_rows(rows, truncated)
+    return [row for row in rows]
+
+###################################################################################################
+def export_sheets(fname, context=None, bulk=True, sheet_filter=None):
+    """
+    Read all of the sheets of an Excel file.
+
+    @param fname (str) The name of the Excel file.
+
+    @param context (ScriptContext) An existing UNO connection to reuse. If None a private
+    soffice is started for this file and stopped when done.
+
+    @return (list) One dict per sheet, in sheet order. Each dict has the sheet "name", the
+    sheet "index" (0 based) and the sheet "cells" as a list of rows, each row being a list
+    of cell values (str). An empty list is returned if the file is not an Excel file. See
+    export_sheets_data() for bulk and sheet_filter.
+    """
+    return export_sheets_data(_read_file(fname), context, bulk, sheet_filter=sheet_filter)
+
+###################################################################################################
+def export_sheets_data(data, context=None, bulk=True, stats=None, sheet_filter=None):
+    """
+    Read all of the sheets of an Excel file held in memory. Nothing is written to disk.
+
+    @param data (binary blob) The contents of the Excel file.
+
+    @param context (ScriptContext) An existing UNO connection to reuse. If None a private
+    soffice is started for this file and stopped when done.
+
+    @param bulk (bool) If True read the cell values of each sheet with a few bulk UNO calls
+    (numbers are not formatted). If False export each sheet with the CSV filter (cells are
+    formatted the way LibreOffice shows them).
+
+    @param stats (PipelineStats) Where to record the time spent in soffice startup, loading
+    and reading each sheet.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. Sheets are
+    only picked by name and index here, LibreOffice sees every sheet as visible once they
+    are unhidden (see excel.load_excel_libreoffice()). See sheet_filter.
+
+    @return (list) One {"name", "index", "cells", "formulas", "truncated"} dict per sheet.
+    See export_sheets(). formulas is a list of [row, col, formula] lists (only read in bulk
+    mode), rows and columns starting at 1. truncated lists the limits of the sheet filter
+    that cut the sheet short.
+    """
+
+    # Make sure this is an Excel file.
+    if (not filetype.is_excel_file(data, True)):
+
+        # Not Excel, so no sheets.
+        if verbose:
+            print("NOT EXCEL", file=sys.stderr)
+        return []
+
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+    if bulk:
+        sheets = _read_sheets(data, context, stats, sheet_filter)
+    else:
+        sheets = []
+        for index, name, csv_data in _export_csv(data, context, stats, sheet_filter):
+            truncated = []
+            with stats.stage("csv_parse"):
+                sheets.append((index, name, parse_csv_rows(csv_data, sheet_filter, truncated), [], truncated))
+    r = []
+    for index, name, rows, formulas, truncated in sheets:
+        r.append({
+            "name" : name,
+            "index" : index,
+            "cells" : rows,
+            "formulas" : formulas,
+            "truncated" : truncated,
+        })
+    return r
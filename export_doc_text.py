@@ -4,24 +4,22 @@
 # This is Python 3.
 
 # sudo apt install python3-uno
-# sudo pip3 install psutil
-import psutil
-import subprocess
-import time
+from __future__ import print_function
+import sys
+import signal
 import argparse
 import json
-import os, signal
 
 # sudo pip3 install unotools
 # sudo apt install libreoffice-calc, python3-uno
-from unotools import Socket, connect
 from unotools.component.writer import Writer
 from unotools.unohelper import convert_path_to_url
-from unotools import ConnectionError
 
-# Connection information for LibreOffice.
-HOST = "127.0.0.1"
-PORT = 2002
+import docx_reader
+import filetype
+import pipeline_stats
+import soffice
+import uno_streams
 
 ###################################################################################################
 def is_word_file(file):
@@ -32,90 +30,36 @@ def is_word_file(file):
 
     @return (bool) True if the file is a Word file, False if not.
     """
-    typ = subprocess.check_output(["file", file])
-    return ((b"Microsoft Office Word" in typ) or (b"Word 2007+" in typ))
+    return filetype.is_word_file(file, False)
 
 ###################################################################################################
-def wait_for_uno_api():
-    """
-    Sleeps until the libreoffice UNO api is available by the headless libreoffice process. Takes
-    a bit to spin up even after the OS reports the process as running. Tries 3 times before giving
-    up and throwing an Exception.
-    """
-
-    tries = 0
-
-    while tries < 3:
-        try:
-            connect(Socket(HOST, PORT))
-            return
-        except ConnectionError:
-            time.sleep(5)
-            tries += 1
-
-    raise Exception("libreoffice UNO API failed to start")
-
-###################################################################################################
-def get_office_proc():
-    """
-    Returns the process info for the headless libreoffice process. None if it's not running
-
-    @return (psutil.Process)
+def get_document(file, connection):
     """
+    Load the component containing the word document.
 
-    for proc in psutil.process_iter():
-        try:
-            pinfo = proc.as_dict(attrs=['pid', 'name', 'username'])
-        except psutil.NoSuchProcess:
-            pass
-        else:
-            if (pinfo["name"].startswith("soffice")):
-                return pinfo
-    return None
+    @param connection (ScriptContext) - connection to the headless LibreOffice process
 
-###################################################################################################
-def is_office_running():
-    """
-    Check to see if the headless libreoffice process is running.
+    @param file (str) - path to the Word doc
 
-    @return (bool) True if running False otherwise
+    @return document (Writer)
     """
 
-    return True if get_office_proc() else False
+    url = convert_path_to_url(file)
+    document = Writer(connection, url)
+    return document
 
 ###################################################################################################
-def run_soffice():
-    """
-    Start the headless, UNO supporting, libreoffice process to access the API, if it is not already
-    running.
+def get_document_from_data(data, connection):
     """
+    Load the component containing a word document held in memory.
 
-    # start the process
-    if not is_office_running():
-
-        # soffice is not running. Run it in listening mode.
-        cmd = "/usr/lib/libreoffice/program/soffice.bin --headless --invisible " + \
-              "--nocrashreport --nodefault --nofirststartwizard --nologo " + \
-              "--norestore " + \
-              '--accept="socket,host=127.0.0.1,port=2002,tcpNoDelay=1;urp;StarOffice.ComponentContext"'
-        subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True)
-        wait_for_uno_api()
-
-###################################################################################################
-def get_document(file, connection):
-    """
-    Load the component containing the word document.
+    @param data (binary blob) - the contents of the Word doc
 
     @param connection (ScriptContext) - connection to the headless LibreOffice process
 
-    @param file (str) - path to the Word doc
-
     @return document (Writer)
     """
-
-    url = convert_path_to_url(file)
-    document = Writer(connection, url)
-    return document
+    return uno_streams.load_component(Writer, connection, data)
 
 ###################################################################################################
 def get_text(document):
@@ -141,48 +85,218 @@ def get_tables(document):
         text tables of the document
     """
 
-    data_array_list = []
-
+    # UNO has no call returning the data of every table at once, so walk the tables once
+    # and get the whole data array of each one in a single call.
     text_tables = document.getTextTables()
-    table_count = 0
-    while table_count < text_tables.getCount():
-        data_array_list.append(text_tables.getByIndex(table_count).getDataArray())
-        table_count += 1
+    return [[list(row) for row in table.getDataArray()] for table in _iter_elements(text_tables)]
 
-    return data_array_list
+###################################################################################################
+def _iter_elements(container):
+    """
+    Walk the elements of a UNO enumeration access container.
+    """
+    enumeration = container.createEnumeration()
+    while enumeration.hasMoreElements():
+        yield enumeration.nextElement()
 
+###################################################################################################
+def _uno_date(date):
+    """
+    Convert a UNO DateTime to an ISO 8601 string, None if the date is not set.
+    """
+    if ((date is None) or (date.Year == 0)):
+        return None
+    return "%04d-%02d-%02dT%02d:%02d:%02d" % (date.Year, date.Month, date.Day,
+                                              date.Hours, date.Minutes, date.Seconds)
+
+###################################################################################################
+def get_metadata(document):
+    """
+    Get the basic document properties of the word doc.
+
+    @param document (Writer) - LibreOffice component containing the document
+
+    @return metadata (dict) - the same fields as docx_reader.DocxDocument.get_metadata(), None
+        for properties the document does not have
+    """
+    props = document.getDocumentProperties()
+    r = {
+        "title" : props.Title,
+        "subject" : props.Subject,
+        "author" : props.Author,
+        "keywords" : ", ".join(props.Keywords),
+        "description" : props.Description,
+        "last_modified_by" : props.ModifiedBy,
+        "created" : _uno_date(props.CreationDate),
+        "modified" : _uno_date(props.ModificationDate),
+        "generator" : props.Generator,
+    }
+    for name in r.keys():
+        if (r[name] == ""):
+            r[name] = None
+    return r
 
-arg_parser = argparse.ArgumentParser(description="export text from various properties in a Word "
-                                                 "document via the LibreOffice API")
-arg_parser.add_argument("--tables", action="store_true",
-                                   help="export a list of 2D lists containing the cell contents"
-                                        "of each text table in the document")
-arg_parser.add_argument("--text", action="store_true",
-                                   help="export a string containing the document text")
-arg_parser.add_argument("-f", "--file", action="store", required=True,
-                                   help="path to the word doc")
-args = arg_parser.parse_args()
+###################################################################################################
+def read_word_native(data):
+    """
+    Read the text, tables and metadata of a Word 2007+ file without LibreOffice.
 
+    @param data (binary blob) - the contents of the Word doc
 
-# Make sure this is a word file.
-if (not is_word_file(args.file)):
+    @return result (dict) - see export_word_all(), None if the file could not be read natively.
+    """
+    return docx_reader.read_document(data)
 
-    # Not Word, so no text.
-    exit()
+###################################################################################################
+def export_word(file, text=False, tables=False, context=None):
+    """
+    Export the text or the tables of a given Word file.
+
+    @param file (str) - path to the Word doc
 
-# Run soffice in listening mode if it is not already running.
-run_soffice()
+    @param text (bool) - export the document text
 
-# Connect to the local LibreOffice server.
-connection = connect(Socket(HOST, PORT))
+    @param tables (bool) - export the text tables (only if text is False)
 
-# Load the document using the connection
-document = get_document(args.file, connection)
+    @param context (ScriptContext) - existing connection to the headless LibreOffice process to
+        reuse. If None a private soffice is started for this file and stopped when done.
 
-if args.text:
-    print(get_text(document))
-elif args.tables:
-    print(json.dumps(get_tables(document)))
+    @return result (str or list) - the document text, the list of table data arrays, or None if
+        the file is not a Word file or nothing was asked for. Results are saved in the
+        result cache, if one is configured (see result_cache).
+    """
+    if ((not text) and (not tables)):
+        return None
+    result = export_word_all(file, context)
+    if (result is None):
+        return None
+    if text:
+        return result["text"]
+    return result["tables"]
 
-# clean up
-os.kill(get_office_proc()["pid"], signal.SIGTERM)
+###################################################################################################
+def export_word_all(file, context=None, stats=None):
+    """
+    Export the text, the tables and the basic metadata of a given Word file, loading the
+    document only once.
+
+    @param file (str) - path to the Word doc
+
+    @param context (ScriptContext) - existing connection to the headless LibreOffice process to
+        reuse. If None a private soffice is started for this file and stopped when done.
+
+    @param stats (PipelineStats) - where to record the time spent in each stage and the byte,
+        table and soffice start counts. It is finished when this returns.
+
+    @return result (dict) - {"text": document text, "tables": list of table data arrays,
+        "metadata": dict of document properties (see get_metadata())}, None if the file is
+        not a Word file. Results are saved in the result cache, if one is configured (see
+        result_cache).
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+
+    # Word 2007+ documents are read natively, LibreOffice is only needed for binary .doc
+    # files or if that fails.
+    def export_word(data):
+        return export_word_data(data, context, stats)
+    return docx_reader.load_word(file, export_word, stats)
+
+###################################################################################################
+def export_word_data(data, context=None, stats=None):
+    """
+    Export the text, tables and metadata of an in-memory Word file with LibreOffice.
+
+    @param data (binary blob) - the contents of the Word doc
+
+    @param context (ScriptContext) - existing connection to the headless LibreOffice process to
+        reuse. If None a private soffice is started for this file and stopped when done.
+
+    @param stats (PipelineStats) - where to record the time spent in each stage.
+
+    @return result (dict) - see export_word_all().
+    """
+    if (stats is None):
+        stats = pipeline_stats.PipelineStats()
+
+    # Connect to the local LibreOffice server, running our own soffice in listening mode if
+    # we were not given a connection.
+    instance = None
+    watchdog = None
+    result = None
+    try:
+        if (context is None):
+            instance = soffice.SofficeInstance()
+            with stats.stage("soffice_start"):
+                context = instance.start()
+            stats.add("soffice_starts")
+
+        # Load the document from memory using the connection, and get everything from it.
+        # A private soffice is killed if the document hangs it or makes it use too much
+        # memory.
+        with soffice.Watchdog(instance) as watchdog:
+            with stats.stage("load"):
+                document = get_document_from_data(data, context)
+            try:
+                with stats.stage("text"):
+                    text = get_text(document)
+                with stats.stage("tables"):
+                    tables = get_tables(document)
+                with stats.stage("metadata"):
+                    metadata = get_metadata(document)
+                result = {
+                    "text" : text,
+                    "tables" : tables,
+                    "metadata" : metadata,
+                }
+            finally:
+                with stats.stage("close"):
+                    document.close(True)
+
+    # clean up
+    finally:
+        if (instance is not None):
+            if ((watchdog is not None) and (watchdog.peak_memory > 0)):
+                stats.peak("soffice_peak_rss", watchdog.peak_memory)
+            with stats.stage("soffice_stop"):
+                instance.stop(remove_profile=True)
+    return result
+
+
+if __name__ == "__main__":
+
+    # Stop soffice and remove its profile when killed with SIGTERM.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    arg_parser = argparse.ArgumentParser(description="export text from various properties in a Word "
+                                                     "document via the LibreOffice API")
+    arg_parser.add_argument("--tables", action="store_true",
+                            help="export a list of 2D lists containing the cell contents"
+                                 "of each text table in the document")
+    arg_parser.add_argument("--text", action="store_true",
+                            help="export a string containing the document text")
+    arg_parser.add_argument("--json", action="store_true",
+                            help="export the text and the tables as one JSON object, loading "
+                                 "the document once")
+    arg_parser.add_argument("--all", action="store_true",
+                            help="export the text, the tables and the document metadata as one "
+                                 "JSON object, loading the document once")
+    arg_parser.add_argument("-f", "--file", action="store", required=True,
+                            help="path to the word doc")
+    args = arg_parser.parse_args()
+
+    if (args.all or args.json):
+        result = export_word_all(args.file)
+        if (result is None):
+            exit()
+        if (not args.all):
+            del result["metadata"]
+        print(json.dumps(result))
+        exit()
+    result = export_word(args.file, text=args.text, tables=args.tables)
+    if (result is None):
+        exit()
+    if args.text:
+        print(result)
+    elif args.tables:
+        print(json.dumps(result))
@@ -1,42 +1,165 @@
 """@package filetype
 Check for Office file types
+
+Files are classified in process by their magic number and, for OLE and ZIP containers, by
+the streams in the OLE directory or the content types of the ZIP package. No external
+tools (file, exiftool) are run.
 """
 
 from __future__ import print_function
 
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import ole
+
 # Office magic numbers.
 magic_nums = {
-    "office97" : "D0 CF 11 E0 A1 B1 1A E1",    # Office 97
-    "office2007" : "50 4B 3 4",                # Office 2007+ (PKZip)
+    "office97" : ole.OLE_MAGIC,                  # Office 97
+    "office2007" : b"PK\x03\x04",                # Office 2007+ (PKZip)
 }
 
+# Precise file types returned by get_file_type().
+EXCEL_TYPES = ("xls", "xlsx", "xlsm", "xlsb")
+WORD_TYPES = ("doc", "docx", "docm")
+
+# Top level OLE streams saying what an Office 97-2003 file is.
+OLE_STREAM_TYPES = [
+    ("workbook", "xls"),
+    ("book", "xls"),
+    ("worddocument", "doc"),
+]
+
+# Content types of the main part of Office 2007+ packages. Templates and add-ins are
+# reported as the matching document type.
+CONTENT_TYPES = {
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml" : "xlsx",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.template.main+xml" : "xlsx",
+    "application/vnd.ms-excel.sheet.macroEnabled.main+xml" : "xlsm",
+    "application/vnd.ms-excel.template.macroEnabled.main+xml" : "xlsm",
+    "application/vnd.ms-excel.addin.macroEnabled.main+xml" : "xlsm",
+    "application/vnd.ms-excel.sheet.binary.macroEnabled.main" : "xlsb",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml" : "docx",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml" : "docx",
+    "application/vnd.ms-word.document.macroEnabled.main+xml" : "docm",
+    "application/vnd.ms-word.template.macroEnabledTemplate.main+xml" : "docm",
+}
+
+# Main parts to look for if a package has no usable [Content_Types].xml.
+MAIN_PARTS = [
+    ("xl/workbook.xml", "xlsx"),
+    ("xl/workbook.bin", "xlsb"),
+    ("word/document.xml", "docx"),
+]
+
+# Largest [Content_Types].xml that is parsed.
+MAX_CONTENT_TYPES_SIZE = 1024 * 1024
+
+def _is_data(fname, is_data):
+    """
+    Figure out if we were given file contents or a file name. Contents are always bytes, so
+    a str is always a file name, however long.
+    """
+    return (is_data or isinstance(fname, (bytes, bytearray)))
+
 def get_1st_8_bytes(fname, is_data):
+    """
+    Get the magic number of a file.
 
-    info = None
-    is_data = (is_data or (len(fname) > 200))
-    if (not is_data):
-        try:
-            tmp = open(fname, 'rb')
-            tmp.close()
-        except:
-            is_data = True
-    if (not is_data):
-        with open(fname, 'rb') as f:
-            info = f.read(8)
-    else:
-        info = fname[:9]
-
-    curr_magic = ""
-    for b in info:
-        byte_val = b
+    return - The 1st 8 bytes of the file (binary blob). Empty if the file cannot be read.
+    """
+    if (not _is_data(fname, is_data)):
         try:
-            byte_val = ord(b)
-        except TypeError:
-            pass
-        curr_magic += hex(byte_val).replace("0x", "").upper() + " "
-        
-    return curr_magic
-    
+            with open(fname, 'rb') as f:
+                return f.read(8)
+        except (IOError, OSError):
+            return b""
+    return bytes(fname[:8])
+
+def _ole_type(data):
+    """
+    Classify an OLE file by its top level streams.
+    """
+    try:
+        names = set([path[0].lower() for path in ole.OleFile(data).list_streams() if (len(path) == 1)])
+    except Exception:
+        return "other"
+    for name, typ in OLE_STREAM_TYPES:
+        if (name in names):
+            return typ
+    return "other"
+
+def _zip_type(zip_file):
+    """
+    Classify a ZIP file by the content types of its parts.
+    """
+    try:
+        z = zipfile.ZipFile(zip_file)
+    except Exception:
+        return "other"
+    try:
+        names = set(z.namelist())
+        if ("[Content_Types].xml" in names):
+            info = z.getinfo("[Content_Types].xml")
+            if (info.file_size <= MAX_CONTENT_TYPES_SIZE):
+                try:
+                    root = ET.fromstring(z.read(info))
+                except Exception:
+                    root = []
+                for elem in root:
+                    typ = CONTENT_TYPES.get(elem.get("ContentType", "").strip())
+                    if (typ is not None):
+                        return typ
+        for part, typ in MAIN_PARTS:
+            if (part in names):
+                return typ
+        return "other"
+    finally:
+        z.close()
+
+def get_file_type(fname, is_data):
+    """
+    Find out what kind of Office file the given file is.
+
+    return - "xls", "xlsx", "xlsm", "xlsb", "doc", "docx", "docm" or "other".
+    """
+    is_data = _is_data(fname, is_data)
+    magic = get_1st_8_bytes(fname, is_data)
+    if (magic == magic_nums["office97"]):
+
+        # Only the header, the FAT and the directory sectors are read.
+        if (not is_data):
+            try:
+                with open(fname, 'rb') as f:
+                    return _ole_type(ole.FileBlob(f))
+            except (IOError, OSError):
+                return "other"
+        return _ole_type(fname)
+    if (magic.startswith(magic_nums["office2007"])):
+
+        # Only the ZIP directory and [Content_Types].xml are read.
+        if is_data:
+            fname = io.BytesIO(fname)
+        return _zip_type(fname)
+    return "other"
+
+def is_excel_file(fname, is_data):
+    """
+    Check to see if the given file is an Excel workbook.
+
+    return - True if it is an Excel file, False if not.
+    """
+    return (get_file_type(fname, is_data) in EXCEL_TYPES)
+
+def is_word_file(fname, is_data):
+    """
+    Check to see if the given file is a Word document.
+
+    return - True if it is a Word file, False if not.
+    """
+    return (get_file_type(fname, is_data) in WORD_TYPES)
+
 def is_office_file(fname, is_data):
     """
     Check to see if the given file is a MS Office file format.
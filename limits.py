@@ -0,0 +1,53 @@
+"""@package limits
+Per-document limits for LibreOffice conversions. A document that makes soffice run longer
+or use more memory than this gets its soffice killed and is reported as failed.
+
+The limits are configured with environment variables:
+
+OFFICE_DUMPER_TIMEOUT     Wall-clock seconds allowed per document (default 120, 0 for none).
+OFFICE_DUMPER_MAX_MEMORY  Bytes of resident memory soffice may use while working on a
+                          document (default 2GB, 0 for none).
+"""
+
+from __future__ import print_function
+
+import os
+
+# Default limits.
+DEFAULT_TIMEOUT = 120
+DEFAULT_MAX_MEMORY = 2 * 1024 * 1024 * 1024
+
+# Time allowed for starting soffice, on top of the document timeout, when a whole conversion
+# runs in a child process.
+STARTUP_TIMEOUT = 60
+
+DOC_TIMEOUT = float(os.environ.get("OFFICE_DUMPER_TIMEOUT", DEFAULT_TIMEOUT))
+MAX_MEMORY = int(os.environ.get("OFFICE_DUMPER_MAX_MEMORY", DEFAULT_MAX_MEMORY))
+
+####################################################################
+class LimitExceeded(Exception):
+    """
+    A document went over its time or memory limit.
+    """
+    pass
+
+####################################################################
+def process_rss(pid):
+    """
+    Get the resident memory of a process.
+
+    @param pid (int) The process ID.
+
+    @return (int) The resident set size in bytes, None if it cannot be read (no /proc).
+    """
+    try:
+        f = open("/proc/" + str(pid) + "/status", "r")
+        try:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
@@ -0,0 +1,344 @@
+"""@package office_async
+asyncio API for Excel and Word extraction.
+
+async with office_async.AsyncExtractor(concurrency=8) as extractor:
+    book = await extractor.read_excel_sheets("invoice.xlsm")
+    word = await extractor.export_word_all("letter.doc")
+
+At most concurrency documents are worked on at once, however many are awaited, and the
+native readers run on a pool of that many threads. LibreOffice conversions are done with
+asyncio socket I/O to the conversion service (see office_service) if it is running, and
+with an asyncio subprocess running the export scripts if not. Cancelling an extraction
+stops its conversion: the service cancels the job when the client disconnects (killing
+its soffice if the job is running), and the export script is killed together with its
+soffice.
+
+This is Python 3.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import base64
+import signal
+import asyncio
+import functools
+import threading
+import concurrent.futures
+
+import docx_reader
+import excel
+import limits
+import office_service
+import pipeline_stats
+import userdirs
+
+# Where the export scripts are.
+_thismodule_dir = os.path.normpath(os.path.abspath(os.path.dirname(__file__)))
+
+# Seconds a cancelled export script gets to stop its soffice and clean up before it is
+# killed.
+KILL_GRACE = 5
+
+# Longest conversion service reply line read.
+MAX_REPLY_SIZE = 2 ** 31 - 1
+
+# What send_request() raises if the conversion service is not running (or is run by
+# another user), in which case the export scripts are used instead.
+SERVICE_UNAVAILABLE = office_service.SERVICE_UNAVAILABLE
+
+###################################################################################################
+async def send_request(req, socket_path=None):
+    """
+    Send a single request to the conversion service and wait for the reply. Cancelling this
+    closes the connection, which makes the service cancel the conversion.
+
+    @param req (dict) The request. See office_service.
+
+    @param socket_path (str) The Unix socket of the service. Uses
+    office_service.DEFAULT_SOCKET if None.
+
+    @return (any) The result of the request. An Exception is raised if the service reports
+    an error. One of SERVICE_UNAVAILABLE is raised, before anything is sent, if there is no
+    service of the current user to send it to.
+    """
+    if (socket_path is None):
+        socket_path = office_service.DEFAULT_SOCKET
+    reader, writer = await asyncio.open_unix_connection(socket_path, limit=MAX_REPLY_SIZE)
+    try:
+        problem = userdirs.check_peer(writer.get_extra_info("socket"), socket_path)
+        if (problem is not None):
+            print("WARNING: Not using the conversion service. " + problem + ".", file=sys.stderr)
+            raise PermissionError("Not using the conversion service. " + problem + ".")
+        writer.write(json.dumps(req).encode("utf-8") + b"\n")
+        await writer.drain()
+        line = await reader.readline()
+    finally:
+        writer.close()
+    return office_service.parse_reply(line)
+
+###################################################################################################
+async def _kill(proc):
+    """
+    Stop an export script and the soffice it started. They run in their own process group.
+    """
+    if (proc.returncode is not None):
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            os.killpg(proc.pid, signal.SIGKILL)
+            await proc.wait()
+    except ProcessLookupError:
+        pass
+
+async def run_script(script, args, data=None, timeout=None):
+    """
+    Run one of the export scripts. Cancelling this, or running over the timeout, kills the
+    script and its soffice.
+
+    @param script (str) The name of the script.
+
+    @param args (list) The script arguments.
+
+    @param data (bytes) What to write to the script's stdin, if anything.
+
+    @param timeout (float) Seconds the script may run. No limit if None.
+
+    @return (bytes) What the script wrote to stdout.
+    """
+    stdin = asyncio.subprocess.DEVNULL
+    if (data is not None):
+        stdin = asyncio.subprocess.PIPE
+    proc = await asyncio.create_subprocess_exec("python3", os.path.join(_thismodule_dir, script), *args,
+                                                stdin=stdin, stdout=asyncio.subprocess.PIPE,
+                                                start_new_session=True)
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(data), timeout)
+    except asyncio.TimeoutError:
+        await _kill(proc)
+        raise Exception("Running " + script + " timed out.")
+    except BaseException:
+        await _kill(proc)
+        raise
+    if (proc.returncode != 0):
+        raise Exception("Running " + script + " failed. Exit code " + str(proc.returncode) + ".")
+    return output
+
+###################################################################################################
+class _LoopBridge(object):
+    """
+    Lets a blocking call running in a worker thread await coroutines on the event loop, and
+    cancels them if the extraction is cancelled.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.futures = []
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def run(self, coro):
+        """
+        Run a coroutine on the event loop and wait for its result, from a worker thread.
+        """
+        with self.lock:
+            if self.cancelled:
+                coro.close()
+                raise concurrent.futures.CancelledError()
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+            self.futures.append(future)
+        return future.result()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            for future in self.futures:
+                future.cancel()
+
+###################################################################################################
+class AsyncExtractor(object):
+    """
+    Runs Excel and Word extractions from asyncio code with a limit on how many run at once.
+    """
+
+    def __init__(self, concurrency=None, socket_path=None, timeout=None):
+        """
+        @param concurrency (int) The number of documents worked on at once. Defaults to the
+        number of CPUs.
+
+        @param socket_path (str) The Unix socket of the conversion service. Uses
+        office_service.DEFAULT_SOCKET if None.
+
+        @param timeout (float) Seconds an export script may run when there is no conversion
+        service. Defaults to the document timeout plus the soffice startup time (see limits).
+        """
+        if (concurrency is None):
+            concurrency = os.cpu_count() or 1
+        if ((timeout is None) and (limits.DOC_TIMEOUT > 0)):
+            timeout = limits.DOC_TIMEOUT + limits.STARTUP_TIMEOUT
+        self.concurrency = concurrency
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Stop the native reader threads once their current work is done.
+        """
+        self._executor.shutdown(wait=False)
+
+    def _limit(self):
+        # Made on first use so it belongs to the running event loop.
+        if (self._semaphore is None):
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _in_thread(self, func, *args):
+        """
+        Run a blocking extraction in a worker thread, once fewer than concurrency
+        extractions are running. func is called with a _LoopBridge followed by args.
+
+        A cancelled extraction keeps its place until its thread is really done, so
+        cancelling doesn't let more than concurrency extractions run at once.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._limit()
+        await semaphore.acquire()
+        def release(future):
+            try:
+                loop.call_soon_threadsafe(semaphore.release)
+            except RuntimeError:
+
+                # The event loop is closed, nobody is waiting any more.
+                pass
+        bridge = _LoopBridge(loop)
+        try:
+            future = self._executor.submit(functools.partial(func, bridge, *args))
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(release)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            bridge.cancel()
+            raise
+
+    async def export_sheets(self, data, sheet_filter=None):
+        """
+        Read all the sheets of an Excel file with LibreOffice.
+
+        @param data (bytes) The contents of the Excel file.
+
+        @param sheet_filter (SheetFilter) Which sheets to read and how much of each. See
+        sheet_filter.
+
+        @return (list) One {"name", "index", "cells", "formulas"} dict per sheet. See
+        excel_export.export_sheets_data().
+        """
+        req = {
+            "op" : "excel_sheets",
+            "data" : base64.b64encode(data).decode("ascii"),
+        }
+        if (sheet_filter is not None):
+            req["filter"] = sheet_filter.to_dict()
+        try:
+            return await send_request(req, self.socket_path)
+        except SERVICE_UNAVAILABLE:
+            pass
+        args = ["--json"]
+        if (sheet_filter is not None):
+            args += sheet_filter.to_args()
+        output = await run_script("export_all_excel_sheets.py", args + ["-"], data, self.timeout)
+        return json.loads(output)
+
+    def _load_excel(self, bridge, data, formulas, stats, sheet_filter):
+        def export_sheets(data, sheet_filter=None):
+            return bridge.run(self.export_sheets(data, sheet_filter))
+        return excel.load_excel_libreoffice(data, formulas, export_sheets, stats, sheet_filter)
+
+    async def load_excel(self, data, formulas=False, stats=None, sheet_filter=None):
+        """
+        Load the sheets of an in-memory Excel file. See excel.load_excel_libreoffice().
+
+        @param data (bytes) The contents of the Excel file.
+
+        @param formulas (bool) Make sure the cell formulas are read too.
+
+        @param stats (PipelineStats) Where to record the extraction stages.
+
+        @param sheet_filter (SheetFilter) Which sheets to read and how much of each.
+
+        @return (ExcelBook object) The workbook, None on failure.
+        """
+        return await self._in_thread(self._load_excel, data, formulas, stats, sheet_filter)
+
+    async def read_excel_sheets(self, fname, formulas=False, stats=None, sheet_filter=None):
+        """
+        Read all the sheets of an Excel file. See excel.read_excel_sheets().
+
+        @return (ExcelBook object) The workbook, None on failure.
+        """
+        def load(bridge):
+            f = open(fname, 'rb')
+            data = f.read()
+            f.close()
+            return self._load_excel(bridge, data, formulas, stats, sheet_filter)
+
+        return await self._in_thread(load)
+
+    async def export_word(self, fname):
+        """
+        Export the text, tables and metadata of a Word file with LibreOffice.
+
+        @param fname (str) The name of the Word file.
+
+        @return (dict) See export_doc_text.export_word_all(), None if the file is not a
+        Word file.
+        """
+        fname = os.path.abspath(fname)
+        try:
+            return await send_request({"op" : "word_all", "file" : fname}, self.socket_path)
+        except SERVICE_UNAVAILABLE:
+            pass
+        output = await run_script("export_doc_text.py", ["--all", "-f", fname], None, self.timeout)
+        if (len(output.strip()) == 0):
+            return None
+        return json.loads(output)
+
+    async def export_word_all(self, fname, stats=None):
+        """
+        Export the text, the tables and the metadata of a Word file. Word 2007+ files are
+        read natively, LibreOffice is only used for the others. See
+        export_doc_text.export_word_all().
+
+        @param fname (str) The name of the Word file.
+
+        @param stats (PipelineStats) Where to record the extraction stages. It is finished
+        when this returns.
+
+        @return (dict) {"text", "tables", "metadata"}, None if the file is not a Word file.
+        """
+        if (stats is None):
+            stats = pipeline_stats.PipelineStats()
+
+        def export(bridge):
+            def export_word(data):
+                with stats.stage("export"):
+                    return bridge.run(self.export_word(fname))
+            return docx_reader.load_word(fname, export_word, stats)
+
+        return await self._in_thread(export)
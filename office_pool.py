@@ -0,0 +1,383 @@
+"""@package office_pool
+Pool of headless soffice instances. LibreOffice is effectively single threaded per process,
+so conversions are spread over several soffice processes, each with its own port and user
+profile, to use all of the cores of a host.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import base64
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import limits
+import sheet_filter
+import soffice
+
+# Default number of queued requests allowed per worker before submit() blocks.
+QUEUE_DEPTH_PER_WORKER = 4
+
+verbose = False
+
+###################################################################################################
+def run_request(req, context, stats=None):
+    """
+    Run a single conversion request with a given UNO connection.
+
+    @param req (dict) The request. See office_service for the request format.
+
+    @param context (ScriptContext) The UNO connection to use.
+
+    @param stats (PipelineStats) Where to record the conversion stages.
+
+    @return (any) The result of the conversion.
+    """
+
+    # Import the converters here so only pool workers need unotools.
+    import excel_export
+    import export_doc_text
+
+    op = req.get("op")
+    fname = req.get("file")
+    sheets = sheet_filter.SheetFilter.from_dict(req.get("filter"))
+    if (op == "excel"):
+        return excel_export.convert_csv(fname, context=context, out_dir=req.get("out_dir"),
+                                        sheet_filter=sheets)
+    if (op == "excel_sheets"):
+        if ("data" in req):
+
+            # In-process requests can pass the file contents as is.
+            data = req["data"]
+            if (not isinstance(data, (bytes, bytearray))):
+                data = base64.b64decode(data)
+            return excel_export.export_sheets_data(data, context=context, stats=stats, sheet_filter=sheets)
+        return excel_export.export_sheets(fname, context=context, sheet_filter=sheets)
+    if (op == "word_all"):
+        if ("data" in req):
+
+            # In-process requests pass the file contents of documents the caller already
+            # failed to read natively, so only LibreOffice is tried.
+            data = req["data"]
+            if (not isinstance(data, (bytes, bytearray))):
+                data = base64.b64decode(data)
+            return export_doc_text.export_word_data(data, context=context, stats=stats)
+        return export_doc_text.export_word_all(fname, context=context, stats=stats)
+    if (op == "word"):
+        return export_doc_text.export_word(fname,
+                                           text=req.get("text", False),
+                                           tables=req.get("tables", False),
+                                           context=context)
+    raise ValueError("Unknown request op '" + str(op) + "'.")
+
+###################################################################################################
+def _round(seconds):
+    if (seconds is None):
+        return None
+    return round(seconds, 3)
+
+###################################################################################################
+class JobCancelled(Exception):
+    """
+    The job was cancelled before it finished.
+    """
+    pass
+
+###################################################################################################
+class Job(object):
+    """
+    A conversion request waiting for a pool worker.
+    """
+
+    def __init__(self, req, stats=None):
+        self.req = req
+        self.stats = stats
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.submitted = time.perf_counter()
+
+        # Set by WorkerPool.cancel(). worker is the worker running the job, if any.
+        self.cancelled = False
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Wait for the job to finish.
+
+        @return (any) The result of the conversion. The conversion error is raised if it failed.
+        """
+        self.done.wait()
+        if (self.error is not None):
+            raise self.error
+        return self.result
+
+###################################################################################################
+class Worker(threading.Thread):
+    """
+    Thread owning one soffice instance and running jobs from the pool queue on it.
+    """
+
+    def __init__(self, pool, instance):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.pool = pool
+        self.instance = instance
+        self.current_file = None
+        self.num_done = 0
+        self.num_failed = 0
+        self.num_restarts = 0
+        self.num_killed = 0
+        self.num_cancelled = 0
+        self.busy_time = 0.0
+
+    def stats(self):
+        """
+        @return (dict) Statistics for this worker.
+        """
+        return {
+            "port" : self.instance.port,
+            "pid" : self.instance.pid(),
+            "running" : self.instance.is_running(),
+            "current_file" : self.current_file,
+            "done" : self.num_done,
+            "failed" : self.num_failed,
+            "restarts" : self.num_restarts,
+            "killed" : self.num_killed,
+            "cancelled" : self.num_cancelled,
+            "startup_seconds" : _round(self.instance.startup_seconds),
+            "total_startup_seconds" : round(self.instance.total_startup_seconds, 3),
+            "busy_seconds" : round(self.busy_time, 3),
+        }
+
+    def restart(self, stats=None):
+        """
+        Restart the soffice instance of this worker.
+
+        @param stats (PipelineStats) The stats of the job the restart is done for.
+        """
+        if verbose:
+            print("RESTARTING " + str(self.instance), file=sys.stderr)
+        self.instance.stop()
+        self.instance.start()
+        self.num_restarts += 1
+        if (stats is not None):
+            stats.add("soffice_restarts")
+            stats.add_time("soffice_start", self.instance.startup_seconds)
+
+    def watched_request(self, req, stats=None):
+        """
+        Run a request on this worker's soffice, killing soffice if the document goes over the
+        pool's time or memory limits.
+
+        @param req (dict) The request.
+
+        @param stats (PipelineStats) Where to record the conversion stages.
+
+        @return (any) The result of the conversion.
+        """
+        watchdog = soffice.Watchdog(self.instance, self.pool.timeout, self.pool.max_memory)
+        try:
+            with watchdog:
+                return run_request(req, self.instance.context, stats)
+        finally:
+            if ((stats is not None) and (watchdog.peak_memory > 0)):
+                stats.peak("soffice_peak_rss", watchdog.peak_memory)
+
+    def run_job(self, job):
+        """
+        Run a single job, restarting soffice and retrying once if the conversion fails
+        because soffice went away. A document that goes over its limits is not retried, it
+        fails its job and soffice is restarted for the next one.
+
+        @param job (Job) The job to run.
+        """
+        if (job.stats is not None):
+            job.stats.add_time("queue_wait", time.perf_counter() - job.submitted)
+        try:
+            if job.cancelled:
+                raise JobCancelled("Job cancelled.")
+            if ((self.instance.context is None) or (not self.instance.is_running())):
+                self.restart(job.stats)
+            try:
+                job.result = self.watched_request(job.req, job.stats)
+            except (ValueError, limits.LimitExceeded):
+                raise
+            except Exception as e:
+                if job.cancelled:
+                    raise JobCancelled("Job cancelled.")
+                if self.instance.is_running():
+                    raise
+                if verbose:
+                    print("SOFFICE DIED, RETRYING. " + str(e), file=sys.stderr)
+                self.restart(job.stats)
+                job.result = self.watched_request(job.req, job.stats)
+            self.num_done += 1
+        except limits.LimitExceeded as e:
+            if verbose:
+                print("KILLED ON " + str(job.req.get("file")) + ". " + str(e), file=sys.stderr)
+            job.error = e
+            self.num_failed += 1
+            self.num_killed += 1
+        except JobCancelled as e:
+            job.error = e
+            self.num_cancelled += 1
+        except Exception as e:
+            job.error = e
+            self.num_failed += 1
+
+    def run(self):
+        while True:
+            job = self.pool.jobs.get()
+            if (job is None):
+                break
+            with job.lock:
+                job.worker = self
+            self.current_file = job.req.get("file")
+            start = time.time()
+            try:
+                self.run_job(job)
+            finally:
+                self.busy_time += time.time() - start
+                self.current_file = None
+                with job.lock:
+                    job.worker = None
+                    job.done.set()
+        self.instance.stop(remove_profile=True)
+
+###################################################################################################
+class WorkerPool(object):
+    """
+    Pool of soffice worker instances sharing a bounded queue of conversion jobs. Jobs are run
+    by whichever worker is idle first.
+    """
+
+    def __init__(self, size=None, queue_depth=None, base_port=None,
+                 timeout=None, max_memory=None):
+        """
+        @param size (int) The number of soffice instances. Defaults to the number of CPUs.
+
+        @param queue_depth (int) The maximum number of jobs waiting for a worker. Defaults to
+        QUEUE_DEPTH_PER_WORKER jobs per worker.
+
+        @param base_port (int) The port of the 1st instance. Instance i uses base_port + i,
+        and fails to start if that port is already in use. Each instance uses a free port if
+        None.
+
+        @param timeout (float) Wall-clock seconds allowed per job before soffice is killed.
+        Defaults to limits.DOC_TIMEOUT. 0 for no limit.
+
+        @param max_memory (int) Resident bytes soffice may use while running a job. Defaults
+        to limits.MAX_MEMORY. 0 for no limit.
+        """
+        if (size is None):
+            size = os.cpu_count() or 1
+        if (queue_depth is None):
+            queue_depth = size * QUEUE_DEPTH_PER_WORKER
+        self.size = size
+        self.queue_depth = queue_depth
+        self.timeout = limits.DOC_TIMEOUT if (timeout is None) else timeout
+        self.max_memory = limits.MAX_MEMORY if (max_memory is None) else max_memory
+        self.jobs = queue.Queue(maxsize=queue_depth)
+        self.workers = []
+        for i in range(0, size):
+            port = None if (base_port is None) else (base_port + i)
+            instance = soffice.SofficeInstance(port=port)
+            self.workers.append(Worker(self, instance))
+
+    def start(self):
+        """
+        Start all of the soffice instances and the worker threads. The instances start side
+        by side, so the pool is ready about as fast as a single instance.
+        """
+        errors = []
+        def start_instance(instance):
+            try:
+                instance.start()
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=start_instance, args=(worker.instance,))
+                   for worker in self.workers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if (len(errors) > 0):
+            for worker in self.workers:
+                worker.instance.stop(remove_profile=True)
+            raise errors[0]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """
+        Stop the worker threads and their soffice instances once the queued jobs are done.
+        """
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def submit(self, req, stats=None):
+        """
+        Queue a conversion request. Blocks if the queue is full.
+
+        @param req (dict) The request.
+
+        @param stats (PipelineStats) Where to record the time waiting for a worker, soffice
+        restarts and the conversion stages.
+
+        @return (Job) The queued job. Call wait() on it to get the result.
+        """
+        job = Job(req, stats)
+        self.jobs.put(job)
+        return job
+
+    def cancel(self, job):
+        """
+        Cancel a job. A queued job is dropped when a worker gets to it. A running job has
+        its soffice killed, which fails the conversion right away, and the worker restarts
+        soffice for its next job.
+
+        @param job (Job) The job to cancel.
+        """
+        with job.lock:
+            if job.done.is_set():
+                return
+            job.cancelled = True
+            if (job.worker is not None):
+                if verbose:
+                    print("CANCELLING JOB ON " + str(job.worker.instance), file=sys.stderr)
+                job.worker.instance.kill()
+
+    def run(self, req, stats=None):
+        """
+        Queue a conversion request and wait for the result.
+
+        @param req (dict) The request.
+
+        @param stats (PipelineStats) See submit().
+
+        @return (any) The result of the conversion.
+        """
+        return self.submit(req, stats).wait()
+
+    def stats(self):
+        """
+        @return (dict) Statistics for the pool and each of its workers.
+        """
+        return {
+            "size" : self.size,
+            "queue_depth" : self.queue_depth,
+            "queued" : self.jobs.qsize(),
+            "timeout" : self.timeout,
+            "max_memory" : self.max_memory,
+            "workers" : [worker.stats() for worker in self.workers],
+        }
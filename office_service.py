@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""@package office_service
+Long running document conversion service. A pool of resident headless LibreOffice processes
+is started once and their UNO connections are reused for every document, so callers only pay
+for loading and exporting the document instead of starting soffice per file.
+
+Requests are sent over a local Unix socket as a single line of JSON and the reply is a
+single line of JSON.
+
+Request:  {"op": "excel", "file": "/path/to/file", "out_dir": "/path/to/csv/dir"}
+          {"op": "excel_sheets", "file": "/path/to/file"}
+          {"op": "excel_sheets", "data": "<base64 file contents>"}
+          {"op": "excel_sheets", "data": "...", "filter": {"names": ["Macro1"], "max_cells": 1000}}
+          {"op": "word", "file": "/path/to/file", "text": true, "tables": false}
+          {"op": "word_all", "file": "/path/to/file"}
+          {"op": "stats"}
+Reply:    {"ok": true, "result": ...}
+          {"ok": false, "error": "..."}
+
+The socket is in a directory only the current user can use ($XDG_RUNTIME_DIR, or
+/tmp/office_dumper-<uid> created with mode 0700). Clients only talk to a service run by the
+same user, and the service only takes requests from processes of its own user.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import base64
+import select
+import socket
+import threading
+import argparse
+
+import userdirs
+
+# Where the service listens by default.
+DEFAULT_SOCKET = os.environ.get("OFFICE_DUMPER_SOCKET",
+                                os.path.join(userdirs.runtime_dir(), "office_dumper.sock"))
+
+# What send_request() raises if the service is not running (or is run by another user),
+# before anything is sent.
+SERVICE_UNAVAILABLE = (FileNotFoundError, ConnectionRefusedError, PermissionError)
+
+# How often the service checks that a client waiting for a conversion is still there, in
+# seconds.
+CLIENT_CHECK_INTERVAL = 0.2
+
+verbose = False
+
+###################################################################################################
+def service_available(socket_path=None):
+    """
+    Check to see if the conversion service is listening. A socket served by another user
+    is ignored, with a warning.
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @return (bool) True if a service of the current user is accepting connections, False
+    if not.
+    """
+    if (socket_path is None):
+        socket_path = DEFAULT_SOCKET
+    if (not os.path.exists(socket_path)):
+        return False
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+        problem = userdirs.check_peer(s, socket_path)
+        if (problem is not None):
+            print("WARNING: Not using the conversion service. " + problem + ".", file=sys.stderr)
+            return False
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+###################################################################################################
+def send_request(req, socket_path=None):
+    """
+    Send a single request to the conversion service and wait for the reply.
+
+    @param req (dict) The request to send.
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @return (any) The result of the request. An Exception is raised if the service reports
+    an error. One of SERVICE_UNAVAILABLE is raised, before anything is sent, if there is no
+    service of the current user to send it to.
+    """
+    if (socket_path is None):
+        socket_path = DEFAULT_SOCKET
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+        problem = userdirs.check_peer(s, socket_path)
+        if (problem is not None):
+            print("WARNING: Not using the conversion service. " + problem + ".", file=sys.stderr)
+            raise PermissionError("Not using the conversion service. " + problem + ".")
+        s.sendall(json.dumps(req).encode("utf-8") + b"\n")
+        f = s.makefile("rb")
+        line = f.readline()
+        f.close()
+    finally:
+        s.close()
+    return parse_reply(line)
+
+###################################################################################################
+def parse_reply(line):
+    """
+    Parse the reply line of the conversion service.
+
+    @param line (bytes) The reply line.
+
+    @return (any) The result of the request. An Exception is raised if the service reports
+    an error.
+    """
+    if (len(line) == 0):
+        raise Exception("Conversion service closed the connection without replying.")
+    reply = json.loads(line.decode("utf-8"))
+    if (not reply.get("ok", False)):
+        raise Exception("Conversion service failed. " + str(reply.get("error")))
+    return reply.get("result")
+
+###################################################################################################
+def convert_excel(fname, out_dir=None, socket_path=None, sheet_filter=None):
+    """
+    Convert all of the sheets of an Excel file to CSV files with the conversion service.
+
+    @param fname (str) The name of the Excel file.
+
+    @param out_dir (str) The directory to write the CSV files to. If None the service writes
+    them to a new private temporary directory.
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @param sheet_filter (SheetFilter) Which sheets to convert and how much of each. See
+    sheet_filter.
+
+    @return (list) The names of the CSV sheet files.
+    """
+    req = {
+        "op" : "excel",
+        "file" : os.path.abspath(fname),
+        "out_dir" : out_dir,
+    }
+    if (sheet_filter is not None):
+        req["filter"] = sheet_filter.to_dict()
+    return send_request(req, socket_path)
+
+###################################################################################################
+def export_excel_sheets(fname, socket_path=None, data=None, sheet_filter=None):
+    """
+    Read all of the sheets of an Excel file with the conversion service.
+
+    @param fname (str) The name of the Excel file. Ignored if data is given.
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @param data (binary blob) The contents of the Excel file. They are sent over the socket
+    so the file does not have to be on disk.
+
+    @param sheet_filter (SheetFilter) Which sheets to read and how much of each. See
+    sheet_filter.
+
+    @return (list) One {"name", "index", "cells"} dict per sheet. See
+    excel_export.export_sheets().
+    """
+    req = {
+        "op" : "excel_sheets",
+    }
+    if (sheet_filter is not None):
+        req["filter"] = sheet_filter.to_dict()
+    if (data is not None):
+        req["data"] = base64.b64encode(data).decode("ascii")
+    else:
+        req["file"] = os.path.abspath(fname)
+    return send_request(req, socket_path)
+
+###################################################################################################
+def export_word(fname, text=False, tables=False, socket_path=None):
+    """
+    Export the text or the tables of a Word file with the conversion service.
+
+    @param fname (str) The name of the Word file.
+
+    @param text (bool) Export the document text.
+
+    @param tables (bool) Export the text tables (only if text is False).
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @return (str or list) The document text or the list of table data arrays, None if the
+    file is not a Word file.
+    """
+    req = {
+        "op" : "word",
+        "file" : os.path.abspath(fname),
+        "text" : text,
+        "tables" : tables,
+    }
+    return send_request(req, socket_path)
+
+###################################################################################################
+def export_word_all(fname, socket_path=None):
+    """
+    Export the text, the tables and the metadata of a Word file with the conversion service,
+    loading the document once.
+
+    @param fname (str) The name of the Word file.
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @return (dict) The {"text", "tables", "metadata"} result (see
+    export_doc_text.export_word_all()), None if the file is not a Word file.
+    """
+    req = {
+        "op" : "word_all",
+        "file" : os.path.abspath(fname),
+    }
+    return send_request(req, socket_path)
+
+###################################################################################################
+def get_stats(socket_path=None):
+    """
+    Get the pool and per worker statistics of the conversion service.
+
+    @param socket_path (str) The Unix socket of the service. Uses DEFAULT_SOCKET if None.
+
+    @return (dict) The service statistics.
+    """
+    return send_request({"op" : "stats"}, socket_path)
+
+###################################################################################################
+class OfficeService(object):
+    """
+    Resident conversion service handing requests to a pool of soffice instances.
+    """
+
+    def __init__(self, socket_path=None, pool_size=None, queue_depth=None, base_port=None,
+                 timeout=None, max_memory=None):
+        import office_pool
+        if (socket_path is None):
+            socket_path = DEFAULT_SOCKET
+        self.socket_path = socket_path
+        self.pool = office_pool.WorkerPool(pool_size, queue_depth, base_port,
+                                           timeout=timeout, max_memory=max_memory)
+
+    def _client_gone(self, conn):
+        """
+        @return (bool) True if the client closed its end of the connection.
+        """
+        readable, _, _ = select.select([conn], [], [], 0)
+        if (len(readable) == 0):
+            return False
+        try:
+            return (len(conn.recv(1, socket.MSG_PEEK)) == 0)
+        except socket.error:
+            return True
+
+    def run_request(self, req, conn):
+        """
+        Run a conversion request on the pool. If the client goes away before it is done the
+        conversion is cancelled, killing its soffice if it is already running.
+
+        @param req (dict) The request.
+
+        @param conn (socket) The client connection.
+
+        @return (any) The result of the conversion.
+        """
+        job = self.pool.submit(req)
+        while (not job.done.wait(CLIENT_CHECK_INTERVAL)):
+            if self._client_gone(conn):
+                if verbose:
+                    print("CLIENT WENT AWAY, CANCELLING " + str(req.get("file")), file=sys.stderr)
+                self.pool.cancel(job)
+                break
+        return job.wait()
+
+    def handle(self, conn):
+        """
+        Read one request from a client connection and write back the reply.
+
+        @param conn (socket) The client connection.
+        """
+        uid = userdirs.peer_uid(conn)
+        if ((uid is not None) and (uid != os.getuid())):
+            print("WARNING: Refusing request from uid " + str(uid) + ".", file=sys.stderr)
+            return
+        f = conn.makefile("rwb")
+        try:
+            line = f.readline()
+            if (len(line) == 0):
+                return
+            try:
+                req = json.loads(line.decode("utf-8"))
+                if verbose:
+                    print("REQUEST: " + str(req), file=sys.stderr)
+                if (req.get("op") == "stats"):
+                    result = self.pool.stats()
+                else:
+                    result = self.run_request(req, conn)
+                reply = {"ok" : True, "result" : result}
+            except Exception as e:
+                reply = {"ok" : False, "error" : str(e)}
+            f.write(json.dumps(reply).encode("utf-8") + b"\n")
+            f.flush()
+        finally:
+            f.close()
+
+    def _handle_conn(self, conn):
+        try:
+            self.handle(conn)
+        except Exception as e:
+            print("ERROR: Handling request failed. " + str(e), file=sys.stderr)
+        finally:
+            conn.close()
+
+    def serve_forever(self):
+        """
+        Listen on the service socket and hand each request to the soffice pool.
+        """
+
+        # Start soffice up front so the first request doesn't pay for it.
+        self.pool.start()
+
+        # Listen for requests. Each client gets a thread that waits on its job, the
+        # actual conversions are limited by the pool size.
+        socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+        if (socket_dir == os.path.dirname(DEFAULT_SOCKET)):
+            userdirs.private_dir(socket_dir)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only this user may connect, wherever the socket is.
+        old_umask = os.umask(0o077)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(128)
+        if verbose:
+            print("LISTENING ON " + self.socket_path, file=sys.stderr)
+        try:
+            while True:
+                conn, _ = server.accept()
+                t = threading.Thread(target=self._handle_conn, args=(conn,))
+                t.daemon = True
+                t.start()
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.pool.stop()
+
+
+if __name__ == "__main__":
+
+    arg_parser = argparse.ArgumentParser(description="run a resident LibreOffice conversion "
+                                                     "service for Excel and Word documents")
+    arg_parser.add_argument("-s", "--socket", action="store", default=DEFAULT_SOCKET,
+                            help="path of the Unix socket to listen on")
+    arg_parser.add_argument("-w", "--workers", action="store", type=int, default=None,
+                            help="number of soffice instances to run (default: number of CPUs)")
+    arg_parser.add_argument("-q", "--queue-depth", action="store", type=int, default=None,
+                            help="maximum number of requests waiting for a soffice instance")
+    arg_parser.add_argument("-p", "--base-port", action="store", type=int, default=None,
+                            help="port of the 1st soffice instance, the others use the following "
+                                 "ports (default: a free port per instance)")
+    arg_parser.add_argument("-t", "--timeout", action="store", type=float, default=None,
+                            help="seconds allowed per document before its soffice is killed "
+                                 "(default: $OFFICE_DUMPER_TIMEOUT or 120, 0 for no limit)")
+    arg_parser.add_argument("-m", "--max-memory", action="store", type=int, default=None,
+                            help="bytes of memory soffice may use per document before it is killed "
+                                 "(default: $OFFICE_DUMPER_MAX_MEMORY or 2GB, 0 for no limit)")
+    arg_parser.add_argument("--stats", action="store_true",
+                            help="print the statistics of a running service and exit")
+    arg_parser.add_argument("-v", "--verbose", action="store_true",
+                            help="print debug information to stderr")
+    args = arg_parser.parse_args()
+    verbose = args.verbose
+
+    if args.stats:
+        print(json.dumps(get_stats(args.socket), indent=4))
+        sys.exit(0)
+
+    import office_pool
+    import soffice
+    office_pool.verbose = verbose
+    soffice.verbose = verbose
+    OfficeService(args.socket, args.workers, args.queue_depth, args.base_port,
+                  timeout=args.timeout, max_memory=args.max_memory).serve_forever()
@@ -0,0 +1,293 @@
+"""@package ole
+Minimal reader for OLE2 compound files (the Office 97-2003 container format). Only what is
+needed to find and read streams is implemented.
+"""
+
+from __future__ import print_function
+
+import struct
+
+# OLE2 magic number.
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# Special sector numbers.
+FREESECT = 0xFFFFFFFF
+ENDOFCHAIN = 0xFFFFFFFE
+FATSECT = 0xFFFFFFFD
+DIFSECT = 0xFFFFFFFC
+MAXREGSECT = 0xFFFFFFFA
+
+# Directory entry types.
+STGTY_EMPTY = 0
+STGTY_STORAGE = 1
+STGTY_STREAM = 2
+STGTY_ROOT = 5
+
+NOSTREAM = 0xFFFFFFFF
+
+####################################################################
+class FileBlob(object):
+    """
+    Read-only view of an open file that can be sliced like a binary blob, so an OleFile
+    can be read from a file without loading all of it. Only the sectors that are used are
+    read.
+    """
+
+    def __init__(self, f):
+        """
+        @param f (file) The file, opened in binary mode. It must be seekable.
+        """
+        self.f = f
+        f.seek(0, 2)
+        self.size = f.tell()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if (not isinstance(index, slice)):
+            raise TypeError("FileBlob only supports slices.")
+        start, stop, _ = index.indices(self.size)
+        if (stop <= start):
+            return b""
+        self.f.seek(start)
+        return self.f.read(stop - start)
+
+    def startswith(self, prefix):
+        return (self[:len(prefix)] == prefix)
+
+####################################################################
+class DirEntry(object):
+    """
+    Entry in the directory of an OLE file.
+    """
+
+    def __init__(self, sid, data):
+        self.sid = sid
+        name_len = struct.unpack_from("<H", data, 64)[0]
+        if (name_len > 64):
+            name_len = 64
+        self.name = data[:max(name_len - 2, 0)].decode("utf-16-le", "replace")
+        self.type = data[66]
+        if (not isinstance(self.type, int)):
+            self.type = ord(self.type)
+        self.left, self.right, self.child = struct.unpack_from("<III", data, 68)
+        self.start = struct.unpack_from("<I", data, 116)[0]
+        self.size = struct.unpack_from("<Q", data, 120)[0]
+
+    def __repr__(self):
+        return "DirEntry(" + repr(self.name) + ", type=" + str(self.type) + ", size=" + str(self.size) + ")"
+
+####################################################################
+class OleFile(object):
+    """
+    Compound file read from an in-memory blob.
+    """
+
+    def __init__(self, data):
+        """
+        @param data (binary blob) The contents of the OLE file, or a FileBlob to only read
+        the parts of a file that are used.
+        """
+        if ((len(data) < 512) or (not data.startswith(OLE_MAGIC))):
+            raise ValueError("Not an OLE file.")
+        self.data = data
+
+        # Read the header.
+        header = data[:512]
+        sector_shift, mini_sector_shift = struct.unpack_from("<HH", header, 30)
+        if ((sector_shift < 7) or (sector_shift > 16) or (mini_sector_shift > sector_shift)):
+            raise ValueError("Bad OLE sector sizes.")
+        self.sector_size = 1 << sector_shift
+        self.mini_sector_size = 1 << mini_sector_shift
+        num_fat_sectors, dir_start = struct.unpack_from("<II", header, 44)
+        self.mini_stream_cutoff, mini_fat_start, num_mini_fat_sectors, difat_start, num_difat_sectors = \
+            struct.unpack_from("<IIIII", header, 56)
+
+        # Read the FAT, using the DIFAT to find its sectors.
+        fat_sectors = list(struct.unpack_from("<109I", header, 76))
+        sect = difat_start
+        seen = set()
+        ids_per_sector = self.sector_size // 4
+        while ((sect <= MAXREGSECT) and (sect not in seen) and (len(seen) < num_difat_sectors)):
+            seen.add(sect)
+            ids = struct.unpack("<" + str(ids_per_sector) + "I", self._sector(sect))
+            fat_sectors.extend(ids[:-1])
+            sect = ids[-1]
+        fat_data = b"".join([self._sector(s) for s in fat_sectors[:num_fat_sectors] if (s <= MAXREGSECT)])
+        self.fat = struct.unpack("<" + str(len(fat_data) // 4) + "I", fat_data[:len(fat_data) // 4 * 4])
+
+        # Read the directory.
+        dir_data = self._read_chain(dir_start)
+        self.entries = []
+        for i in range(0, len(dir_data) // 128):
+            entry = DirEntry(i, dir_data[i * 128 : (i + 1) * 128])
+
+            # Version 3 files only use the low 32 bits of the stream size.
+            if (self.sector_size == 512):
+                entry.size &= 0xFFFFFFFF
+            self.entries.append(entry)
+        if ((len(self.entries) == 0) or (self.entries[0].type != STGTY_ROOT)):
+            raise ValueError("No OLE root directory entry.")
+        self.root = self.entries[0]
+
+        # Read the MiniFAT. The mini stream is only read when a small stream is.
+        self.mini_fat = ()
+        self._mini_stream = None
+        if (num_mini_fat_sectors > 0):
+            mini_fat_data = self._read_chain(mini_fat_start)
+            self.mini_fat = struct.unpack("<" + str(len(mini_fat_data) // 4) + "I",
+                                          mini_fat_data[:len(mini_fat_data) // 4 * 4])
+
+    @property
+    def mini_stream(self):
+        """
+        The data of the mini stream holding the small streams.
+        """
+        if (self._mini_stream is None):
+            self._mini_stream = b""
+            if (len(self.mini_fat) > 0):
+                self._mini_stream = self._read_chain(self.root.start, self.root.size)
+        return self._mini_stream
+
+    def _sector(self, sect):
+        """
+        Get the data of a sector.
+
+        @param sect (int) The sector number.
+
+        @return (binary blob) The sector data.
+        """
+        start = (sect + 1) * self.sector_size
+        if (start >= len(self.data)):
+            raise ValueError("OLE sector " + str(sect) + " is past the end of the file.")
+        return self.data[start : start + self.sector_size]
+
+    def _chain(self, start, fat):
+        """
+        Follow a sector chain.
+
+        @param start (int) The 1st sector of the chain.
+
+        @param fat (tuple) The FAT or MiniFAT holding the chain.
+
+        @return (list) The sector numbers of the chain.
+        """
+        r = []
+        sect = start
+        while (sect <= MAXREGSECT):
+            if ((sect >= len(fat)) or (len(r) > len(fat))):
+                raise ValueError("Bad OLE sector chain.")
+            r.append(sect)
+            sect = fat[sect]
+        return r
+
+    def _read_chain(self, start, size=None):
+        """
+        Read the data of a regular sector chain.
+
+        @param start (int) The 1st sector of the chain.
+
+        @param size (int) The number of bytes to return. All of the chain if None.
+
+        @return (binary blob) The chain data.
+        """
+        r = b"".join([self._sector(s) for s in self._chain(start, self.fat)])
+        if (size is not None):
+            r = r[:size]
+        return r
+
+    def stream_offsets(self, entry):
+        """
+        Get where the sectors of a stream are in the file, so the stream can be patched in
+        place.
+
+        @param entry (DirEntry) The stream.
+
+        @return (list) The file offset of each sector of the stream, and the sector size.
+        """
+        if (entry.size < self.mini_stream_cutoff):
+            mini_stream_sectors = self._chain(self.root.start, self.fat)
+            per_sector = self.sector_size // self.mini_sector_size
+            r = []
+            for mini_sect in self._chain(entry.start, self.mini_fat):
+                offset = mini_sect * self.mini_sector_size
+                sect = mini_stream_sectors[offset // self.sector_size]
+                r.append((sect + 1) * self.sector_size + (mini_sect % per_sector) * self.mini_sector_size)
+            return (r, self.mini_sector_size)
+        return ([(s + 1) * self.sector_size for s in self._chain(entry.start, self.fat)], self.sector_size)
+
+    def read_entry(self, entry):
+        """
+        Read the data of a stream.
+
+        @param entry (DirEntry) The stream.
+
+        @return (binary blob) The stream data.
+        """
+        if (entry.size < self.mini_stream_cutoff):
+            sectors = self._chain(entry.start, self.mini_fat)
+            size = self.mini_sector_size
+            r = b"".join([self.mini_stream[s * size : (s + 1) * size] for s in sectors])
+            return r[:entry.size]
+        return self._read_chain(entry.start, entry.size)
+
+    def list_streams(self):
+        """
+        @return (list) The paths of all the streams in the file, as lists of names.
+        """
+        return [path for path, _ in self._stream_entries()]
+
+    def _stream_entries(self):
+        """
+        @return (list) (path, DirEntry) tuples for all the streams in the file.
+        """
+        r = []
+        self._walk(self.root.child, [], r, set())
+        return r
+
+    def _walk(self, sid, path, r, seen):
+        """
+        Walk the red-black trees of the storages, collecting streams. This is done without
+        recursion since hostile files can have very deep trees.
+        """
+        todo = [(sid, path)]
+        while (len(todo) > 0):
+            sid, path = todo.pop()
+            if ((sid == NOSTREAM) or (sid >= len(self.entries)) or (sid in seen)):
+                continue
+            seen.add(sid)
+            entry = self.entries[sid]
+            if (entry.type == STGTY_STREAM):
+                r.append((path + [entry.name], entry))
+            elif (entry.type == STGTY_STORAGE):
+                todo.append((entry.child, path + [entry.name]))
+            todo.append((entry.right, path))
+            todo.append((entry.left, path))
+
+    def find_entry(self, name):
+        """
+        Find a top level stream by name, ignoring case.
+
+        @param name (str) The name of the stream.
+
+        @return (DirEntry) The stream entry, None if there is no such stream.
+        """
+        name = name.lower()
+        for path, entry in self._stream_entries():
+            if ((len(path) == 1) and (path[0].lower() == name)):
+                return entry
+        return None
+
+    def read_stream(self, name):
+        """
+        Read a top level stream by name, ignoring case.
+
+        @param name (str) The name of the stream.
+
+        @return (binary blob) The stream data, None if there is no such stream.
+        """
+        entry = self.find_entry(name)
+        if (entry is None):
+            return None
+        return self.read_entry(entry)
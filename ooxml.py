@@ -0,0 +1,170 @@
+"""@package ooxml
+Helpers for reading the parts of Office 2007+ (Open XML) ZIP packages.
+"""
+
+from __future__ import print_function
+
+import io
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+# Relationship type of the main document part, without the (transitional or strict)
+# namespace prefix.
+REL_OFFICE_DOCUMENT = "/officeDocument"
+
+# Relationship types of the document property parts.
+REL_CORE_PROPERTIES = "/core-properties"
+REL_EXTENDED_PROPERTIES = "/extended-properties"
+
+# Metadata names of the core properties we report.
+CORE_PROPERTIES = {
+    "title" : "title",
+    "subject" : "subject",
+    "creator" : "author",
+    "keywords" : "keywords",
+    "description" : "description",
+    "lastModifiedBy" : "last_modified_by",
+    "created" : "created",
+    "modified" : "modified",
+}
+
+# Document metadata fields, as returned by OoxmlPackage.read_metadata().
+METADATA_FIELDS = ["title", "subject", "author", "keywords", "description",
+                   "last_modified_by", "created", "modified", "generator"]
+
+####################################################################
+def local_name(tag):
+    """
+    Strip the namespace from an XML tag or attribute name.
+
+    @param tag (str) The tag, maybe in '{namespace}name' form.
+
+    @return (str) The name without the namespace.
+    """
+    if (tag[:1] == "{"):
+        return tag[tag.index("}") + 1:]
+    return tag
+
+####################################################################
+def get_attrib(elem, name):
+    """
+    Get an attribute of an element by local name, ignoring its namespace.
+
+    @param elem (Element) The XML element.
+
+    @param name (str) The local name of the attribute.
+
+    @return (str) The attribute value, None if the element does not have it.
+    """
+    for key in elem.attrib:
+        if (local_name(key) == name):
+            return elem.attrib[key]
+    return None
+
+####################################################################
+class OoxmlPackage(object):
+    """
+    Open XML ZIP package.
+    """
+
+    def __init__(self, data):
+        """
+        @param data (binary blob) The contents of the package.
+        """
+        try:
+            self.zip = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipfile as e:
+            raise ValueError("Not a ZIP file. " + str(e))
+        self.names = set(self.zip.namelist())
+
+    def read_rels(self, part_path):
+        """
+        Read the relationships of a part.
+
+        @param part_path (str) The path of the part. "" for the package relationships.
+
+        @return (list) (relationship ID, type, target path) tuples. External targets are
+        skipped.
+        """
+        base = posixpath.dirname(part_path)
+        rels_path = posixpath.join(base, "_rels", posixpath.basename(part_path) + ".rels")
+        r = []
+        if (rels_path not in self.names):
+            return r
+        root = ET.fromstring(self.zip.read(rels_path))
+        for rel in root:
+            if (local_name(rel.tag) != "Relationship"):
+                continue
+            if (rel.get("TargetMode") == "External"):
+                continue
+            target = rel.get("Target", "")
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(base, target))
+            r.append((rel.get("Id"), rel.get("Type", ""), target))
+        return r
+
+    def main_part(self, default):
+        """
+        Find the main document part of the package.
+
+        @param default (str) The usual path of the main part, used if the package
+        relationships don't say.
+
+        @return (str) The path of the main part, None if it is not in the package.
+        """
+        r = default
+        for _, rel_type, target in self.read_rels(""):
+            if rel_type.endswith(REL_OFFICE_DOCUMENT):
+                r = target
+                break
+        if (r not in self.names):
+            return None
+        return r
+
+    def _find_part(self, rel_suffix, default):
+        """
+        Find a package level part by relationship type.
+        """
+        for _, rel_type, target in self.read_rels(""):
+            if rel_type.endswith(rel_suffix):
+                return target if (target in self.names) else None
+        if (default in self.names):
+            return default
+        return None
+
+    def read_metadata(self):
+        """
+        Read the basic document properties (docProps/core.xml and docProps/app.xml).
+
+        @return (dict) The METADATA_FIELDS values. Properties the document does not have
+        are None.
+        """
+        r = dict([(name, None) for name in METADATA_FIELDS])
+        core_path = self._find_part(REL_CORE_PROPERTIES, "docProps/core.xml")
+        if (core_path is not None):
+            for child in ET.fromstring(self.zip.read(core_path)):
+                name = CORE_PROPERTIES.get(local_name(child.tag))
+                if (name is not None):
+                    r[name] = child.text
+        app_path = self._find_part(REL_EXTENDED_PROPERTIES, "docProps/app.xml")
+        if (app_path is not None):
+            for child in ET.fromstring(self.zip.read(app_path)):
+                if (local_name(child.tag) == "Application"):
+                    r["generator"] = child.text
+        return r
+
+    def open(self, path):
+        """
+        Open a part for streaming.
+
+        @param path (str) The path of the part.
+
+        @return (file) The part contents.
+        """
+        return self.zip.open(path)
+
+    def close(self):
+        self.zip.close()
@@ -0,0 +1,170 @@
+"""@package pipeline_stats
+Timing and resource statistics of single extraction calls. Each call to
+excel.load_excel_libreoffice() or export_doc_text.export_word_all() fills a PipelineStats
+object with the time spent in each stage and counters like the number of bytes, sheets,
+cells and soffice restarts:
+
+stats = pipeline_stats.PipelineStats()
+book = excel.load_excel_libreoffice(data, stats=stats)
+print(stats.to_dict())
+
+{"kind": "excel", "status": "ok", "seconds": 0.41,
+ "stages": {"filetype": 0.0001, "unhide": 0.002, "soffice_start": 0.31, "load": 0.06, ...},
+ "counts": {"input_bytes": 28160, "sheets": 3, "cells": 1200, "soffice_starts": 1, ...}}
+
+Listeners added with add_listener() get the stats of every finished call, to export them
+to a metrics system. If the OFFICE_DUMPER_STATS_LOG environment variable is set, the stats
+of every call are also appended to that file as JSON lines. Recording only costs a few
+clock reads per stage, so it is always on.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import threading
+
+# Functions called with every finished PipelineStats object.
+_listeners = []
+_listeners_lock = threading.Lock()
+
+####################################################################
+def add_listener(func):
+    """
+    Call a function with the PipelineStats of every finished extraction call.
+
+    @param func (function) Called with the PipelineStats object. It runs in the thread
+    that did the extraction, so it should be quick.
+    """
+    with _listeners_lock:
+        _listeners.append(func)
+
+def remove_listener(func):
+    with _listeners_lock:
+        if (func in _listeners):
+            _listeners.remove(func)
+
+####################################################################
+class _Stage(object):
+    """
+    Times a with block as a stage of a PipelineStats.
+    """
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+####################################################################
+class PipelineStats(object):
+    """
+    Statistics of one extraction call.
+    """
+
+    def __init__(self, callback=None):
+        """
+        @param callback (function) Called with the stage name and its duration in seconds
+        every time a stage ends.
+        """
+        self.kind = None
+        self.status = None
+        self.seconds = None
+        self.stages = {}
+        self.counts = {}
+        self.callback = callback
+        self._start = time.perf_counter()
+
+    def __repr__(self):
+        return "PipelineStats(" + json.dumps(self.to_dict()) + ")"
+
+    def stage(self, name):
+        """
+        Time a stage. Times of stages run several times (like reading each sheet) add up.
+
+        with stats.stage("load"):
+            ...
+
+        @param name (str) The stage name.
+        """
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds):
+        """
+        Add time to a stage.
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if (self.callback is not None):
+            self.callback(name, seconds)
+
+    def add(self, name, num=1):
+        """
+        Add to a counter.
+        """
+        self.counts[name] = self.counts.get(name, 0) + num
+
+    def peak(self, name, value):
+        """
+        Keep the highest value seen for a counter, like a peak memory size.
+        """
+        self.counts[name] = max(self.counts.get(name, value), value)
+
+    def finish(self, kind, status="ok"):
+        """
+        Record the end of the extraction call and hand the stats to the listeners.
+
+        @param kind (str) What was extracted ("excel" or "word").
+
+        @param status (str) "ok" or "error".
+        """
+        self.kind = kind
+        self.status = status
+        self.seconds = time.perf_counter() - self._start
+        with _listeners_lock:
+            listeners = list(_listeners)
+        for func in listeners:
+            try:
+                func(self)
+            except Exception as e:
+                print("WARNING: Stats listener failed. " + str(e), file=sys.stderr)
+
+    def to_dict(self):
+        """
+        @return (dict) The stats as JSON serializable data. Times are in seconds.
+        """
+        return {
+            "kind" : self.kind,
+            "status" : self.status,
+            "seconds" : None if (self.seconds is None) else round(self.seconds, 6),
+            "stages" : dict([(name, round(seconds, 6)) for name, seconds in self.stages.items()]),
+            "counts" : dict(self.counts),
+        }
+
+####################################################################
+class _JsonLinesLog(object):
+    """
+    Listener appending the stats of every call to a file as JSON lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, stats):
+        line = json.dumps(stats.to_dict()) + "\n"
+        with self.lock:
+            f = open(self.path, "a")
+            f.write(line)
+            f.close()
+
+if (os.environ.get("OFFICE_DUMPER_STATS_LOG") is not None):
+    add_listener(_JsonLinesLog(os.environ["OFFICE_DUMPER_STATS_LOG"]))
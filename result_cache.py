@@ -0,0 +1,234 @@
+"""@package result_cache
+On-disk cache of extraction results, keyed by a hash of the input file contents and the
+extractor version. The same attachment is often seen many times, so repeat files skip the
+conversion entirely.
+
+Entries are JSON files written atomically (write to a temporary file, then rename), so
+several worker processes can share one cache directory. The cache is kept under a maximum
+size by deleting the least recently used entries.
+
+The default cache is configured with environment variables:
+
+OFFICE_DUMPER_CACHE_DIR       The cache directory. Caching is off if this is not set.
+OFFICE_DUMPER_CACHE_MAX_SIZE  The maximum cache size in bytes (default 1GB).
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Bump this whenever the output of an extractor changes so old cache entries are not used.
+EXTRACTOR_VERSION = "5"
+
+# Default maximum cache size in bytes.
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+
+# When the cache gets too big, entries are deleted until it is this fraction of the maximum.
+EVICT_TO = 0.9
+
+####################################################################
+class ResultCache(object):
+    """
+    Size limited LRU cache of extraction results in a directory.
+    """
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """
+        @param cache_dir (str) The cache directory. It is created if needed.
+
+        @param max_size (int) The maximum total size of the cache entries in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if (not os.path.isdir(cache_dir)):
+            os.makedirs(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.size = self._scan_size()
+
+    def key(self, data, kind):
+        """
+        Compute the cache key of a result.
+
+        @param data (binary blob) The input file contents.
+
+        @param kind (str) What was extracted from the file (e.g. "excel", "word_text").
+
+        @return (str) The hex cache key.
+        """
+        h = hashlib.sha256()
+        h.update(kind.encode("utf-8") + b"\0" + EXTRACTOR_VERSION.encode("utf-8") + b"\0")
+        h.update(data)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, data, kind):
+        """
+        Look up a cached result.
+
+        @param data (binary blob) The input file contents.
+
+        @param kind (str) What was extracted from the file.
+
+        @return (any) The cached result, None if it is not in the cache.
+        """
+        path = self._path(self.key(data, kind))
+        try:
+            f = open(path, "rb")
+            try:
+                r = json.loads(f.read().decode("utf-8"))
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark the entry as recently used. It may have just been evicted by another process.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return r
+
+    def put(self, data, kind, result):
+        """
+        Save a result in the cache.
+
+        @param data (binary blob) The input file contents.
+
+        @param kind (str) What was extracted from the file.
+
+        @param result (any) The result. It must be JSON serializable.
+        """
+        path = self._path(self.key(data, kind))
+        entry_dir = os.path.dirname(path)
+        if (not os.path.isdir(entry_dir)):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                pass
+
+        # Write to a temporary file and rename it so readers never see a partial entry.
+        blob = json.dumps(result).encode("utf-8")
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        try:
+            f = os.fdopen(fd, "wb")
+            f.write(blob)
+            f.close()
+
+            # An entry being replaced no longer counts towards the cache size.
+            try:
+                self.size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.stores += 1
+        self.size += len(blob)
+        if (self.size > self.max_size):
+            self.evict()
+
+    def _entries(self):
+        """
+        @return (list) (last use time, size, path) for each cache entry.
+        """
+        r = []
+        for sub_dir in os.listdir(self.cache_dir):
+            sub_path = os.path.join(self.cache_dir, sub_dir)
+            if (not os.path.isdir(sub_path)):
+                continue
+            for name in os.listdir(sub_path):
+                if (not name.endswith(".json")):
+                    continue
+                path = os.path.join(sub_path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                r.append((st.st_mtime, st.st_size, path))
+        return r
+
+    def _scan_size(self):
+        return sum([size for _, size, _ in self._entries()])
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is below its size limit.
+        """
+
+        # Only one process evicts at a time.
+        lock = open(os.path.join(self.cache_dir, ".lock"), "a")
+        try:
+            if (fcntl is not None):
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._entries()
+            self.size = sum([size for _, size, _ in entries])
+            if (self.size <= self.max_size):
+                return
+            entries.sort()
+            target = self.max_size * EVICT_TO
+            for _, size, path in entries:
+                if (self.size <= target):
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.size -= size
+                self.evictions += 1
+        finally:
+            if (fcntl is not None):
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def stats(self):
+        """
+        @return (dict) Hit/miss counters of this process and the cache size.
+        """
+        return {
+            "hits" : self.hits,
+            "misses" : self.misses,
+            "stores" : self.stores,
+            "evictions" : self.evictions,
+            "size" : self.size,
+            "max_size" : self.max_size,
+        }
+
+# The cache configured by the environment, created on first use.
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+####################################################################
+def default_cache():
+    """
+    Get the cache configured by the OFFICE_DUMPER_CACHE_DIR and OFFICE_DUMPER_CACHE_MAX_SIZE
+    environment variables.
+
+    @return (ResultCache) The cache, None if caching is not configured.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if (_default_cache is None):
+            cache_dir = os.environ.get("OFFICE_DUMPER_CACHE_DIR")
+            if (cache_dir is None):
+                return None
+            max_size = int(os.environ.get("OFFICE_DUMPER_CACHE_MAX_SIZE", DEFAULT_MAX_SIZE))
+            _default_cache = ResultCache(cache_dir, max_size)
+        return _default_cache
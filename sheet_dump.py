@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""@package sheet_dump
+Write the cells of Excel sheets to a file as they are walked, in row/column order, without
+building the whole dump in memory. Formats:
+
+text   The ExcelSheet/ExcelBook repr() format:
+           Sheet: Sheet1
+           <blank line>
+           (1, 1)<TAB>=<TAB>'value'
+jsonl  One JSON object per row: {"sheet": "Sheet1", "row": 1, "cells": [[1, "value"], ...]}
+tsv    One line per cell: sheet<TAB>row<TAB>col<TAB>value, with '\\', tabs, newlines and
+       carriage returns in the sheet name and value escaped as \\\\, \\t, \\n and \\r.
+
+This is Python 3.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+
+# Output formats.
+FORMATS = ("text", "tsv", "jsonl")
+
+# Control characters (C0 and C1, except tab, newline and carriage return) removed by
+# filter_printable().
+_NON_PRINTABLE = dict.fromkeys([c for c in range(0, 32) if (chr(c) not in "\t\n\r")] +
+                               list(range(127, 160)))
+
+# Escapes of TSV fields.
+_TSV_ESCAPES = str.maketrans({"\\" : "\\\\", "\t" : "\\t", "\n" : "\\n", "\r" : "\\r"})
+
+####################################################################
+def filter_printable(val):
+    """
+    Remove the control characters from a string, keeping tabs and line breaks.
+
+    @param val (str) The string.
+
+    @return (str) The string without control characters.
+    """
+    if val.isprintable():
+        return val
+    return val.translate(_NON_PRINTABLE)
+
+####################################################################
+class SheetWriter(object):
+    """
+    Writes sheets to a file handle one row at a time.
+    """
+
+    def __init__(self, out, fmt="text", printable=False):
+        """
+        @param out (file) Where to write, opened in text mode.
+
+        @param fmt (str) The output format, one of FORMATS.
+
+        @param printable (bool) Remove control characters from the cell values (see
+        filter_printable()).
+        """
+        if (fmt not in FORMATS):
+            raise ValueError("Unknown dump format '" + str(fmt) + "'.")
+        self.out = out
+        self.fmt = fmt
+        self.printable = printable
+
+    def write_sheet(self, sheet):
+        """
+        Write the non-empty cells of a sheet, in row/column order. Sheets that are not loaded
+        yet are not kept loaded (see ExcelSheet.iter_cells()).
+
+        @param sheet (ExcelSheet) The sheet.
+        """
+        write = self.out.write
+        name = sheet.name
+        if (self.fmt == "text"):
+            write("Sheet: " + name + "\n\n")
+        elif (self.fmt == "tsv"):
+            name = name.translate(_TSV_ESCAPES)
+        for row, cells in sheet.iter_rows(ordered=True):
+            if self.printable:
+                cells = [(col, filter_printable(val)) for col, val in cells]
+            if (self.fmt == "text"):
+                write("".join(["(%d, %d)\t=\t'%s'\n" % (row, col, val) for col, val in cells]))
+            elif (self.fmt == "tsv"):
+                prefix = name + "\t" + str(row) + "\t"
+                write("".join([prefix + str(col) + "\t" + val.translate(_TSV_ESCAPES) + "\n"
+                               for col, val in cells]))
+            else:
+                write(json.dumps({"sheet" : name, "row" : row, "cells" : cells}) + "\n")
+
+    def write_book(self, book):
+        """
+        Write all the sheets of a workbook, one after the other.
+
+        @param book (ExcelBook) The workbook.
+        """
+        for sheet in book.sheets:
+            self.write_sheet(sheet)
+            if (self.fmt == "text"):
+                self.out.write("\n")
+
+
+if __name__ == "__main__":
+
+    import excel
+    import sheet_filter
+
+    arg_parser = argparse.ArgumentParser(description="dump the cells of the sheets of an Excel file")
+    arg_parser.add_argument("file", help="the Excel file")
+    arg_parser.add_argument("-f", "--format", action="store", choices=FORMATS, default="text",
+                            help="output format (default: text)")
+    arg_parser.add_argument("-p", "--printable", action="store_true",
+                            help="remove control characters from the cell values")
+    arg_parser.add_argument("-o", "--output", action="store", default="-",
+                            help="file to write to (default: stdout)")
+    sheet_filter.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+
+    book = excel.read_excel_sheets(args.file, sheet_filter=sheet_filter.from_args(args), lazy=True)
+    if (book is None):
+        print("ERROR: Reading " + args.file + " failed.", file=sys.stderr)
+        sys.exit(1)
+    out = sys.stdout
+    if (args.output != "-"):
+        out = open(args.output, "w", encoding="utf-8", errors="surrogateescape")
+    try:
+        SheetWriter(out, args.format, args.printable).write_book(book)
+    finally:
+        if (out is not sys.stdout):
+            out.close()
+    for sheet in book.sheets:
+        if (len(sheet.truncated) > 0):
+            print("WARNING: Sheet '" + sheet.name + "' was cut short (" + ", ".join(sheet.truncated) + ").",
+                  file=sys.stderr)
@@ -0,0 +1,361 @@
+"""@package sheet_filter
+Pick which sheets of a workbook are read and cap how much of each sheet is read, so decoy
+workbooks with hundreds of filler sheets or millions of padding cells don't slow the
+extraction down:
+
+sheet_filter = sheet_filter.SheetFilter(states=["hidden", "veryHidden"], max_cells=100000)
+book = excel.load_excel_libreoffice(data, sheet_filter=sheet_filter)
+
+Sheets are picked by name or index (0 based), visibility (visible, hidden or veryHidden)
+and type (worksheet, macrosheet, chartsheet, dialogsheet). A sheet is read if its name or
+index is listed (or no names and indexes are given) and its visibility and type are
+listed (or not given). Sheets that are not picked are never read.
+
+The caps limit the rows, columns, non-empty cells and value bytes (UTF-8) kept per sheet.
+Reading a sheet stops at the first row past max_rows, or at the first cell past
+max_cells or max_bytes. Columns past max_cols are skipped. The limits that cut a sheet
+short are recorded in ExcelSheet.truncated ("rows", "cols", "cells" or "bytes").
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+
+# Visibility and type values. See xls_reader.SHEET_STATES and xlsx_reader.SHEET_REL_TYPES.
+STATES = ("visible", "hidden", "veryHidden")
+TYPES = ("worksheet", "macrosheet", "chartsheet", "dialogsheet")
+
+####################################################################
+class CellCounter(object):
+    """
+    Applies the caps of a SheetFilter to the cells of one sheet, in the order they are
+    read.
+    """
+
+    def __init__(self, sheet_filter, truncated=None):
+        """
+        @param sheet_filter (SheetFilter) The caps.
+
+        @param truncated (list) Where to add the names of the limits that were hit.
+        """
+        self.filter = sheet_filter
+        self.truncated = truncated
+        self.num_cells = 0
+        self.num_bytes = 0
+        self.done = False
+
+    def note(self, limit):
+        """
+        Record that a limit cut the sheet short.
+
+        @param limit (str) "rows", "cols", "cells" or "bytes".
+        """
+        if ((self.truncated is not None) and (limit not in self.truncated)):
+            self.truncated.append(limit)
+
+    def _stop(self, limit):
+        self.note(limit)
+        self.done = True
+        return False
+
+    def add_row(self, row):
+        """
+        @param row (int) The row about to be read, starting at 1.
+
+        @return (bool) True if the row can be read, False if reading should stop.
+        """
+        if ((self.filter.max_rows is not None) and (row > self.filter.max_rows)):
+            return self._stop("rows")
+        return True
+
+    def add(self, row, col, val):
+        """
+        Count a cell.
+
+        @param row (int) The row of the cell, starting at 1.
+
+        @param col (int) The column of the cell, starting at 1.
+
+        @param val (str) The cell value.
+
+        @return (bool) True if the cell is kept. If it is not, done is set if reading the
+        sheet should stop.
+        """
+        f = self.filter
+        if (not self.add_row(row)):
+            return False
+        if ((f.max_cols is not None) and (col > f.max_cols)):
+            self.note("cols")
+            return False
+        if ((val is None) or (len(val) == 0)):
+            return True
+        if ((f.max_cells is not None) and (self.num_cells >= f.max_cells)):
+            return self._stop("cells")
+        if (f.max_bytes is not None):
+            size = len(val.encode("utf-8", "replace"))
+            if (self.num_bytes + size > f.max_bytes):
+                return self._stop("bytes")
+            self.num_bytes += size
+        self.num_cells += 1
+        return True
+
+####################################################################
+class SheetFilter(object):
+    """
+    Which sheets of a workbook to read and how much of each.
+    """
+
+    def __init__(self, names=None, indexes=None, states=None, types=None,
+                 max_rows=None, max_cols=None, max_cells=None, max_bytes=None):
+        """
+        @param names (list) Names of the sheets to read.
+
+        @param indexes (list) Indexes (0 based) of the sheets to read.
+
+        @param states (list) Visibility of the sheets to read. See STATES.
+
+        @param types (list) Types of the sheets to read. See TYPES.
+
+        @param max_rows (int) Rows read per sheet. No limit if None.
+
+        @param max_cols (int) Columns read per sheet. No limit if None.
+
+        @param max_cells (int) Non-empty cells read per sheet. No limit if None.
+
+        @param max_bytes (int) Bytes of cell values (UTF-8) read per sheet. No limit if
+        None.
+        """
+        self.names = None if (names is None) else list(names)
+        self.indexes = None if (indexes is None) else [int(index) for index in indexes]
+        self.states = None if (states is None) else list(states)
+        self.types = None if (types is None) else list(types)
+        self.max_rows = max_rows
+        self.max_cols = max_cols
+        self.max_cells = max_cells
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return "SheetFilter(" + self.key() + ")"
+
+    def to_dict(self):
+        """
+        @return (dict) The filter as JSON serializable data, without the unset fields.
+        """
+        r = {}
+        for field in ("names", "indexes", "states", "types",
+                      "max_rows", "max_cols", "max_cells", "max_bytes"):
+            val = getattr(self, field)
+            if (val is not None):
+                r[field] = val
+        return r
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Rebuild a filter saved with to_dict().
+
+        @param d (dict) The filter fields. None for no filter.
+
+        @return (SheetFilter) The filter, None if d is None.
+        """
+        if (d is None):
+            return None
+        return cls(**d)
+
+    def to_args(self):
+        """
+        @return (list) The command line options giving this filter. See add_arguments().
+        """
+        r = []
+        for option, vals in (("--sheet", self.names), ("--sheet-index", self.indexes),
+                             ("--state", self.states), ("--type", self.types)):
+            for val in (vals or []):
+
+                # Sheet names can start with "-".
+                r.append(option + "=" + str(val))
+        for option, val in (("--max-rows", self.max_rows), ("--max-cols", self.max_cols),
+                            ("--max-cells", self.max_cells), ("--max-bytes", self.max_bytes)):
+            if (val is not None):
+                r.append(option + "=" + str(val))
+        return r
+
+    def key(self):
+        """
+        @return (str) A string identifying what the filter reads, e.g. for a cache key.
+        """
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def picks_by_sheet(self):
+        """
+        @return (bool) True if some sheets may not be read.
+        """
+        return ((self.names is not None) or (self.indexes is not None) or
+                (self.states is not None) or (self.types is not None))
+
+    def has_caps(self):
+        """
+        @return (bool) True if some sheets may not be read in full.
+        """
+        return ((self.max_rows is not None) or (self.max_cols is not None) or
+                (self.max_cells is not None) or (self.max_bytes is not None))
+
+    def selects(self, index, name, state="visible", sheet_type="worksheet"):
+        """
+        Check if a sheet is read.
+
+        @param index (int) The sheet index, starting at 0.
+
+        @param name (str) The sheet name.
+
+        @param state (str) The sheet visibility. See STATES.
+
+        @param sheet_type (str) The sheet type. See TYPES.
+
+        @return (bool) True if the sheet is read, False if it is skipped.
+        """
+        if ((self.names is not None) or (self.indexes is not None)):
+            if (not ((name in (self.names or [])) or (index in (self.indexes or [])))):
+                return False
+        if ((self.states is not None) and (state not in self.states)):
+            return False
+        if ((self.types is not None) and (sheet_type not in self.types)):
+            return False
+        return True
+
+    def for_sheets(self, sheets):
+        """
+        Pick the sheets of a workbook by name, for readers that don't know the visibility
+        or type of the sheets (e.g. LibreOffice reading an unhidden copy of the file).
+
+        @param sheets (list) The {"name", "index", "state", "type"} dicts of all the sheets.
+
+        @return (SheetFilter) A filter with the same caps picking the selected sheets by
+        name.
+        """
+        names = [sheet["name"] for sheet in sheets
+                 if self.selects(sheet["index"], sheet["name"], sheet.get("state") or "visible",
+                                 sheet.get("type") or "worksheet")]
+        return SheetFilter(names=names, max_rows=self.max_rows, max_cols=self.max_cols,
+                           max_cells=self.max_cells, max_bytes=self.max_bytes)
+
+    def by_name_and_index(self):
+        """
+        Drop the visibility and type criteria, for readers that can't tell (LibreOffice, for
+        files whose sheet list can't be read natively, e.g. .xlsb). Otherwise every sheet
+        would look visible and of type worksheet, and e.g. a filter for hidden sheets would
+        silently read nothing. A warning is printed if criteria are dropped.
+
+        @return (SheetFilter) A filter picking the same sheets by name and index, with the
+        same caps. This filter if it has no visibility or type criteria.
+        """
+        if ((self.states is None) and (self.types is None)):
+            return self
+        print("WARNING: The visibility and type of the sheets are not known, ignoring the " +
+              "sheet visibility and type filters.", file=sys.stderr)
+        return SheetFilter(names=self.names, indexes=self.indexes, max_rows=self.max_rows,
+                           max_cols=self.max_cols, max_cells=self.max_cells,
+                           max_bytes=self.max_bytes)
+
+    def counter(self, truncated=None):
+        """
+        @param truncated (list) Where to add the names of the limits that were hit.
+
+        @return (CellCounter) A counter applying the caps to the cells of one sheet.
+        """
+        return CellCounter(self, truncated)
+
+    def cap_cells(self, cells, truncated=None):
+        """
+        Apply the caps to a stream of cells, stopping as soon as a limit is hit.
+
+        @param cells (iterable) (row, col, value, formula) tuples in row order.
+
+        @param truncated (list) Where to add the names of the limits that were hit.
+
+        @return (generator) The kept (row, col, value, formula) tuples.
+        """
+        counter = self.counter(truncated)
+        for cell in cells:
+            if counter.add(cell[0], cell[1], cell[2]):
+                yield cell
+            elif counter.done:
+                break
+
+    def cap_rows(self, rows, truncated=None):
+        """
+        Apply the caps to a stream of sheet rows (e.g. read from CSV), stopping as soon as a
+        limit is hit.
+
+        @param rows (iterable) The rows of the sheet, starting at row 1. Each row is a list
+        of cell values.
+
+        @param truncated (list) Where to add the names of the limits that were hit.
+
+        @return (generator) The kept rows, cut short where needed.
+        """
+        counter = self.counter(truncated)
+        row = 0
+        for vals in rows:
+            row += 1
+            if (not counter.add_row(row)):
+                break
+            kept = []
+            for val in vals:
+                if (not counter.add(row, len(kept) + 1, val)):
+                    break
+                kept.append(val)
+            if ((not counter.done) or (len(kept) > 0)):
+                yield kept
+            if counter.done:
+                break
+
+####################################################################
+def add_arguments(arg_parser):
+    """
+    Add the sheet filter options to a command line parser.
+
+    @param arg_parser (ArgumentParser) The parser.
+    """
+    group = arg_parser.add_argument_group("sheet selection")
+    group.add_argument("--sheet", action="append", default=None, dest="sheet_names",
+                       help="only read the sheet with this name, can be given several times")
+    group.add_argument("--sheet-index", action="append", type=int, default=None, dest="sheet_indexes",
+                       help="only read the sheet with this index (0 based), can be given several times")
+    group.add_argument("--state", action="append", choices=STATES, default=None, dest="sheet_states",
+                       help="only read sheets with this visibility, can be given several times")
+    group.add_argument("--hidden", action="store_true",
+                       help="only read hidden and very hidden sheets")
+    group.add_argument("--type", action="append", choices=TYPES, default=None, dest="sheet_types",
+                       help="only read sheets of this type, can be given several times")
+    group.add_argument("--macro", action="store_true",
+                       help="only read Excel 4.0 macro sheets")
+    group.add_argument("--max-rows", action="store", type=int, default=None,
+                       help="rows read per sheet")
+    group.add_argument("--max-cols", action="store", type=int, default=None,
+                       help="columns read per sheet")
+    group.add_argument("--max-cells", action="store", type=int, default=None,
+                       help="non-empty cells read per sheet")
+    group.add_argument("--max-bytes", action="store", type=int, default=None,
+                       help="bytes of cell values read per sheet")
+
+def from_args(args):
+    """
+    Make the sheet filter given on the command line.
+
+    @param args (Namespace) The parsed arguments. See add_arguments().
+
+    @return (SheetFilter) The filter, None if no option was given.
+    """
+    states = args.sheet_states
+    if args.hidden:
+        states = (states or []) + ["hidden", "veryHidden"]
+    types = args.sheet_types
+    if args.macro:
+        types = (types or []) + ["macrosheet"]
+    r = SheetFilter(names=args.sheet_names, indexes=args.sheet_indexes, states=states, types=types,
+                    max_rows=args.max_rows, max_cols=args.max_cols, max_cells=args.max_cells,
+                    max_bytes=args.max_bytes)
+    if ((not r.picks_by_sheet()) and (not r.has_caps())):
+        return None
+    return r
@@ -0,0 +1,423 @@
+"""@package soffice
+Start and stop the headless LibreOffice processes used for document conversion. Every
+soffice process is tracked through the child process that started it, never by name, so
+conversions running side by side never stop each other's soffice.
+
+Private user profiles live on tmpfs (/dev/shm) when there is one, and are copied from a
+template profile saved by the first soffice that stopped cleanly, so soffice skips its
+first start initialization. The template is kept in a directory only the current user
+can use, or can be given with the OFFICE_DUMPER_PROFILE_TEMPLATE environment variable. A
+template that belongs to another user or that other users can change is not used.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import socket
+import shutil
+import subprocess
+import time
+import tempfile
+import threading
+
+# sudo pip3 install unotools
+# sudo apt install libreoffice-calc, python3-uno
+from unotools import Socket, connect
+from unotools import ConnectionError
+
+import limits
+import userdirs
+
+# The LibreOffice executable.
+soffice_exe = "/usr/lib/libreoffice/program/soffice.bin"
+
+# Connection information for LibreOffice.
+HOST = "127.0.0.1"
+PORT = 2002
+
+# How often a Watchdog checks on soffice, in seconds.
+WATCH_INTERVAL = 0.25
+
+# Delays between checks for the UNO API while soffice starts, in seconds. The delay doubles
+# after every check up to the maximum.
+POLL_MIN_DELAY = 0.02
+POLL_MAX_DELAY = 0.25
+
+# Where private user profiles are created. tmpfs if we have it.
+PROFILE_ROOT = None
+if (os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK)):
+    PROFILE_ROOT = "/dev/shm"
+
+# The user profile copied into new private profiles. By default it is kept in a directory
+# only the current user can use (see userdirs.private_dir()).
+DEFAULT_PROFILE_TEMPLATE = os.path.join(PROFILE_ROOT or tempfile.gettempdir(),
+                                        "office_dumper-" + str(os.getuid()), "profile_template")
+PROFILE_TEMPLATE = os.environ.get("OFFICE_DUMPER_PROFILE_TEMPLATE", DEFAULT_PROFILE_TEMPLATE)
+
+verbose = False
+
+###################################################################################################
+def is_soffice_installed():
+    """
+    Check to see if LibreOffice is installed.
+
+    @return (bool) True if the soffice executable exists, False if not.
+    """
+    return os.path.isfile(soffice_exe)
+
+###################################################################################################
+def _port_open(host, port):
+    """
+    @return (bool) True if something accepts TCP connections on the given port.
+    """
+    try:
+        s = socket.create_connection((host, port), timeout=1)
+    except socket.error:
+        return False
+    s.close()
+    return True
+
+###################################################################################################
+def wait_for_uno_api(timeout=limits.STARTUP_TIMEOUT, host=HOST, port=PORT, proc=None):
+    """
+    Wait until the libreoffice UNO api is available by the headless libreoffice process. Takes
+    a bit to spin up even after the OS reports the process as running. The port is polled with
+    a short, growing delay, and the UNO connection is only made once soffice listens.
+
+    @param timeout (float) The number of seconds to wait before giving up and throwing an
+    Exception.
+
+    @param host (str) The host soffice is listening on.
+
+    @param port (int) The port soffice is listening on.
+
+    @param proc (Popen) The soffice process. If given, an Exception is thrown as soon as it
+    exits instead of waiting for the timeout.
+
+    @return (ScriptContext) The UNO connection to soffice.
+    """
+
+    deadline = time.time() + timeout
+    delay = POLL_MIN_DELAY
+    while True:
+        if ((proc is not None) and (proc.poll() is not None)):
+            raise Exception("soffice exited with code " + str(proc.returncode) + " while starting")
+        if _port_open(host, port):
+            try:
+                return connect(Socket(host, port))
+            except ConnectionError:
+                pass
+        now = time.time()
+        if (now >= deadline):
+            break
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+    raise Exception("libreoffice UNO API failed to start")
+
+###################################################################################################
+def find_free_port(host=HOST):
+    """
+    Find a TCP port nobody is listening on, for a private soffice instance.
+
+    @param host (str) The host to check ports on.
+
+    @return (int) A free port.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+###################################################################################################
+def _template_problem():
+    """
+    Check that the profile template can only have been made by the current user. A profile
+    planted by somebody else could run macros or point soffice at their files.
+
+    @return (str) Why the template is not used, None if it can be used.
+    """
+    paths = [PROFILE_TEMPLATE]
+    if (PROFILE_TEMPLATE == DEFAULT_PROFILE_TEMPLATE):
+        paths.insert(0, os.path.dirname(PROFILE_TEMPLATE))
+    for path in paths:
+        problem = userdirs.check_private(path)
+        if (problem is not None):
+            return problem
+    return None
+
+###################################################################################################
+def save_profile_template(profile_dir):
+    """
+    Save a user profile as the template for new private profiles, unless there already is
+    one. Several processes can race to do this, only the 1st one wins.
+
+    @param profile_dir (str) A profile soffice has initialized and stopped cleanly with.
+    """
+    if os.path.lexists(PROFILE_TEMPLATE):
+        return
+    parent = os.path.dirname(PROFILE_TEMPLATE)
+    tmp_dir = None
+    try:
+        if (PROFILE_TEMPLATE == DEFAULT_PROFILE_TEMPLATE):
+            userdirs.private_dir(parent)
+        tmp_dir = tempfile.mkdtemp(prefix=".office_dumper_template_", dir=parent)
+        copy = os.path.join(tmp_dir, "profile")
+        shutil.copytree(profile_dir, copy, symlinks=True)
+        os.rename(copy, PROFILE_TEMPLATE)
+        if verbose:
+            print("SAVED PROFILE TEMPLATE " + PROFILE_TEMPLATE, file=sys.stderr)
+    except Exception as e:
+        if verbose:
+            print("NOT SAVING PROFILE TEMPLATE: " + str(e), file=sys.stderr)
+    finally:
+        if (tmp_dir is not None):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+###################################################################################################
+class SofficeInstance(object):
+    """
+    A headless soffice process with its own port and user profile, so several can run side by
+    side on one host.
+    """
+
+    def __init__(self, port=None, profile_dir=None, host=HOST):
+        """
+        @param port (int) The port soffice listens on. A free port is picked if None, and
+        picked again if it has been taken by the time soffice is (re)started.
+
+        @param profile_dir (str) The soffice user profile directory. A private directory is
+        created (and removed by stop()) if None.
+        """
+        self.host = host
+        self.pick_port = (port is None)
+        if self.pick_port:
+            port = find_free_port(host)
+        self.port = port
+        self.own_profile = (profile_dir is None)
+        if self.own_profile:
+            profile_dir = tempfile.mkdtemp(prefix="office_dumper_profile_", dir=PROFILE_ROOT)
+        self.profile_dir = profile_dir
+        self.proc = None
+        self.context = None
+
+        # Whether the profile was initialized by soffice itself rather than copied.
+        self.new_profile = False
+
+        # Startup latency.
+        self.num_starts = 0
+        self.startup_seconds = None
+        self.total_startup_seconds = 0.0
+
+    def __repr__(self):
+        return "soffice(port=" + str(self.port) + ", pid=" + str(self.pid()) + ")"
+
+    def pid(self):
+        """
+        @return (int) The PID of the soffice process, None if it was not started.
+        """
+        proc = self.proc
+        if (proc is None):
+            return None
+        return proc.pid
+
+    def is_running(self):
+        """
+        @return (bool) True if the soffice process started by this object is still running.
+        """
+        proc = self.proc
+        return ((proc is not None) and (proc.poll() is None))
+
+    def _init_profile(self):
+        """
+        Fill an empty private profile from the profile template, if there is one.
+        """
+        if (not os.path.isdir(self.profile_dir)):
+            os.makedirs(self.profile_dir)
+        if ((not self.own_profile) or (len(os.listdir(self.profile_dir)) > 0)):
+            return
+        self.new_profile = True
+        if (not os.path.isdir(PROFILE_TEMPLATE)):
+            return
+        problem = _template_problem()
+        if (problem is not None):
+            print("WARNING: Not using the soffice profile template. " + problem + ".",
+                  file=sys.stderr)
+            return
+        try:
+            os.rmdir(self.profile_dir)
+            shutil.copytree(PROFILE_TEMPLATE, self.profile_dir, symlinks=True)
+            self.new_profile = False
+        except (IOError, OSError, shutil.Error):
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            os.makedirs(self.profile_dir)
+
+    def start(self, timeout=limits.STARTUP_TIMEOUT):
+        """
+        Start soffice listening on this instance's port and connect to it.
+
+        @param timeout (float) The number of seconds soffice has to make its UNO API
+        available. Fails right away if soffice exits.
+
+        @return (ScriptContext) The UNO connection to the new soffice process.
+        """
+        if self.is_running():
+            self.stop()
+        start = time.time()
+
+        # Never connect to (and later kill) a soffice, or anything else, that another process
+        # started on our port.
+        if _port_open(self.host, self.port):
+            if (not self.pick_port):
+                raise Exception("port " + str(self.port) + " is already in use, not starting soffice")
+            self.port = find_free_port(self.host)
+        self._init_profile()
+        cmd = [soffice_exe, "--headless", "--invisible",
+               "--nocrashreport", "--nodefault", "--nofirststartwizard", "--nologo",
+               "--norestore",
+               "-env:UserInstallation=file://" + os.path.abspath(self.profile_dir),
+               "--accept=socket,host=" + self.host + ",port=" + str(self.port) + \
+               ",tcpNoDelay=1;urp;StarOffice.ComponentContext"]
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self.context = wait_for_uno_api(timeout, self.host, self.port, self.proc)
+        except Exception:
+            self.stop()
+            raise
+        self.num_starts += 1
+        self.startup_seconds = time.time() - start
+        self.total_startup_seconds += self.startup_seconds
+        if verbose:
+            print("STARTED " + str(self) + " in " + str(round(self.startup_seconds, 3)) + \
+                  " seconds", file=sys.stderr)
+        return self.context
+
+    def kill(self):
+        """
+        Kill the soffice process started by this object right away, for when it is hung. The
+        user profile is kept so the instance can be started again.
+
+        This can be called from another thread (a Watchdog or a cancelled job) while the
+        instance is being stopped or killed, so the process is only looked at through a
+        local reference.
+        """
+        self.context = None
+        proc = self.proc
+        if (proc is not None):
+            if (proc.poll() is None):
+                proc.kill()
+                proc.wait()
+            if verbose:
+                print("KILLED soffice(port=" + str(self.port) + ", pid=" + str(proc.pid) + ")",
+                      file=sys.stderr)
+            if (self.proc is proc):
+                self.proc = None
+
+    def stop(self, remove_profile=False):
+        """
+        Stop the soffice process started by this object.
+
+        @param remove_profile (bool) Also remove the user profile directory if it was created
+        by this object.
+        """
+        started = (self.context is not None)
+        self.context = None
+        proc = self.proc
+        if (proc is not None):
+
+            # Always stop the process, even if it never got as far as taking UNO
+            # connections. Only a profile soffice fully started with is worth keeping.
+            clean = False
+            if (proc.poll() is None):
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                    clean = started
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+            if verbose:
+                print("STOPPED soffice(port=" + str(self.port) + ", pid=" + str(proc.pid) + ")",
+                      file=sys.stderr)
+            if (self.proc is proc):
+                self.proc = None
+
+            # Keep a cleanly initialized profile to start the next ones faster.
+            if (clean and self.new_profile):
+                save_profile_template(self.profile_dir)
+                self.new_profile = False
+        if (remove_profile and self.own_profile):
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+###################################################################################################
+class Watchdog(object):
+    """
+    Watch the soffice instance working on a document, and kill it if the document takes too
+    long or makes soffice use too much memory. Killing soffice makes the blocked UNO calls of
+    the conversion fail, and the with block then raises limits.LimitExceeded.
+
+    with Watchdog(instance):
+        ... convert the document ...
+    """
+
+    def __init__(self, instance, timeout=None, max_memory=None):
+        """
+        @param instance (SofficeInstance) The soffice to watch. Nothing is watched if None.
+
+        @param timeout (float) The wall-clock seconds allowed. Uses limits.DOC_TIMEOUT if
+        None. 0 for no limit.
+
+        @param max_memory (int) The resident memory in bytes soffice may use. Uses
+        limits.MAX_MEMORY if None. 0 for no limit.
+        """
+        self.instance = instance
+        self.timeout = limits.DOC_TIMEOUT if (timeout is None) else timeout
+        self.max_memory = limits.MAX_MEMORY if (max_memory is None) else max_memory
+        self.reason = None
+        self.peak_memory = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _check(self, start):
+        """
+        @return (str) Why soffice has to be killed, None if it is fine.
+        """
+        if ((self.timeout > 0) and (time.time() - start > self.timeout)):
+            return "Document timed out after " + str(self.timeout) + " seconds."
+        rss = limits.process_rss(self.instance.pid())
+        if (rss is not None):
+            self.peak_memory = max(self.peak_memory, rss)
+            if ((self.max_memory > 0) and (rss > self.max_memory)):
+                return "Document used too much memory (" + str(rss) + " bytes)."
+        return None
+
+    def _watch(self):
+        start = time.time()
+        while (not self._stop.wait(WATCH_INTERVAL)):
+            if (not self.instance.is_running()):
+                return
+            reason = self._check(start)
+            if (reason is not None):
+                self.reason = reason
+                if verbose:
+                    print("KILLING " + str(self.instance) + ". " + reason, file=sys.stderr)
+                self.instance.kill()
+                return
+
+    def __enter__(self):
+        if ((self.instance is not None) and ((self.timeout > 0) or (self.max_memory > 0))):
+            self._thread = threading.Thread(target=self._watch)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if (self._thread is not None):
+            self._stop.set()
+            self._thread.join()
+        if (self.reason is not None):
+            raise limits.LimitExceeded(self.reason)
+        return False
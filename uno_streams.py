@@ -0,0 +1,109 @@
+"""@package uno_streams
+Pass documents to LibreOffice and get exports back through in-memory UNO streams, so no
+temporary files are written. This needs the LibreOffice python bindings (uno).
+"""
+
+from __future__ import print_function
+
+import uno
+import unohelper
+from com.sun.star.io import XOutputStream
+
+# URL used to load from and store to streams given in the load/store properties.
+STREAM_URL = "private:stream"
+
+###################################################################################################
+def property_values(context, *values):
+    """
+    Make the properties for loading or storing a document.
+
+    @param context (ScriptContext) The UNO connection.
+
+    @param values (list) Property names followed by their values (name1, value1, name2,
+    value2, ...).
+
+    @return (tuple) The PropertyValue structs.
+    """
+    return tuple([context.make_property_value(values[i], values[i + 1])
+                  for i in range(0, len(values) - 1, 2)])
+
+###################################################################################################
+def input_stream(context, data):
+    """
+    Make a UNO input stream reading from memory.
+
+    @param context (ScriptContext) The UNO connection.
+
+    @param data (binary blob) The stream contents.
+
+    @return (XInputStream) The stream.
+    """
+
+    # uno.ByteSequence only takes bytes.
+    if (not isinstance(data, bytes)):
+        data = bytes(data)
+    return context.service_manager.createInstanceWithArgumentsAndContext(
+        "com.sun.star.io.SequenceInputStream", (uno.ByteSequence(data),), context.raw)
+
+###################################################################################################
+def load_component(component_class, context, data):
+    """
+    Load a document from memory.
+
+    @param component_class (class) The unotools component class to load the document as
+    (Calc or Writer).
+
+    @param context (ScriptContext) The UNO connection.
+
+    @param data (binary blob) The contents of the document.
+
+    @return (object) The loaded component.
+    """
+    args = property_values(context,
+                           "InputStream", input_stream(context, data),
+                           "Hidden", True)
+    return component_class(context, STREAM_URL, arguments=args)
+
+###################################################################################################
+class OutputStream(unohelper.Base, XOutputStream):
+    """
+    UNO output stream collecting what is written to it in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def writeBytes(self, seq):
+        self.chunks.append(seq.value)
+
+    def flush(self):
+        pass
+
+    def closeOutput(self):
+        self.closed = True
+
+    def getvalue(self):
+        """
+        @return (binary blob) Everything written to the stream.
+        """
+        return b"".join(self.chunks)
+
+###################################################################################################
+def store_to_memory(component, context, *values):
+    """
+    Export a document to memory.
+
+    @param component (object) The loaded unotools component.
+
+    @param context (ScriptContext) The UNO connection.
+
+    @param values (list) The store properties as name, value pairs (e.g. "FilterName",
+    "...").
+
+    @return (binary blob) The exported data.
+    """
+    stream = OutputStream()
+    args = property_values(context, *(values + ("OutputStream", stream)))
+    component.raw.storeToURL(STREAM_URL, args)
+    return stream.getvalue()
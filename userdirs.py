@@ -0,0 +1,105 @@
+"""@package userdirs
+Private per-user directories and socket peer checks. The conversion service socket and the
+soffice profile template live in directories only the current user can use, so other local
+users can't intercept documents sent to the service or plant a soffice profile.
+"""
+
+from __future__ import print_function
+
+import os
+import stat
+import socket
+import struct
+import tempfile
+
+####################################################################
+def runtime_dir():
+    """
+    @return (str) The directory for the per-user files of office_dumper: $XDG_RUNTIME_DIR
+    if it is set, and /tmp/office_dumper-<uid> (see private_dir()) if not.
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if (runtime and os.path.isdir(runtime)):
+        return runtime
+    return os.path.join(tempfile.gettempdir(), "office_dumper-" + str(os.getuid()))
+
+####################################################################
+def check_private(path):
+    """
+    Check that a file or directory belongs to the current user and can't be changed by
+    anybody else.
+
+    @param path (str) The file or directory.
+
+    @return (str) Why it is not private, None if it is.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError as e:
+        return str(e)
+    if stat.S_ISLNK(st.st_mode):
+        return path + " is a symbolic link"
+    if (st.st_uid != os.getuid()):
+        return path + " belongs to uid " + str(st.st_uid)
+    if ((st.st_mode & 0o022) != 0):
+        return path + " can be written by other users"
+    return None
+
+####################################################################
+def private_dir(path):
+    """
+    Create a directory only the current user can use (mode 0700), or check that an
+    existing one is.
+
+    @param path (str) The directory.
+
+    @return (str) The directory. An Exception is raised if it exists and is not private.
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    problem = check_private(path)
+    if ((problem is None) and (not os.path.isdir(path))):
+        problem = path + " is not a directory"
+    if ((problem is None) and ((os.lstat(path).st_mode & 0o077) != 0)):
+        problem = path + " can be used by other users"
+    if (problem is not None):
+        raise Exception("Not using " + path + ": " + problem + ".")
+    return path
+
+####################################################################
+def peer_uid(sock):
+    """
+    Get the user id of the process at the other end of a Unix socket.
+
+    @param sock (socket) The connected Unix socket.
+
+    @return (int) The user id of the peer, None if the OS can't tell.
+    """
+    if (not hasattr(socket, "SO_PEERCRED")):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid
+
+def check_peer(sock, path):
+    """
+    Check that the other end of a Unix socket is run by the current user. Where the OS
+    can't tell, the owner of the socket file is checked instead.
+
+    @param sock (socket) The connected Unix socket.
+
+    @param path (str) The path of the socket.
+
+    @return (str) Why the peer is not trusted, None if it is.
+    """
+    uid = peer_uid(sock)
+    if (uid is None):
+        try:
+            uid = os.stat(path).st_uid
+        except OSError as e:
+            return str(e)
+    if (uid != os.getuid()):
+        return path + " is served by uid " + str(uid)
+    return None
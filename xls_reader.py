@@ -0,0 +1,476 @@
+"""@package xls_reader
+Read the cell values of Office 97-2003 (BIFF8) Excel files directly from the Workbook stream
+of the OLE container, without LibreOffice.
+"""
+
+from __future__ import print_function
+
+import struct
+
+import ole
+
+# BIFF record types.
+RT_FORMULA = 0x0006
+RT_EOF = 0x000A
+RT_FILEPASS = 0x002F
+RT_CONTINUE = 0x003C
+RT_BOUNDSHEET = 0x0085
+RT_MULRK = 0x00BD
+RT_SST = 0x00FC
+RT_LABELSST = 0x00FD
+RT_NUMBER = 0x0203
+RT_LABEL = 0x0204
+RT_BOOLERR = 0x0205
+RT_STRING = 0x0207
+RT_RK = 0x027E
+RT_BOF = 0x0809
+
+# BIFF8 version number in the BOF record.
+BIFF8_VERSION = 0x0600
+
+# Sheet visibility and type values of the BOUNDSHEET record.
+SHEET_STATES = {
+    0 : "visible",
+    1 : "hidden",
+    2 : "veryHidden",
+}
+SHEET_TYPES = {
+    0 : "worksheet",
+    1 : "macrosheet",
+    2 : "chartsheet",
+    6 : "vbmodule",
+}
+
+# Error values of cells.
+ERROR_CODES = {
+    0x00 : "#NULL!",
+    0x07 : "#DIV/0!",
+    0x0F : "#VALUE!",
+    0x17 : "#REF!",
+    0x1D : "#NAME?",
+    0x24 : "#NUM!",
+    0x2A : "#N/A",
+}
+
+####################################################################
+def iter_records(stream, pos=0):
+    """
+    Walk the BIFF records of a stream.
+
+    @param stream (binary blob) The Workbook stream.
+
+    @param pos (int) Where to start in the stream.
+
+    @return (generator) (position, record type, record data) tuples.
+    """
+    end = len(stream)
+    while (pos + 4 <= end):
+        rtype, size = struct.unpack_from("<HH", stream, pos)
+        yield (pos, rtype, stream[pos + 4 : pos + 4 + size])
+        pos += 4 + size
+
+####################################################################
+def _byte(data, pos):
+    """
+    @return (int) The unsigned byte at the given position.
+    """
+    return struct.unpack_from("<B", data, pos)[0]
+
+####################################################################
+def _decode_chars(data, is_16bit):
+    """
+    Decode the characters of a BIFF8 string.
+
+    @param data (binary blob) The character data.
+
+    @param is_16bit (bool) True if the characters are UTF-16, False if they are compressed
+    (the low byte of each UTF-16 character only).
+
+    @return (str) The decoded string.
+    """
+    if is_16bit:
+        return data.decode("utf-16-le", "replace")
+    return data.decode("latin-1")
+
+####################################################################
+def read_unicode_string(data, pos, len_size=2):
+    """
+    Read a BIFF8 XLUnicodeString (or ShortXLUnicodeString if len_size is 1) that is not
+    split over CONTINUE records.
+
+    @param data (binary blob) The record data.
+
+    @param pos (int) Where the string starts.
+
+    @param len_size (int) The size in bytes of the character count.
+
+    @return (tuple) The string and the position after it.
+    """
+    if (len_size == 1):
+        cch = _byte(data, pos)
+    else:
+        cch = struct.unpack_from("<H", data, pos)[0]
+    pos += len_size
+    flags = _byte(data, pos)
+    pos += 1
+    runs = 0
+    ext = 0
+    if (flags & 0x08):
+        runs = struct.unpack_from("<H", data, pos)[0]
+        pos += 2
+    if (flags & 0x04):
+        ext = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+    width = 2 if (flags & 0x01) else 1
+    r = _decode_chars(data[pos : pos + cch * width], (flags & 0x01))
+    pos += cch * width + runs * 4 + ext
+    return (r, pos)
+
+####################################################################
+def parse_sst(blocks):
+    """
+    Read the shared string table.
+
+    @param blocks (list) The data of the SST record followed by the data of its CONTINUE
+    records.
+
+    @return (list) The shared strings.
+    """
+    r = []
+    block_num = 0
+    data = blocks[0]
+    num_unique = struct.unpack_from("<I", data, 4)[0]
+    pos = 8
+    for _ in range(0, num_unique):
+
+        # String headers are never split, but may start in the next CONTINUE record.
+        if (pos >= len(data)):
+            block_num += 1
+            if (block_num >= len(blocks)):
+                break
+            data = blocks[block_num]
+            pos = 0
+        cch = struct.unpack_from("<H", data, pos)[0]
+        flags = _byte(data, pos + 2)
+        pos += 3
+        runs = 0
+        ext = 0
+        if (flags & 0x08):
+            runs = struct.unpack_from("<H", data, pos)[0]
+            pos += 2
+        if (flags & 0x04):
+            ext = struct.unpack_from("<I", data, pos)[0]
+            pos += 4
+
+        # The characters may be split over CONTINUE records. Each CONTINUE starts with a
+        # byte saying whether the rest of the characters are compressed.
+        is_16bit = (flags & 0x01)
+        parts = []
+        remaining = cch
+        while True:
+            width = 2 if is_16bit else 1
+            n = min(remaining, (len(data) - pos) // width)
+            parts.append(_decode_chars(data[pos : pos + n * width], is_16bit))
+            pos += n * width
+            remaining -= n
+            if (remaining == 0):
+                break
+            block_num += 1
+            if (block_num >= len(blocks)):
+                break
+            data = blocks[block_num]
+            is_16bit = (_byte(data, 0) & 0x01)
+            pos = 1
+        r.append("".join(parts))
+
+        # Skip the formatting runs and the extended string data.
+        skip = runs * 4 + ext
+        while (skip > 0):
+            avail = len(data) - pos
+            if (skip <= avail):
+                pos += skip
+                break
+            skip -= avail
+            block_num += 1
+            if (block_num >= len(blocks)):
+                break
+            data = blocks[block_num]
+            pos = 0
+    return r
+
+####################################################################
+def rk_value(rk):
+    """
+    Decode an RK number.
+
+    @param rk (int) The RK value, as a signed 32 bit int.
+
+    @return (float or int) The number.
+    """
+    if (rk & 0x02):
+        val = rk >> 2
+    else:
+        val = struct.unpack("<d", struct.pack("<Q", (rk & 0xFFFFFFFC) << 32))[0]
+    if (rk & 0x01):
+        val = val / 100.0
+    return val
+
+####################################################################
+def format_number(val):
+    """
+    Convert a cell number to a string, without a trailing '.0' for whole numbers.
+
+    @param val (float or int) The number.
+
+    @return (str) The number as a string.
+    """
+    try:
+        if ((val == int(val)) and (abs(val) < 1e16)):
+            return str(int(val))
+    except (ValueError, OverflowError):
+        pass
+    return repr(val)
+
+####################################################################
+class XlsWorkbook(object):
+    """
+    Office 97-2003 Excel workbook read straight from the Workbook stream.
+    """
+
+    def __init__(self, data):
+        """
+        @param data (binary blob) The contents of the .xls file.
+        """
+        self.ole = ole.OleFile(data)
+        self.stream = self.ole.read_stream("Workbook")
+        if (self.stream is None):
+            raise ValueError("No BIFF8 Workbook stream found.")
+
+        # Make sure this is a BIFF8 workbook.
+        records = iter_records(self.stream)
+        first = next(records, None)
+        if ((first is None) or (first[1] != RT_BOF) or (len(first[2]) < 2) or
+            (struct.unpack_from("<H", first[2], 0)[0] != BIFF8_VERSION)):
+            raise ValueError("Workbook stream is not BIFF8.")
+
+        # Read the sheet list and the shared strings from the workbook globals.
+        self.sheets = []
+        self.shared_strings = []
+        sst_blocks = None
+        for _, rtype, rdata in records:
+            if (rtype == RT_EOF):
+                break
+            if (rtype == RT_FILEPASS):
+                raise ValueError("Workbook is encrypted.")
+            if ((sst_blocks is not None) and (rtype != RT_CONTINUE)):
+                self.shared_strings = parse_sst(sst_blocks)
+                sst_blocks = None
+            if (rtype == RT_SST):
+                sst_blocks = [rdata]
+            elif ((rtype == RT_CONTINUE) and (sst_blocks is not None)):
+                sst_blocks.append(rdata)
+            elif (rtype == RT_BOUNDSHEET):
+                offset = struct.unpack_from("<I", rdata, 0)[0]
+                state = _byte(rdata, 4) & 0x03
+                sheet_type = _byte(rdata, 5)
+                name, _ = read_unicode_string(rdata, 6, 1)
+                if (sheet_type == 6):
+                    continue
+                self.sheets.append({
+                    "name" : name,
+                    "index" : len(self.sheets),
+                    "state" : SHEET_STATES.get(state, "hidden"),
+                    "type" : SHEET_TYPES.get(sheet_type),
+                    "offset" : offset,
+                })
+        if (sst_blocks is not None):
+            self.shared_strings = parse_sst(sst_blocks)
+
+    def iter_cells(self, sheet, formulas=False):
+        """
+        Stream the non-empty cells of a sheet.
+
+        @param sheet (dict) The sheet info from the sheets list.
+
+        @param formulas (bool) If True return (row, col, value, formula) tuples like
+        xlsx_reader.XlsxWorkbook.iter_cells(). BIFF8 formulas are stored as parsed tokens
+        and are not decompiled, so formula is always None.
+
+        @return (generator) (row, col, value) tuples, rows and columns starting at 1.
+        """
+        if formulas:
+            return ((row, col, val, None) for row, col, val in self.iter_cells(sheet))
+        return self._iter_cells(sheet)
+
+    def _iter_cells(self, sheet):
+        depth = 0
+        pending_string = None
+        for _, rtype, rdata in iter_records(self.stream, sheet["offset"]):
+
+            # Skip embedded substreams (charts).
+            if (rtype == RT_BOF):
+                depth += 1
+                continue
+            if (rtype == RT_EOF):
+                depth -= 1
+                if (depth <= 0):
+                    break
+                continue
+            if (depth != 1):
+                continue
+
+            # The string result of a formula is in the STRING record after it.
+            if (rtype == RT_STRING):
+                if (pending_string is not None):
+                    val, _ = read_unicode_string(rdata, 0)
+                    if (len(val) > 0):
+                        yield (pending_string[0], pending_string[1], val)
+                    pending_string = None
+                continue
+
+            if (rtype in (RT_LABELSST, RT_NUMBER, RT_RK, RT_LABEL, RT_BOOLERR, RT_FORMULA, RT_MULRK)):
+                pending_string = None
+            else:
+                continue
+            row, col = struct.unpack_from("<HH", rdata, 0)
+            row += 1
+            col += 1
+            val = None
+            if (rtype == RT_LABELSST):
+                index = struct.unpack_from("<I", rdata, 6)[0]
+                if (index < len(self.shared_strings)):
+                    val = self.shared_strings[index]
+            elif (rtype == RT_NUMBER):
+                val = format_number(struct.unpack_from("<d", rdata, 6)[0])
+            elif (rtype == RT_RK):
+                val = format_number(rk_value(struct.unpack_from("<i", rdata, 6)[0]))
+            elif (rtype == RT_LABEL):
+                val, _ = read_unicode_string(rdata, 6)
+            elif (rtype == RT_BOOLERR):
+                val = self._bool_or_error(_byte(rdata, 6), _byte(rdata, 7))
+            elif (rtype == RT_MULRK):
+                num = (len(rdata) - 6) // 6
+                for i in range(0, num):
+                    rk = struct.unpack_from("<i", rdata, 4 + i * 6 + 2)[0]
+                    yield (row, col + i, format_number(rk_value(rk)))
+                continue
+            elif (rtype == RT_FORMULA):
+                result = rdata[6:14]
+                if (result[6:8] != b"\xff\xff"):
+                    val = format_number(struct.unpack("<d", result)[0])
+                else:
+                    result_type = _byte(result, 0)
+                    if (result_type == 0):
+                        pending_string = (row, col)
+                    elif (result_type in (1, 2)):
+                        val = self._bool_or_error(_byte(result, 2), result_type - 1)
+            if ((val is not None) and (len(val) > 0)):
+                yield (row, col, val)
+
+    def _bool_or_error(self, val, is_error):
+        """
+        Convert a boolean or error cell value to a string.
+        """
+        if is_error:
+            return ERROR_CODES.get(val, "#N/A")
+        return "TRUE" if val else "FALSE"
+
+    def close(self):
+        pass
+
+####################################################################
+def _read_stream_bytes(buf, offsets, sector_size, pos, size):
+    """
+    Read bytes of a stream directly from the OLE file, without reading the whole stream.
+
+    @param buf (bytearray) The contents of the OLE file.
+
+    @param offsets (list) The file offsets of the stream sectors (see
+    ole.OleFile.stream_offsets()).
+
+    @param sector_size (int) The size of the stream sectors.
+
+    @param pos (int) Where to start reading in the stream.
+
+    @param size (int) The number of bytes to read.
+
+    @return (binary blob) The data read.
+    """
+    r = []
+    while (size > 0):
+        sect = pos // sector_size
+        if (sect >= len(offsets)):
+            raise ValueError("Read past the end of the Workbook stream.")
+        start = offsets[sect] + pos % sector_size
+        n = min(size, sector_size - pos % sector_size)
+        r.append(bytes(buf[start : start + n]))
+        pos += n
+        size -= n
+    return b"".join(r)
+
+####################################################################
+def unhide_sheets(buf):
+    """
+    Make the hidden and very hidden sheets of an Office 97-2003 workbook visible. Only the
+    BOUNDSHEET records of the workbook globals are read, and the visibility byte of each
+    hidden sheet is patched where it is in the file.
+
+    @param buf (bytearray) The contents of the .xls file. It is changed in place.
+
+    @return (list) The sheet info dicts ("name", "index", "state", "type") of the sheets
+    that were hidden.
+    """
+    ole_file = ole.OleFile(buf)
+    entry = ole_file.find_entry("Workbook")
+    if (entry is None):
+        raise ValueError("No BIFF8 Workbook stream found.")
+    offsets, sector_size = ole_file.stream_offsets(entry)
+
+    r = []
+    index = 0
+    pos = 0
+    while (pos + 4 <= entry.size):
+        rtype, size = struct.unpack("<HH", _read_stream_bytes(buf, offsets, sector_size, pos, 4))
+        if ((pos == 0) and (rtype != RT_BOF)):
+            raise ValueError("Workbook stream is not BIFF8.")
+
+        # The rest of the BOUNDSHEET records are encrypted in encrypted workbooks.
+        if (rtype in (RT_EOF, RT_FILEPASS)):
+            break
+        if (rtype == RT_BOUNDSHEET):
+            rdata = _read_stream_bytes(buf, offsets, sector_size, pos + 4, size)
+            state = _byte(rdata, 4)
+            sheet_type = _byte(rdata, 5)
+            if (sheet_type == 6):
+                pos += 4 + size
+                continue
+            if ((state & 0x03) != 0):
+                name, _ = read_unicode_string(rdata, 6, 1)
+                r.append({
+                    "name" : name,
+                    "index" : index,
+                    "state" : SHEET_STATES.get(state & 0x03, "hidden"),
+                    "type" : SHEET_TYPES.get(sheet_type),
+                })
+                state_pos = pos + 4 + 4
+                file_pos = offsets[state_pos // sector_size] + state_pos % sector_size
+                buf[file_pos] = state & ~0x03
+            index += 1
+        pos += 4 + size
+    return r
+
+####################################################################
+def is_xls_data(data):
+    """
+    Check to see if the given data looks like an Office 97-2003 Excel file.
+
+    @param data (binary blob) The file contents.
+
+    @return (bool) True if it is an OLE file with a Workbook stream, False if not.
+    """
+    if (not data.startswith(ole.OLE_MAGIC)):
+        return False
+    try:
+        return (ole.OleFile(data).find_entry("Workbook") is not None)
+    except Exception:
+        return False
@@ -0,0 +1,399 @@
+"""@package xlsx_reader
+Read the cell values of Office 2007+ Excel files (.xlsx/.xlsm) directly from the ZIP
+container, without LibreOffice. Sheet XML is parsed incrementally so only the shared
+strings table is held in memory.
+"""
+
+from __future__ import print_function
+
+import io
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import ooxml
+import xls_reader
+
+# Relationship types of the parts we care about, without the (transitional or strict)
+# namespace prefix.
+REL_SHARED_STRINGS = "/sharedStrings"
+SHEET_REL_TYPES = {
+    "/worksheet" : "worksheet",
+    "/xlMacrosheet" : "macrosheet",
+    "/xlIntlMacrosheet" : "macrosheet",
+    "/dialogsheet" : "dialogsheet",
+    "/chartsheet" : "chartsheet",
+}
+
+# Cell references look like "AB12".
+_cell_ref_pat = re.compile(r"^\$?([A-Za-z]+)\$?(\d+)$")
+
+# Cell references in formulas, and the parts of formulas that are not references (string
+# literals, quoted sheet names and structured table references).
+_formula_ref_pat = re.compile(r"(?<![A-Za-z0-9_.$])(\$?)([A-Za-z]{1,3})(\$?)(\d+)(?![A-Za-z0-9_.(])")
+_formula_literal_pat = re.compile(r"\"(?:[^\"]|\"\")*\"|'(?:[^']|'')*'|\[[^\]]*\]")
+
+# The largest row and column numbers of a sheet.
+MAX_ROW = 1048576
+MAX_COL = 16384
+
+# <sheet> tags of the workbook part and their hidden state attribute.
+_sheet_tag_pat = re.compile(br"<(?:[\w.-]+:)?sheet\s[^>]*>")
+_hidden_state_pat = re.compile(br"""(\sstate\s*=\s*)(["'])(?:hidden|veryHidden)\2""")
+
+####################################################################
+def parse_cell_ref(ref):
+    """
+    Convert an A1 style cell reference to a (row, col) tuple.
+
+    @param ref (str) The cell reference (e.g. "B3").
+
+    @return (tuple) The 1 based (row, col) of the cell, None if the reference is bad.
+    """
+    m = _cell_ref_pat.match(ref)
+    if (m is None):
+        return None
+    col = 0
+    for c in m.group(1).upper():
+        col = col * 26 + (ord(c) - ord('A') + 1)
+    return (int(m.group(2)), col)
+
+def col_name(col):
+    """
+    Convert a column number to its letters.
+
+    @param col (int) The 1 based column number.
+
+    @return (str) The column letters (e.g. "AB").
+    """
+    r = ""
+    while (col > 0):
+        col, rem = divmod(col - 1, 26)
+        r = chr(ord('A') + rem) + r
+    return r
+
+def _shift_refs(text, rows, cols):
+    """
+    Move the relative cell references of a piece of formula text.
+    """
+    def shift(m):
+        col_abs, letters, row_abs, row = m.groups()
+        col = parse_cell_ref(letters + "1")[1]
+        if (col > MAX_COL):
+
+            # Not a cell reference (e.g. a defined name).
+            return m.group(0)
+        row = int(row)
+        if (not col_abs):
+            col += cols
+        if (not row_abs):
+            row += rows
+        if ((row < 1) or (row > MAX_ROW) or (col < 1) or (col > MAX_COL)):
+            return "#REF!"
+        return col_abs + col_name(col) + row_abs + str(row)
+    return _formula_ref_pat.sub(shift, text)
+
+def shift_formula(formula, rows, cols):
+    """
+    Translate a formula copied to another cell, the way Excel fills in the cells sharing
+    the formula of another cell: relative references move by the same number of rows and
+    columns, absolute ($) references stay.
+
+    @param formula (str) The formula text.
+
+    @param rows (int) The number of rows the formula is moved down.
+
+    @param cols (int) The number of columns the formula is moved right.
+
+    @return (str) The formula of the other cell.
+    """
+    if ((rows == 0) and (cols == 0)):
+        return formula
+    r = []
+    pos = 0
+    for m in _formula_literal_pat.finditer(formula):
+        r.append(_shift_refs(formula[pos:m.start()], rows, cols))
+        r.append(m.group(0))
+        pos = m.end()
+    r.append(_shift_refs(formula[pos:], rows, cols))
+    return "".join(r)
+
+####################################################################
+def _join_text(elem):
+    """
+    Get the text of a shared or inline string, skipping phonetic runs.
+
+    @param elem (Element) The <si> or <is> element.
+
+    @return (str) The string value.
+    """
+    r = []
+    for child in elem:
+        name = ooxml.local_name(child.tag)
+        if (name == "t"):
+            r.append(child.text or "")
+        elif (name == "r"):
+            for run_child in child:
+                if (ooxml.local_name(run_child.tag) == "t"):
+                    r.append(run_child.text or "")
+    return "".join(r)
+
+####################################################################
+class XlsxWorkbook(object):
+    """
+    Office 2007+ Excel workbook read straight from the ZIP container.
+    """
+
+    def __init__(self, data):
+        """
+        @param data (binary blob) The contents of the .xlsx/.xlsm file.
+        """
+        self.package = ooxml.OoxmlPackage(data)
+        self.names = self.package.names
+
+        # Find the workbook part.
+        self.workbook_path = self.package.main_part("xl/workbook.xml")
+        if (self.workbook_path is None):
+            raise ValueError("No workbook part found.")
+        if (not self.workbook_path.endswith(".xml")):
+            raise ValueError("Workbook part " + self.workbook_path + " is not XML.")
+
+        # Read the workbook relationships.
+        self.rels = {}
+        self.shared_strings_path = None
+        for rel_id, rel_type, target in self.package.read_rels(self.workbook_path):
+            self.rels[rel_id] = (rel_type, target)
+            if rel_type.endswith(REL_SHARED_STRINGS):
+                self.shared_strings_path = target
+
+        # Read the sheet list, including the hidden ones.
+        self.sheets = self._read_sheet_list()
+        self._shared_strings = None
+
+    def _read_sheet_list(self):
+        """
+        Read the names, visibility and parts of the sheets from the workbook part.
+
+        @return (list) One dict per sheet with the sheet "name", "index", "state" (visible,
+        hidden or veryHidden), "type" (worksheet, macrosheet, ...) and "path" of its part.
+        """
+        r = []
+        for _, elem in ET.iterparse(self.package.open(self.workbook_path)):
+            if (ooxml.local_name(elem.tag) != "sheet"):
+                continue
+            rel_id = ooxml.get_attrib(elem, "id")
+            rel_type, path = self.rels.get(rel_id, ("", None))
+            sheet_type = None
+            for suffix in SHEET_REL_TYPES.keys():
+                if rel_type.endswith(suffix):
+                    sheet_type = SHEET_REL_TYPES[suffix]
+            r.append({
+                "name" : elem.get("name", "Sheet" + str(len(r) + 1)),
+                "index" : len(r),
+                "state" : elem.get("state", "visible"),
+                "type" : sheet_type,
+                "path" : path,
+            })
+            elem.clear()
+        return r
+
+    def shared_strings(self):
+        """
+        @return (list) The shared strings table of the workbook.
+        """
+        if (self._shared_strings is None):
+            self._shared_strings = []
+            if ((self.shared_strings_path is not None) and
+                (self.shared_strings_path in self.names)):
+                for _, elem in ET.iterparse(self.package.open(self.shared_strings_path)):
+                    if (ooxml.local_name(elem.tag) == "si"):
+                        self._shared_strings.append(_join_text(elem))
+                        elem.clear()
+        return self._shared_strings
+
+    def _cell_value(self, cell):
+        """
+        Get the displayable value of a <c> element.
+
+        @param cell (Element) The cell element.
+
+        @return (str) The cell value, None if the cell has no value.
+        """
+        typ = cell.get("t", "n")
+        if (typ == "inlineStr"):
+            for child in cell:
+                if (ooxml.local_name(child.tag) == "is"):
+                    return _join_text(child)
+            return None
+        val = None
+        for child in cell:
+            if (ooxml.local_name(child.tag) == "v"):
+                val = child.text
+                break
+        if (val is None):
+            return None
+        if (typ == "s"):
+            strings = self.shared_strings()
+            try:
+                return strings[int(val)]
+            except (ValueError, IndexError):
+                return None
+        if (typ == "b"):
+            return "TRUE" if (val.strip() == "1") else "FALSE"
+        if (typ == "n"):
+
+            # Format numbers like the .xls reader and LibreOffice ("-486", not "-486.0").
+            try:
+                return xls_reader.format_number(float(val))
+            except ValueError:
+                return val
+        return val
+
+    def _cell_formula(self, cell, row, col, shared):
+        """
+        Get the formula of a <c> element.
+
+        @param cell (Element) The cell element.
+
+        @param row (int) The row of the cell.
+
+        @param col (int) The column of the cell.
+
+        @param shared (dict) The shared formulas of the sheet seen so far, as (row, col,
+        formula) of the cell holding the formula text by shared formula index. Updated.
+
+        @return (str) The formula, None if the cell has no formula. Cells sharing the
+        formula of another cell (t="shared" with no text) get that formula with its
+        relative references moved to the cell.
+        """
+        for child in cell:
+            if (ooxml.local_name(child.tag) != "f"):
+                continue
+            si = child.get("si") if (child.get("t") == "shared") else None
+            if child.text:
+                if (si is not None):
+                    shared[si] = (row, col, child.text)
+                return "=" + child.text
+            if (si in shared):
+                master_row, master_col, formula = shared[si]
+                return "=" + shift_formula(formula, row - master_row, col - master_col)
+        return None
+
+    def iter_cells(self, sheet, formulas=False):
+        """
+        Stream the non-empty cells of a sheet.
+
+        @param sheet (dict) The sheet info from the sheets list.
+
+        @param formulas (bool) If True also return the formulas of the cells.
+
+        @return (generator) (row, col, value) tuples, rows and columns starting at 1. If
+        formulas is True (row, col, value, formula) tuples are returned instead, formula
+        being None for cells without a formula. Formula cells with no value are included.
+        """
+        path = sheet["path"]
+        if ((path is None) or (path not in self.names)):
+            return
+        row = 0
+        col = 0
+        sheet_data = None
+        shared = {}
+        for event, elem in ET.iterparse(self.package.open(path), events=("start", "end")):
+            name = ooxml.local_name(elem.tag)
+            if (event == "start"):
+                if (name == "sheetData"):
+                    sheet_data = elem
+                elif (name == "row"):
+                    r = elem.get("r")
+                    row = int(r) if ((r is not None) and r.isdigit()) else (row + 1)
+                    col = 0
+                continue
+            if (name == "c"):
+                ref = elem.get("r")
+                pos = parse_cell_ref(ref) if (ref is not None) else None
+                if (pos is not None):
+                    row, col = pos
+                else:
+                    col += 1
+                val = self._cell_value(elem)
+                if formulas:
+                    formula = self._cell_formula(elem, row, col, shared)
+                    if ((formula is not None) or ((val is not None) and (len(val) > 0))):
+                        yield (row, col, val or "", formula)
+                elif ((val is not None) and (len(val) > 0)):
+                    yield (row, col, val)
+                elem.clear()
+            elif (name == "row"):
+
+                # Drop the finished row so memory use doesn't grow with the sheet.
+                elem.clear()
+                if (sheet_data is not None):
+                    sheet_data.clear()
+
+    def close(self):
+        self.package.close()
+
+####################################################################
+def _make_visible(match):
+    """
+    Set the state attribute of a matched <sheet> tag to visible.
+    """
+    return _hidden_state_pat.sub(br"\1\2visible\2", match.group(0))
+
+####################################################################
+def unhide_sheets(data):
+    """
+    Make the hidden and very hidden sheets of an Office 2007+ workbook visible. Only the
+    workbook part is rewritten, the other parts of the ZIP file are kept as they are.
+
+    @param data (binary blob) The contents of the .xlsx/.xlsm file.
+
+    @return (tuple) The new file contents and the sheet info dicts (see
+    XlsxWorkbook.sheets) of the sheets that were hidden.
+    """
+    workbook = XlsxWorkbook(data)
+    try:
+        hidden = [sheet for sheet in workbook.sheets if (sheet["state"] != "visible")]
+        if (len(hidden) == 0):
+            return (data, hidden)
+        path = workbook.workbook_path
+        xml = workbook.package.zip.read(path)
+    finally:
+        workbook.close()
+    new_xml = _sheet_tag_pat.sub(_make_visible, xml)
+
+    # Drop the old workbook part from the ZIP directory and append the new one. The
+    # entries of the other parts are not touched.
+    f = io.BytesIO(data)
+    z = zipfile.ZipFile(f, "a")
+    info = z.getinfo(path)
+    z.filelist.remove(info)
+    del z.NameToInfo[path]
+    new_info = zipfile.ZipInfo(path, info.date_time)
+    new_info.compress_type = zipfile.ZIP_DEFLATED
+    new_info.external_attr = info.external_attr
+    z.writestr(new_info, new_xml)
+    z.close()
+    return (f.getvalue(), hidden)
+
+####################################################################
+def is_xlsx_data(data):
+    """
+    Check to see if the given data looks like a ZIP based Excel file.
+
+    @param data (binary blob) The file contents.
+
+    @return (bool) True if it is a ZIP file with a workbook part, False if not.
+    """
+    if (not data.startswith(b"PK\x03\x04")):
+        return False
+    try:
+        z = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipfile:
+        return False
+    names = z.namelist()
+    z.close()
+    for name in names:
+        if (name.startswith("xl/workbook.")):
+            return True
+    return False